@@ -0,0 +1,160 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import shlex
+import subprocess
+import tarfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+REMOTE_MANIFEST_NAME = ".deploy-manifest.json"
+IGNORED_NAMES = {".git", "node_modules", "__pycache__"}
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArtifactSyncError(Exception):
+    pass
+
+
+class TransferStats:
+    def __init__(self, files_total=0, files_sent=0, bytes_total=0, bytes_sent=0):
+        self.files_total = files_total
+        self.files_sent = files_sent
+        # bytes_total is what a full uncompressed copy would send; bytes_sent is what went over the wire
+        self.bytes_total = bytes_total
+        self.bytes_sent = bytes_sent
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_total - self.bytes_sent
+
+    def merge(self, other):
+        return TransferStats(self.files_total + other.files_total, self.files_sent + other.files_sent,
+                             self.bytes_total + other.bytes_total, self.bytes_sent + other.bytes_sent)
+
+    def describe(self):
+        saved = 100 * self.bytes_saved / self.bytes_total if self.bytes_total else 0
+        return (f"{self.files_sent}/{self.files_total} artifacts sent, {self.bytes_sent:,} of {self.bytes_total:,} bytes "
+                f"({saved:.0f}% saved)")
+
+
+class _CountingWriter:
+    def __init__(self, channel):
+        self.channel = channel
+        self.written = 0
+
+    def write(self, data):
+        self.channel.sendall(data)
+        self.written += len(data)
+        return len(data)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_manifest(paths):
+    # Relative path -> content hash and size for every file under the given files and directories
+    manifest = {}
+    for path in paths:
+        files = [path] if os.path.isfile(path) else []
+        for root, directories, names in os.walk(path):
+            directories[:] = sorted(name for name in directories if name not in IGNORED_NAMES)
+            files.extend(os.path.join(root, name) for name in sorted(names) if name not in IGNORED_NAMES)
+        for file_path in files:
+            manifest[os.path.normpath(file_path)] = {"sha256": file_digest(file_path), "size": os.path.getsize(file_path)}
+    return manifest
+
+
+class ArtifactSync:
+    def __init__(self, server, remote_dir):
+        self.server = server
+        self.remote_dir = remote_dir
+
+    @property
+    def remote_manifest_path(self):
+        return f"{self.remote_dir.rstrip('/')}/{REMOTE_MANIFEST_NAME}"
+
+    def remote_manifest(self):
+        [(exit_status, output)] = self.server.execute_commands([f"cat {shlex.quote(self.remote_manifest_path)}"], check=False)
+        if exit_status != 0:
+            return {}
+        try:
+            return json.loads(output)
+        except ValueError:
+            logger.warning(f"Ignoring unreadable deploy manifest on {self.server.ip}.")
+            return {}
+
+    def _run_with_stdin(self, command, produce):
+        # Streams produce(writer) into the command's stdin on a channel of the shared session
+        channel = self.server.open_channel()
+        channel.exec_command(command)
+        writer = _CountingWriter(channel)
+        produce(writer)
+        channel.shutdown_write()
+        error = channel.makefile_stderr("rb").read().decode(errors="replace")
+        exit_status = channel.recv_exit_status()
+        channel.close()
+        if exit_status != 0:
+            raise ArtifactSyncError(f"'{command}' on {self.server.ip} exited with {exit_status}: {error.strip()}")
+        return writer.written
+
+    def sync(self, paths):
+        # Only files whose hash differs from the remote manifest are sent, as one gzipped tar stream
+        # that also carries the updated manifest; remote files that are no longer local are left in place
+        local = local_manifest(paths)
+        remote = self.remote_manifest()
+        changed = [path for path, entry in local.items() if remote.get(path, {}).get("sha256") != entry["sha256"]]
+        stats = TransferStats(files_total=len(local), bytes_total=sum(entry["size"] for entry in local.values()))
+        if not changed:
+            logger.info(f"All {len(local)} artifacts already current on {self.server.ip}.")
+            return stats
+
+        manifest = json.dumps({**remote, **local}, indent=2, sort_keys=True).encode()
+
+        def produce(writer):
+            with tarfile.open(fileobj=writer, mode="w|gz") as archive:
+                for path in changed:
+                    archive.add(path, arcname=path, recursive=False)
+                info = tarfile.TarInfo(REMOTE_MANIFEST_NAME)
+                info.size = len(manifest)
+                archive.addfile(info, io.BytesIO(manifest))
+
+        remote_dir = shlex.quote(self.remote_dir)
+        stats.bytes_sent = self._run_with_stdin(f"mkdir -p {remote_dir} && tar -xzf - -C {remote_dir}", produce)
+        stats.files_sent = len(changed)
+        logger.info(f"Synced to {self.server.ip}: {stats.describe()}.")
+        return stats
+
+    def ship_image(self, image):
+        # docker save | gzip straight into docker load on the host, unless it already has this exact image
+        image_id, image_size = subprocess.run(["docker", "image", "inspect", "--format", "{{.Id}} {{.Size}}", image],
+                                              capture_output=True, text=True, check=True).stdout.split()
+        [(exit_status, remote_id)] = self.server.execute_commands(
+            [f"docker image inspect --format '{{{{.Id}}}}' {shlex.quote(image)}"], check=False)
+        if exit_status == 0 and remote_id.strip() == image_id:
+            logger.info(f"Image '{image}' already present on {self.server.ip}, not shipping it.")
+            return TransferStats(files_total=1, bytes_total=int(image_size))
+
+        stats = TransferStats(files_total=1, files_sent=1)
+
+        def produce(writer):
+            save = subprocess.Popen(["docker", "save", image], stdout=subprocess.PIPE)
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            for chunk in iter(lambda: save.stdout.read(CHUNK_SIZE), b""):
+                stats.bytes_total += len(chunk)
+                writer.write(compressor.compress(chunk))
+            writer.write(compressor.flush())
+            if save.wait() != 0:
+                raise ArtifactSyncError(f"docker save {image} exited with {save.returncode}")
+
+        stats.bytes_sent = self._run_with_stdin("gunzip | docker load", produce)
+        logger.info(f"Shipped image '{image}' to {self.server.ip}: {stats.describe()}.")
+        return stats
@@ -0,0 +1,55 @@
+import argparse
+import json
+import logging
+from bulk_updater import BulkClaimUpdater
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+from payment_gateway_server import EXPIRED_CLAIMS, claims_to_attributes
+
+# Measures bulk claim update throughput against a local fake Keycloak at several pool sizes
+
+
+def run_benchmark(users, workers, latency, rate_limit):
+    fake = FakeKeycloak(latency=latency).start()
+    try:
+        user_ids = [fake.add_user(f"user{i}", attributes={'tier': ['basic'], 'expiration_date': ['2020-01-01T00:00:00']})
+                    for i in range(users)]
+        client = KeycloakAdminClient(fake.url, fake.realm, client_id='gateway', client_secret='secret', pool_size=workers)
+
+        def update(user_id, claims):
+            # The gateway's read-modify-write of the attribute map, so each update is a GET and a PUT
+            attributes = claims_to_attributes(client.get(f"/users/{user_id}").json().get('attributes'), claims)
+            return client.put(f"/users/{user_id}", json={'attributes': attributes}).status_code == 204
+
+        updater = BulkClaimUpdater(update, max_workers=workers, rate_limit=rate_limit)
+        result = updater.run((user_id, EXPIRED_CLAIMS) for user_id in user_ids)
+        client.close()
+        # Checked on the fake's state, since a 204 alone does not show the attributes changed
+        downgraded = sum('expiration_date' not in fake.users[user_id]['attributes'] for user_id in user_ids)
+        return {
+            'workers': workers,
+            'users': users,
+            'succeeded': result.succeeded,
+            'downgraded': downgraded,
+            'failed': len(result.failures),
+            'elapsed_seconds': round(result.elapsed, 3),
+            'updates_per_second': round(result.throughput, 1)
+        }
+    finally:
+        fake.stop()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark bulk claim updates against a fake Keycloak.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.02, help="Injected latency per request in seconds")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Maximum updates per second")
+    args = parser.parse_args()
+
+    results = [run_benchmark(args.users, workers, args.latency, args.rate_limit) for workers in args.workers]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
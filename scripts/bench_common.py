@@ -0,0 +1,6 @@
+# Helpers shared by the bench_* scripts
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
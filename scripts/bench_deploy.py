@@ -0,0 +1,96 @@
+import argparse
+import functools
+import json
+import logging
+import os
+import tempfile
+import time
+import deploy_to_vs_server as deploy
+from fake_ssh_server import FakeSSHServer
+
+# Measures multi-host deploy wall time against local fake SSH servers, checks that each host
+# is served by a single SSH connection, and compares bytes sent by a first and a repeat deploy
+
+
+def write_theme(files, size):
+    os.makedirs(deploy.THEME_ARTIFACTS, exist_ok=True)
+    for i in range(files):
+        with open(os.path.join(deploy.THEME_ARTIFACTS, f"asset{i}.css"), "w") as file:
+            file.write(f".rule-{i} {{ color: #{i % 4096:03x}; margin: 0 auto; }}\n" * (size // 48))
+
+
+def transfer_summary(results):
+    total = deploy.TransferStats()
+    for result in results:
+        total = total.merge(result.transfer)
+    return {"files_sent": total.files_sent, "bytes_total": total.bytes_total, "bytes_sent": total.bytes_sent,
+            "bytes_saved": total.bytes_saved}
+
+
+def run_benchmark(hosts, max_parallel, latency, rolling=None, failing_hosts=0, theme_files=50, theme_file_size=20000):
+    workdir = tempfile.TemporaryDirectory()
+    servers = [FakeSSHServer(os.path.join(workdir.name, f"host{i}"), latency=latency).start() for i in range(hosts)]
+    for server in servers[:failing_hosts]:
+        server.responses[r"docker-compose -f"] = (1, "")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir.name)
+        deploy.create_dockerfile()
+        deploy.create_docker_compose_file()
+        write_theme(theme_files, theme_file_size)
+        deploy_fn = functools.partial(deploy.deploy_host, user="deploy", password="secret")
+        deployer = deploy.MultiHostDeployer([server.address for server in servers], deploy_fn,
+                                            max_parallel=max_parallel, batch_size=rolling)
+        started = time.monotonic()
+        results = deployer.run()
+        elapsed = time.monotonic() - started
+        first_transfer = transfer_summary(results)
+        connections = sum(server.connections for server in servers)
+        commands = len(servers[-1].commands)
+
+        # One changed asset: the repeat deploy should send only that file and the manifest
+        with open(os.path.join(deploy.THEME_ARTIFACTS, "asset0.css"), "a") as file:
+            file.write(".changed { display: none; }\n")
+        started = time.monotonic()
+        repeat = deployer.run()
+        repeat_elapsed = time.monotonic() - started
+        return {
+            "hosts": hosts,
+            "max_parallel": max_parallel,
+            "rolling": rolling,
+            "elapsed_seconds": round(elapsed, 3),
+            "statuses": {status: sum(1 for result in results if result.status == status)
+                         for status in ("succeeded", "failed", "skipped")},
+            "ssh_connections": connections,
+            "commands_per_host": commands,
+            "transferred": sorted(os.listdir(os.path.join(servers[-1].root, "home", "deploy"))),
+            "phases": results[-1].phases,
+            "first_transfer": first_transfer,
+            "repeat_elapsed_seconds": round(repeat_elapsed, 3),
+            "repeat_transfer": transfer_summary(repeat)
+        }
+    finally:
+        os.chdir(cwd)
+        for server in servers:
+            server.stop()
+        workdir.cleanup()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark multi-host deploys against fake SSH servers.")
+    parser.add_argument("--hosts", type=int, default=8)
+    parser.add_argument("--max-parallel", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each remote command takes")
+    parser.add_argument("--rolling", type=int, default=None, help="Also run a rolling deploy with this batch size")
+    parser.add_argument("--failing-hosts", type=int, default=0, help="Make the first N hosts fail docker-compose up")
+    args = parser.parse_args()
+
+    results = [run_benchmark(args.hosts, parallel, args.latency, failing_hosts=args.failing_hosts)
+               for parallel in args.max_parallel]
+    if args.rolling:
+        results.append(run_benchmark(args.hosts, max(args.max_parallel), args.latency, args.rolling, args.failing_hosts))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from bench_common import percentile
+from fake_keycloak import FakeKeycloak
+from fake_stripe import FakeStripe
+
+# Compares checkout latency of the sync (gunicorn) and async (uvicorn) gateway against local stand-ins
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == 'sync':
+        return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f"127.0.0.1:{port}", 'payment_gateway_server:create_app()']
+    return [sys.executable, '-m', 'uvicorn', 'payment_gateway_asgi:app', '--port', str(port), '--log-level', 'warning']
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/subscription-options").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Gateway at {url} did not become ready")
+
+
+async def run_load(url, tokens, requests_total, concurrency):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def checkout(i):
+            nonlocal errors
+            async with semaphore:
+                body = {'access_token': tokens[i % len(tokens)], 'tier': 'basic', 'ai_tokens': 10, 'storage': 50}
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/create-checkout-session", json=body)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout(i) for i in range(requests_total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests_total,
+        'errors': errors,
+        'concurrency': concurrency,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(requests_total / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1)
+    }
+
+
+def benchmark(mode, args, keycloak, stripe_fake, tokens):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = dict(os.environ,
+                   KEYCLOAK_URL=keycloak.url,
+                   KEYCLOAK_REALM=keycloak.realm,
+                   KEYCLOAK_CLIENT_ID='myclient',
+                   KEYCLOAK_ADMIN_CLIENT_SECRET='secret',
+                   STRIPE_SECRET_KEY='sk_test_benchmark',
+                   STRIPE_API_BASE=stripe_fake.url,
+                   WEBHOOK_QUEUE_PATH=os.path.join(state_dir, 'webhook_queue.db'),
+                   EXPIRY_INDEX_PATH=os.path.join(state_dir, 'expiry_index.db'),
+                   LEASE_DB_PATH=os.path.join(state_dir, 'leases.db'))
+        process = subprocess.Popen(server_command(mode, port, args.sync_workers), cwd=SCRIPTS_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            wait_until_ready(url)
+            result = asyncio.run(run_load(url, tokens, args.requests, args.concurrency))
+        finally:
+            process.terminate()
+            process.wait(10)
+    return {'mode': mode, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the sync and async gateway against local stand-ins.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--stripe-latency", type=float, default=0.2, help="Injected Stripe latency in seconds")
+    parser.add_argument("--sync-workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    args = parser.parse_args()
+
+    keycloak = FakeKeycloak().start()
+    stripe_fake = FakeStripe(latency=args.stripe_latency).start()
+    try:
+        tokens = [keycloak.issue_token(f"user-{i}", lifetime=3600) for i in range(100)]
+        results = [benchmark(mode, args, keycloak, stripe_fake, tokens) for mode in args.modes]
+    finally:
+        keycloak.stop()
+        stripe_fake.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
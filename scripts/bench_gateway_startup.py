@@ -0,0 +1,88 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from fake_keycloak import FakeKeycloak
+from fake_stripe import FakeStripe
+
+# Measures gateway cold start in fresh interpreters: import time, app creation, the first
+# catalog request and the first checkout (token verification plus the Stripe call). Each sample
+# is a new process, so nothing is shared between runs. Also runs against revisions that still
+# build a module-level `app`, so two commits can be compared.
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ['stripe', 'flask_mail', 'flask_oauthlib', 'apscheduler']
+
+CHILD = """
+import json, sys, threading, time
+started = time.perf_counter()
+import payment_gateway_server as gateway
+imported = time.perf_counter()
+loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+app = gateway.create_app() if hasattr(gateway, 'create_app') else gateway.app
+created = time.perf_counter()
+client = app.test_client()
+client.get('/subscription-options')
+catalog = time.perf_counter()
+response = client.post('/create-checkout-session', json={'access_token': TOKEN, 'tier': 'basic', 'ai_tokens': 10, 'storage': 10})
+checkout = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_catalog_request': catalog - created,
+    'first_checkout_request': checkout - catalog,
+    'checkout_status': response.status_code,
+    'heavy_modules_after_import': loaded,
+    'threads_after_import_and_create': threading.active_count()
+}))
+"""
+
+
+def sample(env, token):
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\nTOKEN = {token!r}\n{CHILD}"
+    output = subprocess.run([sys.executable, '-c', code], cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark gateway import time and first-request latency.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    keycloak = FakeKeycloak().start()
+    stripe_fake = FakeStripe().start()
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            env = dict(os.environ,
+                       KEYCLOAK_URL=keycloak.url,
+                       KEYCLOAK_REALM=keycloak.realm,
+                       KEYCLOAK_CLIENT_ID='myclient',
+                       KEYCLOAK_ADMIN_CLIENT_SECRET='secret',
+                       STRIPE_SECRET_KEY='sk_test_benchmark',
+                       STRIPE_API_BASE=stripe_fake.url,
+                       WEBHOOK_QUEUE_PATH=os.path.join(state_dir, 'webhook_queue.db'),
+                       EXPIRY_INDEX_PATH=os.path.join(state_dir, 'expiry_index.db'),
+                       USAGE_METER_PATH=os.path.join(state_dir, 'usage_meter.db'),
+                       LEASE_DB_PATH=os.path.join(state_dir, 'leases.db'))
+            token = keycloak.issue_token('startup-user', lifetime=3600)
+            samples = [sample(env, token) for _ in range(args.runs)]
+    finally:
+        keycloak.stop()
+        stripe_fake.stop()
+
+    timings = ['import', 'create_app', 'first_catalog_request', 'first_checkout_request']
+    results = {name: round(statistics.median(s[name] for s in samples) * 1000, 1) for name in timings}
+    results = {f"{name}_ms": value for name, value in results.items()}
+    results['ready_to_serve_ms'] = round(results['import_ms'] + results['create_app_ms'], 1)
+    for key in ('checkout_status', 'heavy_modules_after_import', 'threads_after_import_and_create'):
+        results[key] = samples[-1][key]
+    results['runs'] = args.runs
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
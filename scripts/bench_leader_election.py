@@ -0,0 +1,92 @@
+import argparse
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from leader_election import ShardCoordinator, SQLiteLeaseBackend
+
+# Runs several coordinators against one lease database and checks that every user is swept by
+# exactly one node, how long a dead node's shards stay unowned, and how a joining node rebalances
+
+
+class Node:
+    def __init__(self, path, holder, shards, ttl):
+        self.coordinator = ShardCoordinator(SQLiteLeaseBackend(path), 'expiry-sweep', holder, shards=shards, ttl=ttl)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.coordinator.heartbeat()
+            self._stop.wait(self.coordinator.ttl / 3)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def kill(self):
+        # Stops heartbeating without releasing anything, like a crashed process
+        self._stop.set()
+        self._thread.join()
+
+
+def coverage(nodes, user_ids):
+    owned = [node.coordinator.owned_shards() for node in nodes]
+    owners = [sum(node.coordinator.owns(user_id, shards) for node, shards in zip(nodes, owned)) for user_id in user_ids]
+    return {
+        'shards_per_node': [len(shards) for shards in owned],
+        'users_unowned': owners.count(0),
+        'users_owned_twice': sum(1 for count in owners if count > 1)
+    }
+
+
+def wait_for(condition, timeout):
+    started = time.monotonic()
+    while not condition():
+        if time.monotonic() - started > timeout:
+            return None
+        time.sleep(0.02)
+    return round(time.monotonic() - started, 3)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark sharded lease coordination between gateway nodes.")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--ttl", type=float, default=1.0, help="Lease TTL in seconds")
+    args = parser.parse_args()
+
+    user_ids = [f"user-{i}" for i in range(args.users)]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'leases.db')
+        nodes = [Node(path, f"node-{i}", args.shards, args.ttl).start() for i in range(args.nodes)]
+
+        def balanced(live):
+            owned = [len(node.coordinator.owned_shards()) for node in live]
+            return sum(owned) == args.shards and max(owned) <= math.ceil(args.shards / len(live))
+
+        results['startup_seconds'] = wait_for(lambda: balanced(nodes), 10 * args.ttl)
+        results['steady_state'] = coverage(nodes, user_ids)
+
+        nodes[0].kill()
+        survivors = nodes[1:]
+        results['failover_seconds'] = wait_for(lambda: balanced(survivors), 10 * args.ttl)
+        results['after_failover'] = coverage(survivors, user_ids)
+
+        joined = Node(path, 'node-new', args.shards, args.ttl).start()
+        survivors.append(joined)
+        results['rebalance_seconds'] = wait_for(lambda: balanced(survivors), 10 * args.ttl)
+        results['after_join'] = coverage(survivors, user_ids)
+        for node in survivors:
+            node.kill()
+            node.coordinator.release_all()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+from werkzeug.serving import make_server
+from bench_common import percentile
+from fake_keycloak import FakeKeycloak
+from fake_stripe import FakeStripe
+
+# Repeatable gateway and sweeper benchmarks against in-process Keycloak and Stripe stand-ins.
+# Results are written as JSON so runs from different commits can be compared.
+
+WEBHOOK_SECRET = 'whsec_benchmark'
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None
+    }
+
+
+def drive(requests_total, concurrency, send):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        nonlocal errors
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        ok = send(local.session, i)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_total)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+class GatewayHarness:
+    def __init__(self, keycloak_latency, stripe_latency, bulk_rate_limit=None):
+        self.keycloak = FakeKeycloak(latency=keycloak_latency).start()
+        self.stripe = FakeStripe(latency=stripe_latency).start()
+        self.state_dir = tempfile.TemporaryDirectory()
+        os.environ.update(
+            KEYCLOAK_URL=self.keycloak.url,
+            KEYCLOAK_REALM=self.keycloak.realm,
+            KEYCLOAK_CLIENT_ID='myclient',
+            KEYCLOAK_ADMIN_CLIENT_SECRET='secret',
+            STRIPE_SECRET_KEY='sk_test_benchmark',
+            STRIPE_API_BASE=self.stripe.url,
+            STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+            WEBHOOK_QUEUE_PATH=os.path.join(self.state_dir.name, 'webhook_queue.db'),
+            EXPIRY_INDEX_PATH=os.path.join(self.state_dir.name, 'expiry_index.db'),
+            USAGE_METER_PATH=os.path.join(self.state_dir.name, 'usage_meter.db'),
+            LEASE_DB_PATH=os.path.join(self.state_dir.name, 'leases.db')
+        )
+        if bulk_rate_limit is not None:
+            os.environ['BULK_UPDATE_RATE_LIMIT'] = str(bulk_rate_limit)
+        # Imported only after the environment points at the stand-ins
+        self.gateway = importlib.import_module('payment_gateway_server')
+        self.server = make_server('127.0.0.1', 0, self.gateway.create_app(run_scheduler=False), threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+        self.gateway.shutdown()
+        self.keycloak.stop()
+        self.stripe.stop()
+        self.state_dir.cleanup()
+
+    def checkout_throughput(self, requests_total, concurrency):
+        tokens = [self.keycloak.issue_token(f"user-{i}", lifetime=3600) for i in range(100)]
+
+        def send(session, i):
+            body = {'access_token': tokens[i % len(tokens)], 'tier': 'basic', 'ai_tokens': 10000, 'storage': 30000}
+            return session.post(f"{self.url}/create-checkout-session", json=body).status_code == 200
+
+        return drive(requests_total, concurrency, send)
+
+    def webhook_throughput(self, events_total, concurrency):
+        user_ids = [self.keycloak.add_user(f"webhook-user-{i}") for i in range(events_total)]
+        payloads = [json.dumps(FakeStripe.checkout_completed_event(user_id)) for user_id in user_ids]
+
+        def send(session, i):
+            headers = {'Stripe-Signature': FakeStripe.sign_webhook(payloads[i], WEBHOOK_SECRET),
+                       'Content-Type': 'application/json'}
+            return session.post(f"{self.url}/webhook", data=payloads[i], headers=headers).status_code == 200
+
+        started = time.perf_counter()
+        result = drive(events_total, concurrency, send)
+        # Acknowledgement rate is what Stripe sees; drain rate is the end-to-end processing throughput
+        while self.gateway.webhook_queue.stats()['depth'] > 0:
+            time.sleep(0.05)
+        drained = time.perf_counter() - started
+        result['drained_seconds'] = round(drained, 3)
+        result['processed_per_second'] = round(events_total / drained, 1)
+        return result
+
+    def sweep_wall_time(self, users, expired_ratio):
+        self.keycloak.users.clear()
+        now = datetime.now()
+        expired_every = max(1, int(1 / expired_ratio)) if expired_ratio else 0
+        for i in range(users):
+            expired = expired_every and i % expired_every == 0
+            expiration = now + (timedelta(days=-1) if expired else timedelta(days=30))
+            self.keycloak.add_user(f"sweep-user-{i}", attributes={'expiration_date': [expiration.isoformat()]})
+        # The scheduler is off here, so take the shard lease the sweep needs directly
+        self.gateway.heartbeat_leases()
+        requests_before = self.keycloak.request_count
+        started = time.perf_counter()
+        stats = self.gateway.remove_expired_groups()
+        elapsed = time.perf_counter() - started
+        return {
+            'users': users,
+            'elapsed_seconds': round(elapsed, 3),
+            'keycloak_requests': self.keycloak.request_count - requests_before,
+            **stats
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Run gateway and sweeper benchmarks against local stand-ins.")
+    parser.add_argument("--scenarios", nargs="+", default=["checkout", "webhook", "sweep"], choices=["checkout", "webhook", "sweep"])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--sweep-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--expired-ratio", type=float, default=0.1)
+    parser.add_argument("--keycloak-latency", type=float, default=0.0, help="Injected Keycloak latency in seconds")
+    parser.add_argument("--stripe-latency", type=float, default=0.0, help="Injected Stripe latency in seconds")
+    parser.add_argument("--bulk-rate-limit", type=float, default=None,
+                        help="Override BULK_UPDATE_RATE_LIMIT for the sweep; 0 disables rate limiting")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    harness = GatewayHarness(args.keycloak_latency, args.stripe_latency, args.bulk_rate_limit)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    results = {}
+    try:
+        if "checkout" in args.scenarios:
+            results['checkout'] = harness.checkout_throughput(args.requests, args.concurrency)
+        if "webhook" in args.scenarios:
+            results['webhook'] = harness.webhook_throughput(args.requests, args.concurrency)
+        if "sweep" in args.scenarios:
+            results['sweep'] = [harness.sweep_wall_time(size, args.expired_ratio) for size in args.sweep_sizes]
+    finally:
+        harness.close()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': results
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
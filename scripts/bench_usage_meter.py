@@ -0,0 +1,132 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from bench_common import percentile
+from bulk_updater import BulkClaimUpdater
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+from usage_meter import METERED_RESOURCES, QuotaExceeded, UsageMeter
+
+# Measures the per-call cost of usage metering, the write-back to a fake Keycloak, that usage
+# survives a restart, and that two meters on one file (two gateway processes) share the quota
+
+CLAIMS = {'aiToken': '1000000000', 'usedStorage': '1000000000'}
+
+
+def hot_path(meter, calls, threads, users):
+    latencies = [[] for _ in range(threads)]
+
+    def worker(index):
+        timings = latencies[index]
+        for i in range(calls // threads):
+            started = time.perf_counter()
+            meter.record(f"user-{(index * 7919 + i) % users}", CLAIMS, ai_tokens=10, storage=1)
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    merged = [value for timings in latencies for value in timings]
+    return {
+        'threads': threads,
+        'calls': len(merged),
+        'calls_per_second': round(len(merged) / elapsed),
+        'p50_us': round(statistics.median(merged) * 1e6, 2),
+        'p99_us': round(percentile(merged, 99) * 1e6, 2)
+    }
+
+
+def quota_check(meter):
+    claims = {'aiToken': '100', 'usedStorage': '100'}
+    meter.record('quota-user', claims, ai_tokens=100)
+    try:
+        meter.record('quota-user', claims, ai_tokens=1)
+    except QuotaExceeded:
+        return True
+    return False
+
+
+def shared_quota_check(path):
+    # Each meter has its own connection, like separate gunicorn workers
+    claims = {'aiToken': '100', 'usedStorage': '100'}
+    meters = [UsageMeter(path) for _ in range(2)]
+    accepted = 0
+    for i in range(200):
+        try:
+            meters[i % 2].record('shared-user', claims, ai_tokens=1)
+            accepted += 1
+        except QuotaExceeded:
+            pass
+    for meter in meters:
+        meter.close()
+    return accepted == 100
+
+
+def write_back(meter, users, latency, workers):
+    fake = FakeKeycloak(latency=latency).start()
+    try:
+        for i in range(users):
+            fake.add_user(f"user-{i}", user_id=f"user-{i}", attributes={'tier': ['basic']})
+        client = KeycloakAdminClient(fake.url, fake.realm, client_id='gateway', client_secret='secret', pool_size=workers)
+
+        def write_usage(user_id, deltas):
+            attributes = client.get(f"/users/{user_id}").json().get('attributes') or {}
+            for resource, (_, attribute) in METERED_RESOURCES.items():
+                attributes[attribute] = [str(int((attributes.get(attribute) or ['0'])[0]) + deltas[resource])]
+            return client.put(f"/users/{user_id}", json={'attributes': attributes}).status_code == 204
+
+        started = time.perf_counter()
+        stats = meter.flush(BulkClaimUpdater(write_usage, max_workers=workers))
+        elapsed = time.perf_counter() - started
+        sample = fake.users['user-0']['attributes']
+        second = meter.flush(BulkClaimUpdater(write_usage, max_workers=workers))
+        client.close()
+        return {
+            **stats,
+            'elapsed_seconds': round(elapsed, 3),
+            'users_per_second': round(stats['flushed'] / elapsed, 1) if elapsed else 0.0,
+            'attributes_kept': sample.get('tier') == ['basic'],
+            'sample_usage': {attribute: sample.get(attribute) for _, attribute in METERED_RESOURCES.values()},
+            'second_flush_writes': second['flushed']
+        }
+    finally:
+        fake.stop()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark usage metering and its write-back to Keycloak.")
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.01, help="Injected Keycloak latency in seconds")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'usage_meter.db')
+        meter = UsageMeter(path)
+        results = {'hot_path': [hot_path(meter, args.calls, threads, args.users) for threads in args.threads]}
+        results['quota_enforced'] = quota_check(meter)
+        results['quota_shared_between_processes'] = shared_quota_check(path)
+        expected = meter.usage('user-0')
+        meter.close()
+
+        # A fresh meter on the same file stands in for a restarted gateway
+        restarted = UsageMeter(path)
+        results['restart'] = {'expected': expected, 'recovered': restarted.usage('user-0')}
+        results['write_back'] = write_back(restarted, args.users, args.latency, args.workers)
+        restarted.close()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
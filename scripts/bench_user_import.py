@@ -0,0 +1,95 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+from user_import import BulkUserImporter, UserImportError
+import tier_catalog
+
+# Measures bulk user import throughput against a local fake Keycloak and checks that an
+# import interrupted by an outage resumes without duplicates or lost rejects
+
+TIERS = tier_catalog.group_attributes(tier_catalog.load_catalog())
+
+
+def write_users(path, users, invalid_every):
+    tiers = list(TIERS)
+    invalid = 0
+    with open(path, "w") as file:
+        for i in range(users):
+            if invalid_every and i % invalid_every == 0:
+                file.write(json.dumps({"username": f"customer{i}", "tier": "platinum"}) + "\n")
+                invalid += 1
+            else:
+                file.write(json.dumps({"username": f"customer{i}", "email": f"customer{i}@example.com",
+                                       "tier": tiers[i % len(tiers)], "aiToken": 1000 + i}) + "\n")
+    return invalid
+
+
+def count_lines(path):
+    with open(path) as file:
+        return sum(1 for _ in file)
+
+
+def run_benchmark(users, method, workers, batch_size, latency, invalid_every, interrupt_after=None):
+    fake = FakeKeycloak(latency=latency).start()
+    directory = tempfile.TemporaryDirectory()
+    try:
+        path = os.path.join(directory.name, "users.jsonl")
+        invalid = write_users(path, users, invalid_every)
+        client = KeycloakAdminClient(fake.url, fake.realm, client_id="importer", client_secret="secret",
+                                     pool_size=workers, max_retries=0)
+        importer = BulkUserImporter(client, TIERS, batch_size=batch_size, workers=workers, method=method)
+        interrupted = False
+        if interrupt_after:
+            # Simulate an outage part-way through, then resume once it is over
+            timer = threading.Timer(interrupt_after, lambda: setattr(fake, "fail_writes_with", 503))
+            timer.start()
+            try:
+                importer.run(path)
+            except UserImportError:
+                interrupted = True
+            timer.cancel()
+            fake.fail_writes_with = None
+        stats = importer.run(path)
+        client.close()
+        return {
+            "method": method,
+            "workers": workers,
+            "batch_size": batch_size,
+            "users": users,
+            "interrupted": interrupted,
+            "created": len(fake.users),
+            "expected_created": users - invalid,
+            "rejects_written": count_lines(f"{path}.rejects.jsonl"),
+            "expected_rejects": invalid,
+            "requests": fake.request_count,
+            **stats
+        }
+    finally:
+        fake.stop()
+        directory.cleanup()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark bulk user import against a fake Keycloak.")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--methods", nargs="+", default=["partial-import", "users"], choices=["partial-import", "users"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="Injected latency per request in seconds")
+    parser.add_argument("--invalid-every", type=int, default=100, help="Write an unknown-tier record every N users")
+    parser.add_argument("--interrupt-after", type=float, default=None,
+                        help="Fail writes after this many seconds, then resume from the checkpoint")
+    args = parser.parse_args()
+
+    results = [run_benchmark(args.users, method, args.workers, args.batch_size, args.latency, args.invalid_every,
+                             args.interrupt_after) for method in args.methods]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
+import argparse
 import subprocess
 import json
 import logging
 import os
 from keycloak import KeycloakAdmin
 from keycloak.exceptions import KeycloakError
-from time import sleep
+import time
+from keycloak_admin_client import KeycloakAdminClient, KeycloakAdminError
+import readiness
+from keycloak_reconciler import KeycloakReconciler
+from build_cache import BuildCache
+from theme_assets import THEME_ASSET_SOURCE
+from step_scheduler import StepScheduler, SUCCEEDED
+from realm_import import RealmImporter, validate_realm, write_realm_file
+import tier_catalog
+import metrics
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +27,13 @@ REALM_NAME = os.getenv("REALM_NAME", "myrealm")
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin_password")
 CLIENT_ID = os.getenv("CLIENT_ID", "myclient")
+# Keycloak 21 (pinned in the Dockerfile) serves health on the main port; from 25 on it moves to
+# the management port, e.g. KEYCLOAK_HEALTH_URL=https://localhost:9000/health/ready
+KEYCLOAK_HEALTH_URL = os.getenv("KEYCLOAK_HEALTH_URL", KEYCLOAK_URL.rstrip("/") + "/health/ready")
+# Probes the database port before Keycloak when set; docker-compose does not publish Postgres,
+# so by default only Keycloak's own readiness is checked
+KEYCLOAK_DB_HOST = os.getenv("KEYCLOAK_DB_HOST", "")
+KEYCLOAK_DB_PORT = int(os.getenv("KEYCLOAK_DB_PORT", 5432))
 REDIRECT_URI = os.getenv("REDIRECT_URI", "https://localhost:4200/*")
 EMAIL_SETTINGS = {
     "host": os.getenv("EMAIL_HOST", "smtp.example.com"),
@@ -25,12 +42,21 @@ EMAIL_SETTINGS = {
     "password": os.getenv("EMAIL_PASSWORD", "password"),
     "from": os.getenv("EMAIL_FROM", "no-reply@example.com")
 }
-GROUPS = {
-    "free": {"aiToken": 1000, "usedStorage": 500},
-    "basic": {"aiToken": 10000, "usedStorage": 30000},
-    "advanced": {"aiToken": 20000, "usedStorage": 100000},
-    "pro": {"aiToken": 50000, "usedStorage": 300000}
-}
+# Tiers come from the catalog shared with the payment gateway
+TIER_CATALOG = tier_catalog.load_catalog()
+GROUPS = tier_catalog.group_attributes(TIER_CATALOG)
+# Keycloak has no per-tier device setting, so each tier's limit is stored on its group
+DEVICE_LIMITS = tier_catalog.device_restrictions(TIER_CATALOG)
+THEME_SOURCE_DIR = os.getenv("THEME_SOURCE_DIR", "material-keycloak-theme")
+THEME_OUTPUT_DIR = os.path.join(THEME_SOURCE_DIR, "keycloak", "themes", "material-theme")
+THEME_INPUTS = [THEME_SOURCE_DIR, os.path.join("themes", "material-theme"), "build_and_deploy.py"]
+# The image build runs theme_assets.py itself, so its sources are inputs rather than its output
+IMAGE_INPUTS = ["Dockerfile", THEME_OUTPUT_DIR, THEME_ASSET_SOURCE, os.path.join("scripts", "theme_assets.py")]
+SETUP_WORKERS = int(os.getenv("SETUP_WORKERS", 4))
+REALM_IMPORT_DIR = os.getenv("REALM_IMPORT_DIR", "realm-import")
+# Step timings, written in Prometheus text format when METRICS_TEXTFILE is set
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")
+SETUP_STEP_DURATION = metrics.Histogram("keycloak_setup_step_duration_seconds", "Duration of Keycloak setup steps.", ["step", "status"])
 SOCIAL_LOGINS = ["apple", "google", "microsoft"]
 OPTIONAL_SOCIAL_LOGINS = ["github", "discord"]
 
@@ -46,40 +72,184 @@ class CommandRunner:
 
 class AngularBuilder:
     @staticmethod
-    def build_and_deploy():
-        CommandRunner.run_command(["python", "build_and_deploy.py"])
+    def build_and_deploy(build_cache=None):
+        if build_cache is None:
+            return CommandRunner.run_command(["python", "build_and_deploy.py"])
+        build_cache.run("theme", THEME_INPUTS, lambda digest: CommandRunner.run_command(["python", "build_and_deploy.py"]),
+                        artifact_exists=lambda digest: os.path.isdir(THEME_OUTPUT_DIR))
 
 class DockerManager:
     @staticmethod
-    def build_keycloak_image():
-        CommandRunner.run_command(["docker", "build", "-t", DOCKER_IMAGE_NAME, "."])
-        CommandRunner.run_command(["docker", "run", "-d", "--name", DOCKER_CONTAINER_NAME, "-p", "8443:8443", "-e", "KEYCLOAK_USER=" + ADMIN_USER, "-e", "KEYCLOAK_PASSWORD=" + ADMIN_PASSWORD, DOCKER_IMAGE_NAME])
+    def image_digest_label():
+        try:
+            result = subprocess.run(["docker", "image", "inspect", "--format", '{{ index .Config.Labels "build-cache.digest" }}',
+                                     DOCKER_IMAGE_NAME], capture_output=True, text=True, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return result.stdout.strip()
+
+    @staticmethod
+    def build_image(digest=""):
+        # The label ties the image to its inputs, so a cache hit can confirm the image is really there
+        CommandRunner.run_command(["docker", "build", "-t", DOCKER_IMAGE_NAME, "--label", f"build-cache.digest={digest}", "."])
+
+    @staticmethod
+    def build_keycloak_image(build_cache=None):
+        if build_cache is None:
+            DockerManager.build_image()
+        else:
+            build_cache.run("image", IMAGE_INPUTS, DockerManager.build_image, extra={"image": DOCKER_IMAGE_NAME},
+                            artifact_exists=lambda digest: DockerManager.image_digest_label() == digest)
+        DockerManager.start_container()
+
+    @staticmethod
+    def start_container():
+        CommandRunner.run_command(["docker", "run", "-d", "--name", DOCKER_CONTAINER_NAME, "-p", "8443:8443", "-e", "KC_HEALTH_ENABLED=true", "-e", "KEYCLOAK_USER=" + ADMIN_USER, "-e", "KEYCLOAK_PASSWORD=" + ADMIN_PASSWORD, DOCKER_IMAGE_NAME])
+        started = time.monotonic()
+        readiness.wait_until_ready(KEYCLOAK_HEALTH_URL, KEYCLOAK_DB_HOST, KEYCLOAK_DB_PORT)
+        logging.info(f"Container '{DOCKER_CONTAINER_NAME}' ready {time.monotonic() - started:.2f}s after start.")
+
+class RealmDefinition:
+    @staticmethod
+    def realm():
+        return {"realm": REALM_NAME, "enabled": True}
+
+    @staticmethod
+    def client():
+        return {
+            "clientId": CLIENT_ID,
+            "redirectUris": [REDIRECT_URI],
+            "publicClient": True,
+            "directAccessGrantsEnabled": True
+        }
+
+    @staticmethod
+    def refresh_token_attributes():
+        return {
+            "refreshTokenMaxReuse": "1",
+            "useRefreshTokens": "true",
+            "ssoSessionMaxLifespan": "3600",
+            "ssoSessionIdleTimeout": "1800"
+        }
+
+    @staticmethod
+    def protocol_mappers():
+        return [
+            {"name": "aiToken", "protocol": "openid-connect", "protocolMapper": "oidc-usermodel-attribute-mapper", "config": {"claim.name": "aiToken", "user.attribute": "aiToken", "id.token.claim": "true", "access.token.claim": "true"}},
+            {"name": "usedStorage", "protocol": "openid-connect", "protocolMapper": "oidc-usermodel-attribute-mapper", "config": {"claim.name": "usedStorage", "user.attribute": "usedStorage", "id.token.claim": "true", "access.token.claim": "true"}}
+        ]
+
+    @staticmethod
+    def group(group_name, attributes):
+        return {
+            "name": group_name,
+            "attributes": {
+                "aiToken": [str(attributes["aiToken"])],
+                "usedStorage": [str(attributes["usedStorage"])],
+                "maxDevices": [str(DEVICE_LIMITS[group_name])]
+            }
+        }
+
+    @staticmethod
+    def demo_user(group_name):
+        return {
+            "username": f"{group_name}_user",
+            "enabled": True,
+            "credentials": [{"type": "password", "value": "password", "temporary": False}],
+            "groups": [group_name]
+        }
+
+    @staticmethod
+    def identity_provider(provider):
+        return {
+            "alias": provider,
+            "providerId": provider,
+            "enabled": True,
+            "trustEmail": True,
+            "storeToken": False,
+            "addReadTokenRoleOnCreate": True,
+            "authenticateByDefault": False,
+            "linkOnly": False,
+            "config": {"clientId": os.getenv(f"{provider.upper()}_CLIENT_ID", "client_id"), "clientSecret": os.getenv(f"{provider.upper()}_CLIENT_SECRET", "client_secret")}
+        }
+
+    @staticmethod
+    def email_settings():
+        return {"smtpServer": EMAIL_SETTINGS}
+
+    @staticmethod
+    def device_restrictions():
+        return {
+            "bruteForceProtected": True,
+            "maxFailureWaitSeconds": 60,
+            "minimumQuickLoginWaitSeconds": 60,
+            "waitIncrementSeconds": 60,
+            "quickLoginCheckMilliSeconds": 1000,
+            "maxDeltaTimeSeconds": 43200,
+            "failureFactor": 2,
+            "permanentLockout": False
+        }
+
+    @staticmethod
+    def desired_state():
+        # Everything the configurator steps set up, as one document the reconciler can diff
+        client = RealmDefinition.client()
+        client["attributes"] = RealmDefinition.refresh_token_attributes()
+        client["protocolMappers"] = RealmDefinition.protocol_mappers()
+        return {
+            "realm": {**RealmDefinition.realm(), **RealmDefinition.email_settings(), **RealmDefinition.device_restrictions()},
+            "clients": [client],
+            "groups": [RealmDefinition.group(group_name, attributes) for group_name, attributes in GROUPS.items()],
+            "users": [RealmDefinition.demo_user(group_name) for group_name in GROUPS],
+            "identityProviders": [RealmDefinition.identity_provider(provider) for provider in SOCIAL_LOGINS + OPTIONAL_SOCIAL_LOGINS]
+        }
+
+    @staticmethod
+    def realm_representation():
+        # The desired state flattened into a single RealmRepresentation for partialImport or --import-realm
+        state = RealmDefinition.desired_state()
+        representation = {**state["realm"], **{key: value for key, value in state.items() if key != "realm"}}
+        # Realm import only accepts string values for the SMTP map
+        representation["smtpServer"] = {key: str(value) for key, value in representation["smtpServer"].items()}
+        return validate_realm(representation)
 
 class KeycloakConfigurator:
     def __init__(self):
         self.keycloak_admin = None
+        self.admin_client = None
+        self.client_uuid = None
 
-    def connect(self):
-        retry_attempts = 5
-        while retry_attempts > 0:
-            try:
-                self.keycloak_admin = KeycloakAdmin(server_url=KEYCLOAK_URL,
+    def _login(self):
+        try:
+            self.keycloak_admin = KeycloakAdmin(server_url=KEYCLOAK_URL,
+                                                username=ADMIN_USER,
+                                                password=ADMIN_PASSWORD,
+                                                realm_name="master",
+                                                verify=True)
+            # Pooled REST client for bulk reads and raw admin calls the library does not cover
+            self.admin_client = KeycloakAdminClient(KEYCLOAK_URL, REALM_NAME,
                                                     username=ADMIN_USER,
                                                     password=ADMIN_PASSWORD,
-                                                    realm_name="master",
-                                                    verify=True)
-                logging.info("Connected to Keycloak")
-                break
-            except KeycloakError as e:
-                retry_attempts -= 1
-                logging.error(f"Error connecting to Keycloak: {e}, retries left: {retry_attempts}")
-                sleep(5)
-        if retry_attempts == 0:
-            raise Exception("Failed to connect to Keycloak after multiple attempts")
+                                                    token_realm="master")
+            self.admin_client.get_token()
+            return True
+        except (KeycloakError, KeycloakAdminError) as e:
+            logging.warning(f"Keycloak admin login not accepted yet: {e}")
+            return False
+
+    def connect(self, timeout=readiness.READINESS_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        try:
+            readiness.wait_until_ready(KEYCLOAK_HEALTH_URL, KEYCLOAK_DB_HOST, KEYCLOAK_DB_PORT, deadline)
+            # Ready can precede the admin account being usable by a moment on first start
+            readiness.wait_for("admin_login", self._login, deadline)
+        except readiness.ReadinessTimeout as e:
+            raise Exception(f"Failed to connect to Keycloak: {e}")
+        logging.info("Connected to Keycloak")
 
     def create_realm(self):
         try:
-            self.keycloak_admin.create_realm(payload={"realm": REALM_NAME, "enabled": True})
+            self.keycloak_admin.create_realm(payload=RealmDefinition.realm())
             logging.info(f"Realm '{REALM_NAME}' created successfully.")
         except KeycloakError as e:
             logging.error(f"Error creating realm '{REALM_NAME}': {e}")
@@ -87,98 +257,57 @@ class KeycloakConfigurator:
 
     def create_client(self):
         try:
-            self.keycloak_admin.create_client(payload={
-                "clientId": CLIENT_ID,
-                "redirectUris": [REDIRECT_URI],
-                "publicClient": True,
-                "directAccessGrantsEnabled": True
-            }, realm_name=REALM_NAME)
+            # Kept so mapper and token-setting steps skip a get_client_id lookup each
+            self.client_uuid = self.keycloak_admin.create_client(payload=RealmDefinition.client(), realm_name=REALM_NAME)
             logging.info(f"Client '{CLIENT_ID}' created successfully.")
         except KeycloakError as e:
             logging.error(f"Error creating client '{CLIENT_ID}': {e}")
             raise e
 
-    def create_groups_and_users(self):
-        for group_name, attributes in GROUPS.items():
-            try:
-                self.keycloak_admin.create_group(payload={"name": group_name}, realm_name=REALM_NAME)
-                group_id = self.keycloak_admin.get_group_id(group_name, realm_name=REALM_NAME)
-                self.keycloak_admin.update_group(group_id, payload={
-                    "attributes": {"aiToken": str(attributes["aiToken"]), "usedStorage": str(attributes["usedStorage"])}
-                }, realm_name=REALM_NAME)
-                logging.info(f"Group '{group_name}' created with attributes {attributes}.")
-
-                self.keycloak_admin.create_user(payload={
-                    "username": f"{group_name}_user",
-                    "enabled": True,
-                    "credentials": [{"type": "password", "value": "password", "temporary": False}],
-                    "groups": [group_name]
-                }, realm_name=REALM_NAME)
-                logging.info(f"User '{group_name}_user' created and added to group '{group_name}'.")
-            except KeycloakError as e:
-                logging.error(f"Error creating group or user for '{group_name}': {e}")
-                raise e
-
-    def add_custom_claims(self):
+    def create_group(self, group_name, attributes):
         try:
-            client_id = self.keycloak_admin.get_client_id(CLIENT_ID, realm_name=REALM_NAME)
-            protocol_mappers = [
-                {"name": "aiToken", "protocol": "openid-connect", "protocolMapper": "oidc-usermodel-attribute-mapper", "config": {"claim.name": "aiToken", "user.attribute": "aiToken", "id.token.claim": "true", "access.token.claim": "true"}},
-                {"name": "usedStorage", "protocol": "openid-connect", "protocolMapper": "oidc-usermodel-attribute-mapper", "config": {"claim.name": "usedStorage", "user.attribute": "usedStorage", "id.token.claim": "true", "access.token.claim": "true"}}
-            ]
-            for mapper in protocol_mappers:
-                self.keycloak_admin.create_client_protocol_mapper(client_id, mapper, realm_name=REALM_NAME)
-            logging.info("Custom claims added successfully.")
+            # Attributes go in with the create, so no get_group_id/update_group round trip is needed
+            self.keycloak_admin.create_group(payload=RealmDefinition.group(group_name, attributes), realm_name=REALM_NAME)
+            logging.info(f"Group '{group_name}' created with attributes {attributes}.")
         except KeycloakError as e:
-            logging.error(f"Error adding custom claims: {e}")
+            logging.error(f"Error creating group '{group_name}': {e}")
+            raise e
+
+    def create_demo_user(self, group_name):
+        try:
+            self.keycloak_admin.create_user(payload=RealmDefinition.demo_user(group_name), realm_name=REALM_NAME)
+            logging.info(f"User '{group_name}_user' created and added to group '{group_name}'.")
+        except KeycloakError as e:
+            logging.error(f"Error creating user for '{group_name}': {e}")
+            raise e
+
+    def add_custom_claim(self, mapper):
+        try:
+            self.keycloak_admin.create_client_protocol_mapper(self.client_uuid, mapper, realm_name=REALM_NAME)
+            logging.info(f"Custom claim '{mapper['name']}' added successfully.")
+        except KeycloakError as e:
+            logging.error(f"Error adding custom claim '{mapper['name']}': {e}")
             raise e
 
     def configure_email_settings(self):
         try:
-            self.keycloak_admin.update_realm(REALM_NAME, payload={"smtpServer": EMAIL_SETTINGS})
+            self.keycloak_admin.update_realm(REALM_NAME, payload=RealmDefinition.email_settings())
             logging.info("Email settings configured successfully.")
         except KeycloakError as e:
             logging.error(f"Error configuring email settings: {e}")
             raise e
 
-    def configure_social_logins(self):
+    def configure_social_login(self, provider):
         try:
-            for provider in SOCIAL_LOGINS + OPTIONAL_SOCIAL_LOGINS:
-                self.keycloak_admin.create_identity_provider({
-                    "alias": provider,
-                    "providerId": provider,
-                    "enabled": True,
-                    "trustEmail": True,
-                    "storeToken": False,
-                    "addReadTokenRoleOnCreate": True,
-                    "authenticateByDefault": False,
-                    "linkOnly": False,
-                    "config": {"clientId": os.getenv(f"{provider.upper()}_CLIENT_ID", "client_id"), "clientSecret": os.getenv(f"{provider.upper()}_CLIENT_SECRET", "client_secret")}
-                }, realm_name=REALM_NAME)
-            logging.info("Social logins configured successfully.")
+            self.keycloak_admin.create_identity_provider(RealmDefinition.identity_provider(provider), realm_name=REALM_NAME)
+            logging.info(f"Social login '{provider}' configured successfully.")
         except KeycloakError as e:
-            logging.error(f"Error configuring social logins: {e}")
+            logging.error(f"Error configuring social login '{provider}': {e}")
             raise e
 
     def configure_device_restrictions(self):
         try:
-            restrictions = {
-                "free": 2,
-                "basic": 3,
-                "advanced": 5,
-                "pro": 5
-            }
-            self.keycloak_admin.update_realm(REALM_NAME, payload={
-                "bruteForceProtected": True,
-                "maxFailureWaitSeconds": 60,
-                "minimumQuickLoginWaitSeconds": 60,
-                "waitIncrementSeconds": 60,
-                "quickLoginCheckMilliSeconds": 1000,
-                "maxDeltaTimeSeconds": 43200,
-                "failureFactor": 2,
-                "permanentLockout": False,
-                "maxLoginFailures": restrictions
-            })
+            self.keycloak_admin.update_realm(REALM_NAME, payload=RealmDefinition.device_restrictions())
             logging.info("Device restrictions configured successfully.")
         except KeycloakError as e:
             logging.error(f"Error configuring device restrictions: {e}")
@@ -186,39 +315,113 @@ class KeycloakConfigurator:
 
     def configure_refresh_token_settings(self):
         try:
-            client_id = self.keycloak_admin.get_client_id(CLIENT_ID, realm_name=REALM_NAME)
-            self.keycloak_admin.update_client(client_id, payload={
-                "attributes": {
-                    "refreshTokenMaxReuse": 1,
-                    "useRefreshTokens": True,
-                    "ssoSessionMaxLifespan": 3600,
-                    "ssoSessionIdleTimeout": 1800
-                }
+            self.keycloak_admin.update_client(self.client_uuid, payload={
+                "attributes": RealmDefinition.refresh_token_attributes()
             }, realm_name=REALM_NAME)
             logging.info("Refresh token settings configured successfully.")
         except KeycloakError as e:
             logging.error(f"Error configuring refresh token settings: {e}")
             raise e
 
+    def reconcile(self, dry_run=False):
+        reconciler = KeycloakReconciler(self.admin_client)
+        changes = reconciler.plan(RealmDefinition.desired_state())
+        if not changes:
+            logging.info(f"Realm '{REALM_NAME}' is up to date, nothing to apply.")
+            return changes
+        for change in changes:
+            logging.info(change.describe())
+        if dry_run:
+            logging.info(f"{len(changes)} pending changes, nothing applied (dry run).")
+            return changes
+        reconciler.apply(changes)
+        logging.info(f"Applied {len(changes)} changes to realm '{REALM_NAME}'.")
+        return changes
+
+    def provision(self, if_resource_exists="SKIP"):
+        calls = RealmImporter(self.admin_client).apply(RealmDefinition.realm_representation(), if_resource_exists)
+        logging.info(f"Realm '{REALM_NAME}' provisioned with {calls} admin call(s).")
+
+def run_step(name, step):
+    with SETUP_STEP_DURATION.time(step=name):
+        step()
+
+def setup_steps(keycloak_configurator, max_workers=SETUP_WORKERS):
+    scheduler = StepScheduler(max_workers=max_workers)
+
+    def step(name, fn, depends_on=()):
+        return scheduler.add(name, lambda: run_step(name, fn), depends_on)
+
+    realm = step("create_realm", keycloak_configurator.create_realm)
+    client = step("create_client", keycloak_configurator.create_client, [realm])
+    for group_name, attributes in GROUPS.items():
+        group = step(f"create_group:{group_name}", lambda g=group_name, a=attributes: keycloak_configurator.create_group(g, a), [realm])
+        step(f"create_demo_user:{group_name}", lambda g=group_name: keycloak_configurator.create_demo_user(g), [group])
+    for mapper in RealmDefinition.protocol_mappers():
+        step(f"add_custom_claim:{mapper['name']}", lambda m=mapper: keycloak_configurator.add_custom_claim(m), [client])
+    for provider in SOCIAL_LOGINS + OPTIONAL_SOCIAL_LOGINS:
+        step(f"configure_social_login:{provider}", lambda p=provider: keycloak_configurator.configure_social_login(p), [realm])
+    email = step("configure_email_settings", keycloak_configurator.configure_email_settings, [realm])
+    # Both steps PUT the realm; running them one after the other keeps either update from being overwritten
+    step("configure_device_restrictions", keycloak_configurator.configure_device_restrictions, [email])
+    step("configure_refresh_token_settings", keycloak_configurator.configure_refresh_token_settings, [client])
+    return scheduler
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build, start and configure Keycloak.")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Diff the running realm against the desired state and apply only the differences")
+    parser.add_argument("--plan", "--dry-run", dest="plan", action="store_true",
+                        help="List the changes --reconcile would make without applying them")
+    parser.add_argument("--provision", action="store_true",
+                        help="Apply the whole realm in one call: create it from its representation or partialImport into it")
+    parser.add_argument("--if-exists", choices=["SKIP", "OVERWRITE", "FAIL"], default="SKIP",
+                        help="partialImport policy for resources that already exist (default: SKIP)")
+    parser.add_argument("--export-realm", nargs="?", const=REALM_IMPORT_DIR, metavar="DIR",
+                        help=f"Write the validated realm JSON for Keycloak's --import-realm (default: {REALM_IMPORT_DIR}) and exit")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild the theme and image even when the build cache says they are up to date")
+    parser.add_argument("--workers", type=int, default=SETUP_WORKERS,
+                        help=f"Configuration steps run concurrently when independent (default: {SETUP_WORKERS})")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     try:
-        AngularBuilder.build_and_deploy()
-        DockerManager.build_keycloak_image()
+        if args.export_realm:
+            run_step("export_realm", lambda: write_realm_file(RealmDefinition.realm_representation(), args.export_realm))
+            return
+
+        if args.provision:
+            keycloak_configurator = KeycloakConfigurator()
+            run_step("connect", keycloak_configurator.connect)
+            run_step("provision", lambda: keycloak_configurator.provision(args.if_exists))
+            return
+
+        if args.reconcile or args.plan:
+            keycloak_configurator = KeycloakConfigurator()
+            run_step("connect", keycloak_configurator.connect)
+            run_step("reconcile", lambda: keycloak_configurator.reconcile(dry_run=args.plan))
+            return
+
+        build_cache = BuildCache(force=args.force)
+        run_step("build_theme", lambda: AngularBuilder.build_and_deploy(build_cache))
+        run_step("build_image", lambda: DockerManager.build_keycloak_image(build_cache))
+        build_cache.report()
 
         keycloak_configurator = KeycloakConfigurator()
-        keycloak_configurator.connect()
-        keycloak_configurator.create_realm()
-        keycloak_configurator.create_client()
-        keycloak_configurator.create_groups_and_users()
-        keycloak_configurator.add_custom_claims()
-        keycloak_configurator.configure_email_settings()
-        keycloak_configurator.configure_social_logins()
-        keycloak_configurator.configure_device_restrictions()
-        keycloak_configurator.configure_refresh_token_settings()
+        run_step("connect", keycloak_configurator.connect)
+        results = setup_steps(keycloak_configurator, args.workers).run()
+        incomplete = sorted(name for name, result in results.items() if result.status != SUCCEEDED)
+        if incomplete:
+            raise Exception(f"{len(incomplete)} of {len(results)} configuration steps did not complete: {', '.join(incomplete)}")
 
         logging.info("Setup completed successfully.")
     except Exception as e:
         logging.error(f"Setup failed: {e}")
+    finally:
+        if METRICS_TEXTFILE:
+            metrics.REGISTRY.write_textfile(METRICS_TEXTFILE)
 
 if __name__ == "__main__":
     main()
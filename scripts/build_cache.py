@@ -0,0 +1,78 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+BUILD_CACHE_MANIFEST = os.getenv("BUILD_CACHE_MANIFEST", ".build-cache.json")
+# Dependencies and build output are not inputs; hashing them would make every run a miss
+IGNORED_NAMES = {".git", "node_modules", ".angular", "dist", "__pycache__"}
+
+
+def hash_inputs(paths, extra=None):
+    # Paths and contents of every input file, in a stable order, plus any non-file settings
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        if not os.path.exists(path):
+            digest.update(f"missing:{path}\0".encode())
+            continue
+        files = [path] if os.path.isfile(path) else []
+        for root, directories, names in os.walk(path):
+            directories[:] = sorted(name for name in directories if name not in IGNORED_NAMES)
+            files.extend(os.path.join(root, name) for name in sorted(names) if name not in IGNORED_NAMES)
+        for file_path in files:
+            digest.update(f"file:{file_path}\0".encode())
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    digest.update(json.dumps(extra or {}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    def __init__(self, manifest_path=BUILD_CACHE_MANIFEST, force=False):
+        self.manifest_path = manifest_path
+        self.force = force
+        self.results = []
+        try:
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def _save(self):
+        temporary = f"{self.manifest_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.manifest_path)
+
+    def run(self, stage, inputs, build, extra=None, artifact_exists=None):
+        # build(digest) runs only when the inputs changed since the last successful build
+        # or its artifact is gone; the digest is recorded only after the build succeeds
+        started = time.monotonic()
+        digest = hash_inputs(inputs, extra)
+        entry = self.manifest.get(stage, {})
+        if not self.force and entry.get("digest") == digest and (artifact_exists is None or artifact_exists(digest)):
+            self.results.append((stage, "hit", time.monotonic() - started))
+            logger.info(f"Build cache hit for '{stage}' ({digest[:12]}), skipping.")
+            return False
+
+        reason = "forced" if self.force else "inputs changed" if entry else "not built before"
+        if not self.force and entry.get("digest") == digest:
+            reason = "artifact missing"
+        logger.info(f"Build cache miss for '{stage}' ({reason}), building.")
+        build(digest)
+        # Builds that write into their own inputs are fingerprinted again so an unchanged tree hits next time
+        self.manifest[stage] = {"digest": hash_inputs(inputs, extra), "built_at": time.time()}
+        self._save()
+        self.results.append((stage, "miss", time.monotonic() - started))
+        return True
+
+    def report(self):
+        for stage, outcome, elapsed in self.results:
+            logger.info(f"Build cache {outcome:<4} {stage}: {elapsed:.2f}s")
+        hits = sum(1 for _, outcome, _ in self.results if outcome == "hit")
+        logger.info(f"Build cache: {hits} of {len(self.results)} stages reused.")
+        return self.results
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class BulkUpdateResult:
+    def __init__(self):
+        self.succeeded = 0
+        self.failures = {}
+        self.elapsed = 0.0
+
+    @property
+    def attempted(self):
+        return self.succeeded + len(self.failures)
+
+    @property
+    def throughput(self):
+        return self.attempted / self.elapsed if self.elapsed else 0.0
+
+
+class BulkClaimUpdater:
+    def __init__(self, update_fn, max_workers=8, rate_limit=None, burst=None):
+        self.update_fn = update_fn
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+
+    def _update_one(self, user_id, claims):
+        if self.bucket:
+            self.bucket.acquire()
+        return self.update_fn(user_id, claims)
+
+    def run(self, updates):
+        result = BulkUpdateResult()
+        lock = threading.Lock()
+        # Bound the number of queued updates so a generator input is never fully materialised
+        in_flight = threading.BoundedSemaphore(self.max_workers * 2)
+        started = time.monotonic()
+
+        def on_done(future, user_id, claims):
+            try:
+                error = None if future.result() else 'update rejected'
+            except Exception as e:
+                error = str(e)
+            with lock:
+                if error is None:
+                    result.succeeded += 1
+                else:
+                    result.failures[user_id] = (claims, error)
+            in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for user_id, claims in updates:
+                in_flight.acquire()
+                future = pool.submit(self._update_one, user_id, claims)
+                future.add_done_callback(lambda f, u=user_id, c=claims: on_done(f, u, c))
+
+        result.elapsed = time.monotonic() - started
+        logger.info(f"Bulk update finished: {result.succeeded} succeeded, {len(result.failures)} failed "
+                    f"in {result.elapsed:.2f}s ({result.throughput:.1f}/s).")
+        return result
+
+    def retry_failed(self, result):
+        return self.run((user_id, claims) for user_id, (claims, _) in result.failures.items())
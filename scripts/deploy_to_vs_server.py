@@ -1,6 +1,15 @@
+import argparse
+import functools
+import os
 import subprocess
 import logging
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import paramiko
+from artifact_sync import ArtifactSync, TransferStats
+from theme_assets import build_theme_assets
 from scp import SCPClient
 
 # Logging configuration
@@ -9,15 +18,28 @@ logging.basicConfig(level=logging.INFO)
 # Constants
 DOCKER_COMPOSE_FILE = "docker-compose.yml"
 DOCKERFILE = "Dockerfile"
+DOCKER_IMAGE_NAME = "my-keycloak"
+# What the generated Dockerfile copies into the image, so the server can build it
+THEME_ARTIFACTS = "material-keycloak-theme/themes"
+# Fingerprinted, precompressed login assets written by theme_assets.py
+THEME_ASSET_ARTIFACTS = "dist/themes"
 VSERVER_IP = "your.vserver.ip"
 VSERVER_USER = "your_vserver_user"
 VSERVER_PASSWORD = "your_vserver_password"
+VSERVER_PORT = int(os.getenv("VSERVER_PORT", 22))
+# Comma-separated host[:port] list; defaults to the single server above
+VSERVER_HOSTS = [host.strip() for host in os.getenv("VSERVER_HOSTS", VSERVER_IP).split(",") if host.strip()]
+DEPLOY_MAX_PARALLEL = int(os.getenv("DEPLOY_MAX_PARALLEL", 4))
+SSH_KEEPALIVE_INTERVAL = 30
+# Upper bound on one wait for command output; channels are polled again after it
+SSH_READ_POLL_SECONDS = 1.0
 
 DOCKER_COMPOSE_CONTENT = """
 version: '3'
 services:
   keycloak:
     build: .
+    image: my-keycloak
     environment:
       KEYCLOAK_USER: admin
       KEYCLOAK_PASSWORD: admin_password
@@ -31,6 +53,7 @@ FROM jboss/keycloak:latest
 
 # Copy the built Angular Material template to the themes directory
 COPY ./material-keycloak-theme/themes /opt/jboss/keycloak/themes
+COPY ./dist/themes /opt/jboss/keycloak/themes
 
 # Set the Angular Material theme as the default theme
 ENV KEYCLOAK_THEME=material-keycloak-theme
@@ -55,68 +78,247 @@ class AngularBuilder:
         CommandRunner.run_command(["python", "build_and_deploy.py"])
 
 class DockerManager:
+    @staticmethod
+    def build_image():
+        CommandRunner.run_command(["docker", "build", "-t", DOCKER_IMAGE_NAME, "."])
+
     @staticmethod
     def build_keycloak_image():
-        CommandRunner.run_command(["docker", "build", "-t", "my-keycloak", "."])
-        CommandRunner.run_command(["docker", "run", "-d", "--name", "keycloak-container", "-p", "8080:8080", "my-keycloak"])
+        DockerManager.build_image()
+        CommandRunner.run_command(["docker", "run", "-d", "--name", "keycloak-container", "-p", "8080:8080", DOCKER_IMAGE_NAME])
+
+class RemoteCommandError(Exception):
+    def __init__(self, host, command, exit_status, stderr):
+        super().__init__(f"Command '{command}' on {host} exited with {exit_status}: {stderr.strip()}")
+        self.exit_status = exit_status
+
 
 class VirtualServerManager:
-    def __init__(self, ip, user, password):
+    def __init__(self, ip, user, password, port=VSERVER_PORT):
         self.ip = ip
         self.user = user
         self.password = password
+        self.port = port
+        self._ssh = None
+        self._lock = threading.Lock()
+        self.transfer_stats = TransferStats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def provision_server(self):
-        logging.info("Virtual server provisioned successfully.")
+        logging.info(f"Virtual server {self.ip} provisioned successfully.")
 
     def install_dependencies(self):
         try:
-            ssh = self._connect()
+            # Probes are independent, so they share one round trip; apt-get holds the dpkg lock and stays sequential
+            docker, compose = self.execute_commands(["command -v docker", "command -v docker-compose"], check=False)
+            if docker[0] == 0 and compose[0] == 0:
+                logging.info(f"Docker and Docker Compose already installed on {self.ip}, skipping.")
+                return
             commands = [
                 "sudo apt-get update",
-                "sudo apt-get install -y docker.io",
-                "sudo apt-get install -y docker-compose"
+                "sudo apt-get install -y docker.io docker-compose"
             ]
             for command in commands:
-                self._execute_command(ssh, command)
-            ssh.close()
-            logging.info("Dependencies installed successfully on the virtual server.")
+                self._execute_command(command)
+            logging.info(f"Dependencies installed successfully on {self.ip}.")
         except Exception as e:
-            logging.error(f"Error installing dependencies: {e}")
+            logging.error(f"Error installing dependencies on {self.ip}: {e}")
             raise e
 
     def _connect(self):
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(self.ip, username=self.user, password=self.password)
-        return ssh
+        # One SSH session per server, opened on first use and shared by every command and transfer
+        with self._lock:
+            transport = self._ssh.get_transport() if self._ssh else None
+            if transport is None or not transport.is_active():
+                ssh = paramiko.SSHClient()
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh.connect(self.ip, port=self.port, username=self.user, password=self.password)
+                ssh.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
+                self._ssh = ssh
+            return self._ssh
+
+    def open_channel(self):
+        return self._connect().get_transport().open_session()
+
+    def close(self):
+        with self._lock:
+            if self._ssh:
+                self._ssh.close()
+                self._ssh = None
+
+    def execute_commands(self, commands, check=True):
+        # Every command gets its own channel on the shared session, all opened before any result
+        # is awaited, so independent commands cost one round trip instead of one each
+        channels = []
+        for command in commands:
+            channel = self.open_channel()
+            channel.exec_command(command)
+            channels.append(channel)
+        results = []
+        for command, channel, (output, error) in zip(commands, channels, self._drain(channels)):
+            exit_status = channel.recv_exit_status()
+            channel.close()
+            if check and exit_status != 0:
+                raise RemoteCommandError(self.ip, command, exit_status, error)
+            results.append((exit_status, output))
+        return results
+
+    @staticmethod
+    def _drain(channels):
+        # stdout and stderr share each channel's window, so reading one to EOF while the other fills
+        # would stall the remote command; both are read from every channel as data arrives
+        received = {channel: ([], []) for channel in channels}
+        pending = set(channels)
+        while pending:
+            select.select(list(pending), [], [], SSH_READ_POLL_SECONDS)
+            for channel in list(pending):
+                output, error = received[channel]
+                while channel.recv_ready():
+                    output.append(channel.recv(32768))
+                while channel.recv_stderr_ready():
+                    error.append(channel.recv_stderr(32768))
+                if channel.eof_received and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    pending.discard(channel)
+        return [tuple(b"".join(parts).decode(errors="replace") for parts in received[channel]) for channel in channels]
+
+    def _execute_command(self, command):
+        self.execute_commands([command])
+        logging.info(f"Command '{command}' executed successfully on {self.ip}.")
 
-    def _execute_command(self, ssh, command):
-        stdin, stdout, stderr = ssh.exec_command(command)
-        stdout.channel.recv_exit_status()
-        logging.info(f"Command '{command}' executed successfully on the virtual server.")
+    def transfer_files(self, local_paths, remote_dir):
+        try:
+            # All files go over a single SCP channel of the shared session
+            with SCPClient(self._connect().get_transport()) as scp:
+                scp.put(local_paths, remote_dir)
+            logging.info(f"Files {local_paths} transferred to '{remote_dir}' on {self.ip}.")
+        except Exception as e:
+            logging.error(f"Error transferring files to {self.ip}: {e}")
+            raise e
 
     def transfer_file(self, local_path, remote_path):
         try:
-            ssh = self._connect()
-            with SCPClient(ssh.get_transport()) as scp:
+            with SCPClient(self._connect().get_transport()) as scp:
                 scp.put(local_path, remote_path)
-            ssh.close()
-            logging.info(f"File '{local_path}' transferred to '{remote_path}' on the virtual server.")
+            logging.info(f"File '{local_path}' transferred to '{remote_path}' on {self.ip}.")
+        except Exception as e:
+            logging.error(f"Error transferring file to {self.ip}: {e}")
+            raise e
+
+    def sync_artifacts(self, local_paths, remote_dir):
+        try:
+            stats = ArtifactSync(self, remote_dir).sync(local_paths)
+            self.transfer_stats = self.transfer_stats.merge(stats)
+        except Exception as e:
+            logging.error(f"Error syncing artifacts to {self.ip}: {e}")
+            raise e
+
+    def ship_image(self, image):
+        try:
+            stats = ArtifactSync(self, f"/home/{self.user}").ship_image(image)
+            self.transfer_stats = self.transfer_stats.merge(stats)
         except Exception as e:
-            logging.error(f"Error transferring file to the virtual server: {e}")
+            logging.error(f"Error shipping image '{image}' to {self.ip}: {e}")
             raise e
 
-    def deploy_docker_compose(self):
+    def deploy_docker_compose(self, build=True):
         try:
-            ssh = self._connect()
-            self._execute_command(ssh, f"docker-compose -f {DOCKER_COMPOSE_FILE} up -d")
-            ssh.close()
-            logging.info("Docker Compose deployed successfully on the virtual server.")
+            # A shipped image is used as-is instead of being rebuilt on the server
+            self._execute_command(f"docker-compose -f {DOCKER_COMPOSE_FILE} up -d" + ("" if build else " --no-build"))
+            logging.info(f"Docker Compose deployed successfully on {self.ip}.")
         except Exception as e:
-            logging.error(f"Error deploying Docker Compose on the virtual server: {e}")
+            logging.error(f"Error deploying Docker Compose on {self.ip}: {e}")
             raise e
 
+
+class HostDeployResult:
+    def __init__(self, host, status, elapsed=0.0, phases=None, error=None, transfer=None):
+        self.host = host
+        self.status = status
+        self.elapsed = elapsed
+        self.phases = phases or {}
+        self.error = error
+        self.transfer = transfer or TransferStats()
+
+
+def parse_host(host):
+    name, _, port = host.partition(":")
+    return name, int(port) if port else VSERVER_PORT
+
+
+def deploy_host(host, user=VSERVER_USER, password=VSERVER_PASSWORD, ship_image=False):
+    name, port = parse_host(host)
+    phases = {}
+
+    def phase(label, fn, *args):
+        started = time.monotonic()
+        fn(*args)
+        phases[label] = round(time.monotonic() - started, 3)
+
+    with VirtualServerManager(name, user, password, port) as vserver_manager:
+        phase("provision", vserver_manager.provision_server)
+        phase("install_dependencies", vserver_manager.install_dependencies)
+        artifacts = [DOCKERFILE, DOCKER_COMPOSE_FILE]
+        if ship_image:
+            phase("ship_image", vserver_manager.ship_image, DOCKER_IMAGE_NAME)
+        else:
+            artifacts.extend(path for path in (THEME_ARTIFACTS, THEME_ASSET_ARTIFACTS) if os.path.isdir(path))
+        phase("sync", vserver_manager.sync_artifacts, artifacts, f"/home/{user}")
+        phase("deploy", vserver_manager.deploy_docker_compose, not ship_image)
+    return phases, vserver_manager.transfer_stats
+
+
+class MultiHostDeployer:
+    def __init__(self, hosts, deploy_fn=deploy_host, max_parallel=DEPLOY_MAX_PARALLEL, batch_size=None):
+        self.hosts = hosts
+        self.deploy_fn = deploy_fn
+        self.max_parallel = max_parallel
+        # Rolling mode: deploy batch_size hosts at a time and stop before the next batch if one fails
+        self.batch_size = batch_size
+
+    def _deploy_one(self, host):
+        started = time.monotonic()
+        try:
+            phases, transfer = self.deploy_fn(host)
+        except Exception as e:
+            logging.error(f"Deployment to {host} failed: {e}")
+            return HostDeployResult(host, "failed", time.monotonic() - started, error=str(e))
+        logging.info(f"Deployment to {host} finished in {time.monotonic() - started:.2f}s {phases}.")
+        return HostDeployResult(host, "succeeded", time.monotonic() - started, phases, transfer=transfer)
+
+    def run(self):
+        if not self.hosts:
+            return []
+        batch_size = self.batch_size or len(self.hosts)
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            for offset in range(0, len(self.hosts), batch_size):
+                batch = self.hosts[offset:offset + batch_size]
+                results.extend(pool.map(self._deploy_one, batch))
+                if self.batch_size and any(result.status == "failed" for result in results):
+                    skipped = self.hosts[offset + batch_size:]
+                    if skipped:
+                        logging.error(f"Rolling deployment halted; {len(skipped)} hosts not deployed: {', '.join(skipped)}")
+                    results.extend(HostDeployResult(host, "skipped") for host in skipped)
+                    break
+        return results
+
+    @staticmethod
+    def report(results):
+        for result in results:
+            detail = result.error or " ".join(f"{name}={elapsed}s" for name, elapsed in result.phases.items())
+            logging.info(f"{result.host:<30} {result.status:<9} {result.elapsed:7.2f}s  {detail}  {result.transfer.describe()}")
+        failed = [result.host for result in results if result.status != "succeeded"]
+        total = TransferStats()
+        for result in results:
+            total = total.merge(result.transfer)
+        logging.info(f"{len(results) - len(failed)} of {len(results)} hosts deployed; {total.describe()}.")
+        return failed
+
 def create_docker_compose_file():
     with open(DOCKER_COMPOSE_FILE, 'w') as file:
         file.write(DOCKER_COMPOSE_CONTENT)
@@ -127,18 +329,31 @@ def create_dockerfile():
         file.write(DOCKERFILE_CONTENT)
     logging.info("Dockerfile created successfully.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build Keycloak and deploy it to one or more virtual servers.")
+    parser.add_argument("--hosts", nargs="+", default=VSERVER_HOSTS, help="host[:port] of each server")
+    parser.add_argument("--max-parallel", type=int, default=DEPLOY_MAX_PARALLEL, help="Hosts deployed at the same time")
+    parser.add_argument("--rolling", type=int, metavar="BATCH_SIZE",
+                        help="Deploy BATCH_SIZE hosts at a time and stop at the first failed batch")
+    parser.add_argument("--ship-image", action="store_true",
+                        help="Build the image locally and stream it to each host instead of building it there")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     try:
         AngularBuilder.build_and_deploy()
+        build_theme_assets()
         create_dockerfile()
         create_docker_compose_file()
 
-        vserver_manager = VirtualServerManager(VSERVER_IP, VSERVER_USER, VSERVER_PASSWORD)
-        vserver_manager.provision_server()
-        vserver_manager.install_dependencies()
-        vserver_manager.transfer_file(DOCKERFILE, f'/home/{VSERVER_USER}/{DOCKERFILE}')
-        vserver_manager.transfer_file(DOCKER_COMPOSE_FILE, f'/home/{VSERVER_USER}/{DOCKER_COMPOSE_FILE}')
-        vserver_manager.deploy_docker_compose()
+        if args.ship_image:
+            DockerManager.build_image()
+        deploy_fn = functools.partial(deploy_host, ship_image=args.ship_image)
+        deployer = MultiHostDeployer(args.hosts, deploy_fn, max_parallel=args.max_parallel, batch_size=args.rolling)
+        failed = MultiHostDeployer.report(deployer.run())
+        if failed:
+            raise Exception(f"Deployment failed on {', '.join(failed)}")
 
         logging.info("Virtual server setup and Keycloak deployment completed successfully.")
     except Exception as e:
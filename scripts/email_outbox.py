@@ -0,0 +1,156 @@
+import logging
+import math
+import queue
+import smtplib
+import threading
+import time
+from flask_mail import BadHeaderError, Message
+from metrics import DEPENDENCY_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class EmailOutbox:
+    def __init__(self, mail, app, sender, batch_size=50, flush_interval=1.0, idle_timeout=30.0,
+                 max_retries=5, retry_backoff=2.0):
+        self.mail = mail
+        self.app = app
+        self.sender = sender
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue()
+        # (ready_at, message) for messages the server deferred with a 4xx reply; only the worker touches it
+        self._deferred = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._connection = None
+        self._last_used = 0
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def send(self, subject, recipient, body):
+        msg = Message(subject, sender=self.sender, recipients=[recipient])
+        msg.body = body
+        self._queue.put(msg)
+
+    def send_bulk(self, notices):
+        count = 0
+        for subject, recipient, body in notices:
+            self.send(subject, recipient, body)
+            count += 1
+        logger.info(f"Queued {count} emails.")
+        return count
+
+    def stats(self):
+        return {'queued': self._queue.qsize() + len(self._deferred), 'sent': self.sent, 'failed': self.failed}
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # mail.connect() needs an application context for the whole life of the worker
+        with self.app.app_context():
+            while not (self._stop.is_set() and self._queue.empty() and not self._deferred):
+                self._requeue_deferred()
+                batch = self._next_batch()
+                if batch:
+                    self._deliver(batch)
+                elif self._connection and time.monotonic() - self._last_used > self.idle_timeout:
+                    self._close_connection()
+            self._close_connection()
+
+    def _open_connection(self):
+        if self._connection is None:
+            connection = self.mail.connect()
+            with DEPENDENCY_LATENCY.time(dependency='smtp', operation='connect'):
+                connection.__enter__()
+            self._connection = connection
+            logger.info("Opened SMTP connection.")
+        return self._connection
+
+    def _close_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._connection = None
+
+    def _requeue_deferred(self):
+        # On shutdown deferred messages get their remaining attempts straight away
+        now = math.inf if self._stop.is_set() else time.monotonic()
+        ready = [msg for ready_at, msg in self._deferred if ready_at <= now]
+        self._deferred = [(ready_at, msg) for ready_at, msg in self._deferred if ready_at > now]
+        for msg in ready:
+            self._queue.put(msg)
+
+    def _defer(self, msg, error):
+        attempts = getattr(msg, 'outbox_attempts', 0) + 1
+        if attempts > self.max_retries:
+            self.failed += 1
+            logger.error(f"Email to {msg.recipients} still deferred after {self.max_retries} retries: {error}")
+            return
+        msg.outbox_attempts = attempts
+        delay = self.retry_backoff * (2 ** (attempts - 1))
+        self._deferred.append((time.monotonic() + delay, msg))
+        logger.warning(f"Email to {msg.recipients} deferred, retrying in {delay:.1f}s: {error}")
+
+    def _deliver(self, batch):
+        pending = list(batch)
+        attempt = 0
+        while pending:
+            try:
+                connection = self._open_connection()
+                while pending:
+                    msg = pending[0]
+                    try:
+                        with DEPENDENCY_LATENCY.time(dependency='smtp', operation='send'):
+                            connection.send(msg)
+                        self.sent += 1
+                        logger.info(f"Email sent to {msg.recipients[0]} with subject: {msg.subject}")
+                    except (smtplib.SMTPRecipientsRefused, BadHeaderError) as e:
+                        # A bad message must not hold up the rest of the batch
+                        self.failed += 1
+                        logger.error(f"Email to {msg.recipients} rejected: {e}")
+                    except smtplib.SMTPResponseException as e:
+                        # The server answered, so the connection is still good; only 421 means it is closing
+                        if e.smtp_code == 421:
+                            raise
+                        if 400 <= e.smtp_code < 500:
+                            self._defer(msg, e)
+                        else:
+                            self.failed += 1
+                            logger.error(f"Email to {msg.recipients} rejected: {e}")
+                    pending.pop(0)
+                self._last_used = time.monotonic()
+            except (smtplib.SMTPException, OSError) as e:
+                self._close_connection()
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failed += len(pending)
+                    logger.error(f"Dropping {len(pending)} emails after {self.max_retries} retries: {e}")
+                    return
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"SMTP error, reconnecting in {delay:.1f}s: {e}")
+                time.sleep(delay)
@@ -0,0 +1,120 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_INDEX_PATH = os.getenv('EXPIRY_INDEX_PATH', 'expiry_index.db')
+
+
+class ExpiryIndex:
+    def __init__(self, path=EXPIRY_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS subscription_expiry (
+                user_id TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL,
+                claimed_until REAL
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(subscription_expiry)")]
+        if 'claimed_until' not in columns:
+            self._conn.execute("ALTER TABLE subscription_expiry ADD COLUMN claimed_until REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_subscription_expiry_expires_at ON subscription_expiry (expires_at)")
+
+    def record(self, user_id, expiration_date):
+        if isinstance(expiration_date, str):
+            expiration_date = datetime.fromisoformat(expiration_date)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO subscription_expiry (user_id, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET expires_at = excluded.expires_at, claimed_until = NULL",
+                (user_id, expiration_date.timestamp())
+            )
+
+    def remove(self, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM subscription_expiry WHERE user_id = ?", (user_id,))
+
+    def claim_due(self, now=None, limit=1000, lease=300):
+        """Claim up to `limit` due entries for `lease` seconds and return them as (user_id, expires_at).
+
+        Claimed entries stay in the index until complete() removes them, so an entry whose
+        processing failed or crashed becomes due again once its claim runs out.
+        """
+        now = (now or datetime.now()).timestamp()
+        claimed_until = time.time() + lease
+        with self._lock:
+            # Select and claim in one transaction so two jobs never claim the same entry
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT user_id, expires_at FROM subscription_expiry "
+                    "WHERE expires_at <= ? AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY expires_at LIMIT ?",
+                    (now, time.time(), limit)
+                ).fetchall()
+                self._conn.executemany("UPDATE subscription_expiry SET claimed_until = ? WHERE user_id = ?",
+                                       [(claimed_until, user_id) for user_id, _ in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(user_id, datetime.fromtimestamp(expires_at)) for user_id, expires_at in rows]
+
+    def complete(self, entries):
+        # Entries re-recorded with a new expiry since they were claimed are kept
+        with self._lock:
+            self._conn.executemany("DELETE FROM subscription_expiry WHERE user_id = ? AND expires_at = ?",
+                                   [(user_id, expires_at.timestamp()) for user_id, expires_at in entries])
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM subscription_expiry").fetchone()[0]
+
+    def rebuild_from_keycloak(self, admin_client, page_size=500):
+        entries = []
+        for user in admin_client.iter_users(page_size=page_size, briefRepresentation='false'):
+            expiration_date = (user.get('attributes') or {}).get('expiration_date')
+            if not expiration_date or not expiration_date[0]:
+                continue
+            try:
+                entries.append((user['id'], datetime.fromisoformat(expiration_date[0]).timestamp()))
+            except ValueError:
+                logger.warning(f"Skipping invalid expiration date '{expiration_date[0]}' for user {user['id']}.")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM subscription_expiry")
+            self._conn.executemany("INSERT INTO subscription_expiry (user_id, expires_at) VALUES (?, ?)", entries)
+            self._conn.execute("COMMIT")
+        logger.info(f"Expiry index rebuilt with {len(entries)} subscriptions.")
+        return len(entries)
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    from keycloak_admin_client import KeycloakAdminClient
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the local subscription expiry index.")
+    parser.add_argument("command", choices=["rebuild", "count"])
+    parser.add_argument("--path", default=EXPIRY_INDEX_PATH)
+    args = parser.parse_args()
+
+    index = ExpiryIndex(args.path)
+    if args.command == "rebuild":
+        index.rebuild_from_keycloak(KeycloakAdminClient.from_env())
+    else:
+        logging.info(f"{index.count()} subscriptions in the expiry index.")
+    index.close()
+
+if __name__ == "__main__":
+    main()
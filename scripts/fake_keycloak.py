@@ -0,0 +1,389 @@
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# In-process stand-in for the parts of the Keycloak API the gateway and scripts call
+
+# UserRepresentation fields a PUT /users/{id} can change; Keycloak ignores any other top-level key
+USER_FIELDS = {'username', 'email', 'firstName', 'lastName', 'enabled', 'emailVerified', 'attributes', 'requiredActions'}
+# Realm resources partialImport and realm creation handle; everything else in a realm is a setting
+REALM_RESOURCES = ('users', 'groups', 'clients', 'identityProviders')
+# Keycloak returns these masked, never as written
+MASKED_SECRET = '**********'
+
+
+class FakeKeycloakHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _route(self, method):
+        fake = self.server.fake
+        # Counted on arrival, so requests the client gave up on are still seen
+        fake.request_count += 1
+        fake.requests_by_method[method] += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlparse(self.path)
+        body = self._read_body()
+        for pattern, route_method, handler in fake.routes:
+            match = re.fullmatch(pattern, url.path)
+            if match and route_method == method:
+                status, payload = handler(match, parse_qs(url.query), body, self.headers)
+                return self._send(status, payload)
+        return self._send(404, {'error': 'not found'})
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeKeycloak:
+    def __init__(self, realm='myrealm', latency=0.0, host='127.0.0.1', port=0):
+        self.realm = realm
+        self.latency = latency
+        self.users = {}
+        self._user_list = None
+        self._usernames = {}
+        self._users_lock = threading.Lock()
+        self.request_count = 0
+        self.requests_by_method = Counter()
+        # None until the realm exists; the realm is there from the start unless a test removes it
+        self.realm_settings = {'realm': realm, 'enabled': True}
+        self.groups = {}
+        self.clients = {}
+        self.identity_providers = {}
+        # Status to return for every admin write, e.g. 503 to simulate an outage mid-import
+        self.fail_writes_with = None
+        self.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = uuid.uuid4().hex
+        self.routes = [
+            (r'/realms/(?P<realm>[^/]+)/protocol/openid-connect/token', 'POST', self._token),
+            (rf'/realms/{realm}/protocol/openid-connect/certs', 'GET', self._certs),
+            (rf'/realms/{realm}/protocol/openid-connect/userinfo', 'GET', self._userinfo),
+            (rf'/admin/realms/{realm}/users', 'GET', self._list_users),
+            (rf'/admin/realms/{realm}/users', 'POST', self._create_user),
+            (rf'/admin/realms/{realm}/partialImport', 'POST', self._partial_import),
+            (rf'/admin/realms/{realm}/users/(?P<user_id>[^/]+)', 'GET', self._get_user),
+            (rf'/admin/realms/{realm}/users/(?P<user_id>[^/]+)', 'PUT', self._update_user),
+            (r'/admin/realms', 'POST', self._create_realm),
+            (rf'/admin/realms/{realm}', 'GET', self._get_realm),
+            (rf'/admin/realms/{realm}', 'PUT', self._update_realm),
+            (rf'/admin/realms/{realm}/groups', 'GET', self._list_groups),
+            (rf'/admin/realms/{realm}/groups', 'POST', self._create_group),
+            (rf'/admin/realms/{realm}/groups/(?P<id>[^/]+)', 'PUT', self._update_group),
+            (rf'/admin/realms/{realm}/clients', 'GET', self._list_clients),
+            (rf'/admin/realms/{realm}/clients', 'POST', self._create_client),
+            (rf'/admin/realms/{realm}/clients/(?P<id>[^/]+)', 'PUT', self._update_client),
+            (rf'/admin/realms/{realm}/clients/(?P<id>[^/]+)/protocol-mappers/models', 'POST', self._create_mapper),
+            (rf'/admin/realms/{realm}/clients/(?P<id>[^/]+)/protocol-mappers/models/(?P<mapper_id>[^/]+)', 'PUT',
+             self._update_mapper),
+            (rf'/admin/realms/{realm}/identity-provider/instances', 'GET', self._list_identity_providers),
+            (rf'/admin/realms/{realm}/identity-provider/instances', 'POST', self._create_identity_provider),
+            (rf'/admin/realms/{realm}/identity-provider/instances/(?P<alias>[^/]+)', 'PUT', self._update_identity_provider),
+        ]
+        self.server = FakeServer((host, port), FakeKeycloakHandler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_user(self, username, attributes=None, user_id=None, email=None):
+        user_id = user_id or str(uuid.uuid4())
+        with self._users_lock:
+            self.users[user_id] = {'id': user_id, 'username': username, 'enabled': True, 'attributes': attributes or {}}
+            self._usernames[username] = user_id
+            if email:
+                self.users[user_id]['email'] = email
+            self._user_list = None
+        return user_id
+
+    def _insert_user(self, representation):
+        # Returns the new id, or None when the username is taken
+        with self._users_lock:
+            if representation['username'] in self._usernames:
+                return None
+            user_id = str(uuid.uuid4())
+            self.users[user_id] = {'attributes': {}, **representation, 'id': user_id}
+            self.users[user_id].pop('credentials', None)
+            self._usernames[representation['username']] = user_id
+            self._user_list = None
+            return user_id
+
+    @property
+    def issuer(self):
+        return f"{self.url}/realms/{self.realm}"
+
+    def issue_token(self, sub, email=None, audience='account', azp='myclient', lifetime=300, **claims):
+        now = int(time.time())
+        payload = {'sub': sub, 'iss': self.issuer, 'aud': audience, 'azp': azp, 'typ': 'Bearer', 'iat': now,
+                   'exp': now + lifetime, 'email': email or f"{sub}@example.com", **claims}
+        return jwt.encode(payload, self.signing_key, algorithm='RS256', headers={'kid': self.kid})
+
+    def rotate_key(self):
+        # Tokens signed afterwards carry a kid that verifiers have not fetched yet
+        self.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = uuid.uuid4().hex
+
+    def _certs(self, match, query, body, headers):
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.signing_key.public_key()))
+        jwk.update({'kid': self.kid, 'use': 'sig', 'alg': 'RS256'})
+        return 200, {'keys': [jwk]}
+
+    def _token(self, match, query, body, headers):
+        return 200, {'access_token': uuid.uuid4().hex, 'expires_in': 300, 'token_type': 'Bearer'}
+
+    def _userinfo(self, match, query, body, headers):
+        token = (headers.get('Authorization') or '').removeprefix('Bearer ')
+        try:
+            claims = jwt.decode(token, self.signing_key.public_key(), algorithms=['RS256'], options={'verify_aud': False})
+        except jwt.InvalidTokenError:
+            return 401, {'error': 'invalid_token'}
+        return 200, {name: value for name, value in claims.items() if name not in ('iss', 'aud', 'azp', 'iat', 'exp')}
+
+    def _matches(self, user, search):
+        # q=key:value pairs; an empty value only requires the attribute to be present
+        attributes = user.get('attributes') or {}
+        for term in search.split():
+            name, _, value = term.partition(':')
+            values = attributes.get(name)
+            if not values or (value and value not in values):
+                return False
+        return True
+
+    def _list_users(self, match, query, body, headers):
+        first = int(query.get('first', ['0'])[0])
+        page_size = int(query.get('max', ['100'])[0])
+        if self._user_list is None:
+            self._user_list = list(self.users.values())
+        users = self._user_list
+        search = query.get('q', [''])[0]
+        if search:
+            users = [user for user in users if self._matches(user, search)]
+        username = query.get('username', [''])[0]
+        if username:
+            exact = query.get('exact', ['false'])[0] == 'true'
+            users = [user for user in users if user['username'] == username or (not exact and username in user['username'])]
+        return 200, users[first:first + page_size]
+
+    def _create_user(self, match, query, body, headers):
+        if self.fail_writes_with:
+            return self.fail_writes_with, {'error': 'unavailable'}
+        representation = json.loads(body or b'{}')
+        if not representation.get('username'):
+            return 400, {'errorMessage': 'User name is missing'}
+        if self._insert_user(representation) is None:
+            return 409, {'errorMessage': 'User exists with same username'}
+        return 201, None
+
+    def _partial_import(self, match, query, body, headers):
+        if self.fail_writes_with:
+            return self.fail_writes_with, {'error': 'unavailable'}
+        payload = json.loads(body or b'{}')
+        users = payload.get('users') or []
+        if any(not user.get('username') for user in users):
+            # Like Keycloak, one invalid user fails the whole import
+            return 400, {'errorMessage': 'User name is missing'}
+        policy = payload.get('ifResourceExists', 'FAIL')
+        result = {'added': 0, 'skipped': 0, 'overwritten': 0, 'results': []}
+        for user in users:
+            user_id = self._insert_user(user)
+            if user_id is None and policy == 'FAIL':
+                return 409, {'errorMessage': f"User '{user['username']}' already exists"}
+            action = 'ADDED' if user_id else 'SKIPPED'
+            result['added' if user_id else 'skipped'] += 1
+            result['results'].append({'action': action, 'resourceType': 'USER', 'resourceName': user['username'],
+                                      'id': user_id or self._usernames[user['username']]})
+        for field, kind, store, key in (('groups', 'GROUP', self.groups, 'name'),
+                                        ('clients', 'CLIENT', self.clients, 'clientId'),
+                                        ('identityProviders', 'IDP', self.identity_providers, 'alias')):
+            for resource in payload.get(field) or []:
+                existing = self._find(store, key, resource[key])
+                if existing is not None and policy == 'FAIL':
+                    return 409, {'errorMessage': f"{kind} '{resource[key]}' already exists"}
+                if existing is not None and policy == 'SKIP':
+                    action = 'SKIPPED'
+                else:
+                    self._store(store, resource, existing)
+                    action = 'OVERWRITTEN' if existing is not None else 'ADDED'
+                result[action.lower()] += 1
+                result['results'].append({'action': action, 'resourceType': kind, 'resourceName': resource[key]})
+        return 200, result
+
+    @staticmethod
+    def _find(store, key, name):
+        return next((resource for resource in store.values() if resource[key] == name), None)
+
+    def _store(self, store, resource, existing=None):
+        resource = copy.deepcopy(resource)
+        if store is self.identity_providers:
+            store[resource['alias']] = resource
+            return resource
+        resource['id'] = existing['id'] if existing else str(uuid.uuid4())
+        for mapper in resource.get('protocolMappers') or []:
+            mapper.setdefault('id', str(uuid.uuid4()))
+        store[resource['id']] = resource
+        return resource
+
+    def _create_realm(self, match, query, body, headers):
+        representation = json.loads(body or b'{}')
+        if representation.get('realm') != self.realm:
+            return 400, {'errorMessage': 'This fake only serves its own realm'}
+        if self.realm_settings is not None:
+            return 409, {'errorMessage': 'Conflict detected. See logs for details'}
+        self.realm_settings = {'realm': self.realm}
+        self._update_realm(match, query, json.dumps({key: value for key, value in representation.items()
+                                                     if key not in REALM_RESOURCES}).encode(), headers)
+        self._partial_import(match, query, json.dumps({'ifResourceExists': 'FAIL', **{
+            key: representation.get(key) or [] for key in REALM_RESOURCES}}).encode(), headers)
+        return 201, None
+
+    def _get_realm(self, match, query, body, headers):
+        if self.realm_settings is None:
+            return 404, {'error': 'Realm not found.'}
+        realm = copy.deepcopy(self.realm_settings)
+        if 'password' in realm.get('smtpServer', {}):
+            realm['smtpServer']['password'] = MASKED_SECRET
+        return 200, realm
+
+    def _update_realm(self, match, query, body, headers):
+        if self.realm_settings is None:
+            return 404, {'error': 'Realm not found.'}
+        settings = json.loads(body or b'{}')
+        if 'smtpServer' in settings:
+            # Stored as a string map, whatever types were sent
+            settings['smtpServer'] = {name: str(value) for name, value in settings['smtpServer'].items()}
+        self.realm_settings.update(settings)
+        return 204, None
+
+    def _list_groups(self, match, query, body, headers):
+        return 200, [{'subGroups': [], 'path': f"/{group['name']}", **group} for group in self.groups.values()]
+
+    def _create_group(self, match, query, body, headers):
+        group = json.loads(body or b'{}')
+        if self._find(self.groups, 'name', group['name']) is not None:
+            return 409, {'errorMessage': 'Top level group named already exists.'}
+        self._store(self.groups, group)
+        return 201, None
+
+    def _update_group(self, match, query, body, headers):
+        if match['id'] not in self.groups:
+            return 404, {'error': 'Could not find group by id'}
+        self.groups[match['id']] = {**json.loads(body or b'{}'), 'id': match['id']}
+        return 204, None
+
+    def _list_clients(self, match, query, body, headers):
+        client_id = query.get('clientId', [''])[0]
+        return 200, [client for client in self.clients.values() if not client_id or client['clientId'] == client_id]
+
+    def _create_client(self, match, query, body, headers):
+        client = json.loads(body or b'{}')
+        if self._find(self.clients, 'clientId', client['clientId']) is not None:
+            return 409, {'errorMessage': f"Client {client['clientId']} already exists"}
+        client['attributes'] = {name: str(value) for name, value in (client.get('attributes') or {}).items()}
+        self._store(self.clients, client)
+        return 201, None
+
+    def _update_client(self, match, query, body, headers):
+        existing = self.clients.get(match['id'])
+        if existing is None:
+            return 404, {'error': 'Could not find client'}
+        client = json.loads(body or b'{}')
+        # Mappers have their own endpoints; a client PUT leaves them as they are
+        client.pop('protocolMappers', None)
+        self.clients[match['id']] = {**existing, **client, 'id': match['id']}
+        return 204, None
+
+    def _create_mapper(self, match, query, body, headers):
+        client = self.clients.get(match['id'])
+        if client is None:
+            return 404, {'error': 'Could not find client'}
+        mapper = {**json.loads(body or b'{}'), 'id': str(uuid.uuid4())}
+        client.setdefault('protocolMappers', []).append(mapper)
+        return 201, None
+
+    def _update_mapper(self, match, query, body, headers):
+        client = self.clients.get(match['id'])
+        mappers = (client or {}).get('protocolMappers') or []
+        for index, mapper in enumerate(mappers):
+            if mapper['id'] == match['mapper_id']:
+                mappers[index] = {**json.loads(body or b'{}'), 'id': mapper['id']}
+                return 204, None
+        return 404, {'error': 'Model not found'}
+
+    def _list_identity_providers(self, match, query, body, headers):
+        providers = copy.deepcopy(list(self.identity_providers.values()))
+        for provider in providers:
+            if 'clientSecret' in provider.get('config', {}):
+                provider['config']['clientSecret'] = MASKED_SECRET
+        return 200, providers
+
+    def _create_identity_provider(self, match, query, body, headers):
+        provider = json.loads(body or b'{}')
+        if provider['alias'] in self.identity_providers:
+            return 409, {'errorMessage': 'Identity Provider already exists'}
+        self._store(self.identity_providers, provider)
+        return 201, None
+
+    def _update_identity_provider(self, match, query, body, headers):
+        if match['alias'] not in self.identity_providers:
+            return 404, {'error': 'Could not find identity provider'}
+        self.identity_providers[match['alias']] = json.loads(body or b'{}')
+        return 204, None
+
+    def _get_user(self, match, query, body, headers):
+        user = self.users.get(match['user_id'])
+        return (200, user) if user else (404, {'error': 'User not found'})
+
+    def _update_user(self, match, query, body, headers):
+        user = self.users.get(match['user_id'])
+        if not user:
+            return 404, {'error': 'User not found'}
+        # Like Keycloak, attributes sent here replace the whole map
+        user.update({key: value for key, value in json.loads(body or b'{}').items() if key in USER_FIELDS})
+        return 204, None
@@ -0,0 +1,157 @@
+import gzip
+import os
+import re
+import shlex
+import tarfile
+import socket
+import threading
+import time
+import paramiko
+
+# In-process SSH server for exercising deploy_to_vs_server.py without a real virtual server.
+# Commands are recorded, not executed; `scp -t` uploads are written below a local root directory.
+
+# paramiko replies to an exec request only after check_channel_exec_request returns; a command that
+# answered sooner could close its channel before the client saw the reply and fail with 'Channel closed'
+EXEC_REPLY_GRACE_SECONDS = 0.02
+
+
+class FakeSSHServerInterface(paramiko.ServerInterface):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if (username, password) == self.fake.credentials else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.fake.handle_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakeSSHServer:
+    def __init__(self, root, username="deploy", password="secret", latency=0.0, host="127.0.0.1", port=0):
+        self.root = root
+        # The user's home directory exists on any real host, so uploads into it behave the same here
+        os.makedirs(os.path.join(root, "home", username), exist_ok=True)
+        self.credentials = (username, password)
+        # Seconds each command takes, to make round trips visible like on a remote host
+        self.latency = latency
+        # Regex -> (exit status, stdout[, stderr]) for canned command results; anything else exits 0
+        self.responses = {}
+        self.commands = []
+        self.connections = 0
+        # Uncompressed sizes of image archives received by `docker load`
+        self.loaded_images = []
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.socket = socket.create_server((host, port))
+        self._stopped = threading.Event()
+
+    @property
+    def address(self):
+        host, port = self.socket.getsockname()[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.socket.close()
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=FakeSSHServerInterface(self))
+
+    def handle_command(self, channel, command):
+        self.commands.append(command)
+        time.sleep(max(self.latency, EXEC_REPLY_GRACE_SECONDS))
+        if command.startswith("scp "):
+            return self._scp_sink(channel, command.split()[-1])
+        exit_status, output, error = 0, "", ""
+        for pattern, response in self.responses.items():
+            if re.search(pattern, command):
+                exit_status, output, error = (*response, "")[:3]
+                break
+        else:
+            exit_status, output = self._builtin(channel, command)
+        # stderr goes first, so a client reading stdout to EOF before stderr would stall here
+        channel.sendall_stderr(error.encode())
+        channel.sendall(output.encode())
+        channel.send_exit_status(exit_status)
+        channel.close()
+
+    def _local_path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip("/"))
+
+    def _builtin(self, channel, command):
+        # The few commands the deploy needs to read and write real state
+        if command.startswith("cat "):
+            path = self._local_path(shlex.split(command)[1])
+            if not os.path.isfile(path):
+                return 1, ""
+            with open(path) as file:
+                return 0, file.read()
+        match = re.search(r"tar -xzf - -C (\S+)", command)
+        if match:
+            target = self._local_path(shlex.split(match.group(1))[0])
+            os.makedirs(target, exist_ok=True)
+            with tarfile.open(fileobj=channel.makefile("rb"), mode="r|gz") as archive:
+                archive.extractall(target, filter="data")
+            return 0, ""
+        if "docker load" in command:
+            self.loaded_images.append(len(gzip.decompress(channel.makefile("rb").read())))
+            return 0, "Loaded image"
+        return 0, ""
+
+    def _read_line(self, channel):
+        line = b""
+        while not line.endswith(b"\n"):
+            chunk = channel.recv(1)
+            if not chunk:
+                return None
+            line += chunk
+        return line.decode().rstrip("\n")
+
+    def _scp_sink(self, channel, target):
+        # Enough of the scp protocol for SCPClient.put: file (C), time (T) and directory (D/E) records
+        target = os.path.join(self.root, target.strip("'\"").lstrip("/"))
+        directory = target
+        channel.sendall(b"\0")
+        while True:
+            line = self._read_line(channel)
+            if line is None:
+                break
+            if line.startswith("C"):
+                _, size, name = line[1:].split(" ", 2)
+                path = os.path.join(directory, name) if os.path.isdir(directory) else directory
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                channel.sendall(b"\0")
+                remaining = int(size)
+                with open(path, "wb") as file:
+                    while remaining:
+                        chunk = channel.recv(min(remaining, 32768))
+                        file.write(chunk)
+                        remaining -= len(chunk)
+                channel.recv(1)
+            elif line.startswith("D"):
+                directory = os.path.join(directory, line.split(" ", 2)[2])
+                os.makedirs(directory, exist_ok=True)
+            elif line.startswith("E"):
+                directory = os.path.dirname(directory)
+            channel.sendall(b"\0")
+        channel.send_exit_status(0)
+        channel.close()
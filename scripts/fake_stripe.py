@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from fake_keycloak import FakeServer
+
+# In-process stand-in for the Stripe endpoints the gateway calls
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if fake.latency:
+            time.sleep(fake.latency)
+        if self.path != '/v1/checkout/sessions':
+            status, body = 404, {'error': {'message': 'Unrecognized request URL', 'type': 'invalid_request_error'}}
+        else:
+            fake.sessions_created += 1
+            status, body = 200, {'id': f"cs_test_{uuid.uuid4().hex}", 'object': 'checkout.session'}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeStripe:
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.sessions_created = 0
+        self.server = FakeServer((host, port), FakeStripeHandler)
+        self.server.fake = self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @staticmethod
+    def sign_webhook(payload, secret, timestamp=None):
+        # Same scheme as Stripe: HMAC-SHA256 over "<timestamp>.<payload>"
+        timestamp = int(timestamp or time.time())
+        signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return f"t={timestamp},v1={signature}"
+
+    @staticmethod
+    def checkout_completed_event(user_id, ai_tokens=10000, storage=30000, email=None):
+        session = {
+            'id': f"cs_test_{uuid.uuid4().hex}",
+            'object': 'checkout.session',
+            'subscription': f"sub_{uuid.uuid4().hex[:14]}",
+            'metadata': {'user_id': user_id, 'ai_tokens': str(ai_tokens), 'storage': str(storage)},
+            'customer_details': {'email': email}
+        }
+        return {
+            'id': f"evt_{uuid.uuid4().hex}",
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'created': int(time.time()),
+            'data': {'object': session}
+        }
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
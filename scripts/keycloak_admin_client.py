@@ -0,0 +1,169 @@
+import logging
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import DEPENDENCY_LATENCY
+
+#pip install requests
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+
+class KeycloakAdminError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class KeycloakAdminClient:
+    def __init__(self, server_url, realm, client_id='admin-cli', client_secret=None, username=None, password=None,
+                 token_realm=None, pool_size=10, max_retries=4, backoff_factor=0.5, refresh_margin=30,
+                 timeout=10, verify=True):
+        self.server_url = (server_url or '').rstrip('/')
+        self.realm = realm
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.username = username
+        self.password = password
+        self.token_realm = token_realm or realm
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+
+        # One keep-alive pool shared by every caller of this client
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            server_url=os.getenv('KEYCLOAK_URL'),
+            realm=os.getenv('KEYCLOAK_REALM'),
+            client_id=os.getenv('KEYCLOAK_ADMIN_CLIENT_ID', 'admin-cli'),
+            client_secret=os.getenv('KEYCLOAK_ADMIN_CLIENT_SECRET'),
+            pool_size=int(os.getenv('KEYCLOAK_ADMIN_POOL_SIZE', 10)),
+            **kwargs
+        )
+
+    @property
+    def token_url(self):
+        return f"{self.server_url}/realms/{self.token_realm}/protocol/openid-connect/token"
+
+    @property
+    def admin_url(self):
+        return f"{self.server_url}/admin/realms/{self.realm}"
+
+    def _request_token(self):
+        if self.client_secret:
+            data = {'grant_type': 'client_credentials', 'client_id': self.client_id, 'client_secret': self.client_secret}
+        else:
+            data = {'grant_type': 'password', 'client_id': self.client_id, 'username': self.username, 'password': self.password}
+        try:
+            with DEPENDENCY_LATENCY.time(dependency='keycloak_admin', operation='token') as labels:
+                response = self.session.post(self.token_url, data=data, timeout=self.timeout)
+                labels['status'] = str(response.status_code)
+        except requests.RequestException as e:
+            raise KeycloakAdminError(f"Error obtaining admin token: {e}")
+        if response.status_code != 200:
+            raise KeycloakAdminError(f"Error obtaining admin token: {response.status_code} {response.text}", response.status_code)
+        try:
+            token = response.json()
+        except ValueError as e:
+            raise KeycloakAdminError(f"Unreadable admin token response: {e}")
+        self._token = token['access_token']
+        self._token_expires_at = time.monotonic() + int(token.get('expires_in', 60))
+        logger.info(f"Obtained Keycloak admin token valid for {token.get('expires_in')} seconds.")
+
+    def get_token(self, force_refresh=False):
+        if not force_refresh and self._token and time.monotonic() < self._token_expires_at - self.refresh_margin:
+            return self._token
+        stale_token = self._token
+        with self._token_lock:
+            # Only the first thread through the lock refreshes; the others reuse its token
+            fresh = self._token and time.monotonic() < self._token_expires_at - self.refresh_margin
+            if not fresh or (force_refresh and self._token == stale_token):
+                self._request_token()
+            return self._token
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff_factor * (2 ** attempt) + random.uniform(0, self.backoff_factor)
+
+    def request(self, method, path, **kwargs):
+        method = method.upper()
+        url = path if path.startswith('http') else f"{self.admin_url}{path}"
+        kwargs.setdefault('timeout', self.timeout)
+        extra_headers = kwargs.pop('headers', {})
+        retryable = method in IDEMPOTENT_METHODS
+        token_refreshed = False
+        attempt = 0
+        while True:
+            headers = {'Authorization': f"Bearer {self.get_token()}", **extra_headers}
+            try:
+                with DEPENDENCY_LATENCY.time(dependency='keycloak_admin', operation=method) as labels:
+                    response = self.session.request(method, url, headers=headers, **kwargs)
+                    labels['status'] = str(response.status_code)
+            except requests.RequestException as e:
+                # A timed-out write may already have been applied, so only idempotent methods are retried
+                transient = isinstance(e, (requests.ConnectionError, requests.Timeout))
+                if not (transient and retryable) or attempt >= self.max_retries:
+                    raise KeycloakAdminError(f"Error calling {method} {url}: {e}")
+                delay = self._backoff(attempt)
+                logger.warning(f"{type(e).__name__} on {method} {url}, retrying in {delay:.2f}s: {e}")
+            else:
+                if response.status_code == 401 and not token_refreshed:
+                    token_refreshed = True
+                    self.get_token(force_refresh=True)
+                    continue
+                # 429 means the request was never processed, so it is safe to retry for any method
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries \
+                        or not (retryable or response.status_code == 429):
+                    return response
+                delay = self._backoff(attempt, response)
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.2f}s.")
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def iter_users(self, page_size=100, **params):
+        # Pages through /users with first/max so only one page is held in memory at a time
+        first = 0
+        while True:
+            response = self.get('/users', params={**params, 'first': first, 'max': page_size})
+            if response.status_code != 200:
+                raise KeycloakAdminError(f"Error fetching users: {response.status_code} {response.text}", response.status_code)
+            page = response.json()
+            yield from page
+            if len(page) < page_size:
+                return
+            first += page_size
+
+    def close(self):
+        self.session.close()
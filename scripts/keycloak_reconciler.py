@@ -0,0 +1,164 @@
+import logging
+from keycloak_admin_client import KeycloakAdminError
+
+logger = logging.getLogger(__name__)
+
+# Keycloak never returns these in readable form, so they cannot be diffed
+SECRET_FIELDS = {"password", "clientSecret", "credentials"}
+
+
+def _normalize(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def changed_fields(desired, current, prefix="", skip_unknown=False):
+    # Only the fields we manage are compared; anything else Keycloak returns is left alone
+    changes = []
+    for name, value in desired.items():
+        path = f"{prefix}{name}"
+        if name in SECRET_FIELDS:
+            continue
+        if name not in current:
+            if not skip_unknown:
+                changes.append(path)
+            continue
+        if isinstance(value, dict) and isinstance(current[name], dict):
+            changes.extend(changed_fields(value, current[name], f"{path}."))
+        elif isinstance(value, list) and isinstance(current[name], list):
+            if [_normalize(item) for item in value] != [_normalize(item) for item in current[name]]:
+                changes.append(path)
+        elif _normalize(value) != _normalize(current[name]):
+            changes.append(path)
+    return changes
+
+
+class Change:
+    def __init__(self, action, kind, name, method, path, payload, fields=None):
+        self.action = action
+        self.kind = kind
+        self.name = name
+        self.method = method
+        self.path = path
+        self.payload = payload
+        self.fields = fields or []
+
+    def describe(self):
+        symbol = "+" if self.action == "create" else "~"
+        detail = f" ({', '.join(self.fields)})" if self.fields else ""
+        return f"{symbol} {self.action} {self.kind} '{self.name}'{detail}"
+
+
+class KeycloakReconciler:
+    def __init__(self, admin_client):
+        self.admin_client = admin_client
+
+    def _get_json(self, path, **params):
+        response = self.admin_client.get(path, params=params)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise KeycloakAdminError(f"Error reading {path}: {response.status_code} {response.text}", response.status_code)
+        return response.json()
+
+    def fetch_current(self, desired):
+        realm = self._get_json("")
+        if realm is None:
+            return None
+        client_ids = [client["clientId"] for client in desired["clients"]]
+        current = {
+            "realm": realm,
+            "clients": {},
+            "groups": {group["name"]: group for group in self._get_json("/groups", briefRepresentation="false") or []},
+            "identityProviders": {idp["alias"]: idp for idp in self._get_json("/identity-provider/instances") or []},
+            "users": {}
+        }
+        for client_id in client_ids:
+            # Client representations include their protocol mappers
+            for client in self._get_json("/clients", clientId=client_id) or []:
+                current["clients"][client["clientId"]] = client
+        for user in desired["users"]:
+            matches = self._get_json("/users", username=user["username"], exact="true", briefRepresentation="true") or []
+            if matches:
+                current["users"][user["username"]] = matches[0]
+        return current
+
+    def plan(self, desired):
+        current = self.fetch_current(desired)
+        realm_name = desired["realm"]["realm"]
+        if current is None:
+            # A missing realm is created in one call from the full desired representation
+            return [Change("create", "realm", realm_name, "POST", f"{self.admin_client.server_url}/admin/realms", {**desired["realm"], **{
+                key: desired[key] for key in ("clients", "groups", "users", "identityProviders")
+            }})]
+
+        changes = []
+        realm_fields = changed_fields(desired["realm"], current["realm"], skip_unknown=True)
+        if realm_fields:
+            payload = {field: desired["realm"][field] for field in {path.split(".")[0] for path in realm_fields}}
+            changes.append(Change("update", "realm", realm_name, "PUT", "", payload, realm_fields))
+
+        for client in desired["clients"]:
+            changes.extend(self._plan_client(client, current["clients"].get(client["clientId"])))
+
+        for group in desired["groups"]:
+            existing = current["groups"].get(group["name"])
+            if existing is None:
+                changes.append(Change("create", "group", group["name"], "POST", "/groups", group))
+                continue
+            fields = changed_fields(group, existing)
+            if fields:
+                changes.append(Change("update", "group", group["name"], "PUT", f"/groups/{existing['id']}", {**existing, **group}, fields))
+
+        for user in desired["users"]:
+            # Existing users are left alone so passwords and memberships changed since setup are kept
+            if user["username"] not in current["users"]:
+                changes.append(Change("create", "user", user["username"], "POST", "/users", user))
+
+        for idp in desired["identityProviders"]:
+            existing = current["identityProviders"].get(idp["alias"])
+            if existing is None:
+                changes.append(Change("create", "identity provider", idp["alias"], "POST", "/identity-provider/instances", idp))
+                continue
+            fields = changed_fields(idp, existing)
+            if fields:
+                payload = {**existing, **idp, "config": {**existing.get("config", {}), **idp["config"]}}
+                changes.append(Change("update", "identity provider", idp["alias"], "PUT",
+                                      f"/identity-provider/instances/{idp['alias']}", payload, fields))
+        return changes
+
+    def _plan_client(self, client, existing):
+        if existing is None:
+            return [Change("create", "client", client["clientId"], "POST", "/clients", client)]
+        changes = []
+        settings = {name: value for name, value in client.items() if name != "protocolMappers"}
+        fields = changed_fields(settings, existing)
+        if fields:
+            payload = {**existing, **settings, "attributes": {**existing.get("attributes", {}), **settings.get("attributes", {})}}
+            payload.pop("protocolMappers", None)
+            changes.append(Change("update", "client", client["clientId"], "PUT", f"/clients/{existing['id']}", payload, fields))
+
+        existing_mappers = {mapper["name"]: mapper for mapper in existing.get("protocolMappers", [])}
+        for mapper in client.get("protocolMappers", []):
+            current_mapper = existing_mappers.get(mapper["name"])
+            base = f"/clients/{existing['id']}/protocol-mappers/models"
+            if current_mapper is None:
+                changes.append(Change("create", "protocol mapper", mapper["name"], "POST", base, mapper))
+                continue
+            fields = changed_fields(mapper, current_mapper)
+            if fields:
+                changes.append(Change("update", "protocol mapper", mapper["name"], "PUT", f"{base}/{current_mapper['id']}",
+                                      {**mapper, "id": current_mapper["id"]}, fields))
+        return changes
+
+    def apply(self, changes):
+        for change in changes:
+            response = self.admin_client.request(change.method, change.path, json=change.payload)
+            if response.status_code not in (200, 201, 204):
+                raise KeycloakAdminError(f"Error applying '{change.describe()}': {response.status_code} {response.text}",
+                                         response.status_code)
+            logger.info(f"Applied: {change.describe()}")
+        return len(changes)
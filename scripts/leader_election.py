@@ -0,0 +1,205 @@
+import abc
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+LEASE_DB_PATH = os.getenv('LEASE_DB_PATH', 'leases.db')
+
+OWNED_SHARDS = Gauge('leader_election_owned_shards', 'Shards whose lease this process holds.', ['name'])
+
+
+class LeaseBackend(abc.ABC):
+    # A lease is a named row with a holder and an expiry; backends only need these three operations
+
+    @abc.abstractmethod
+    def acquire(self, name, holder, ttl):
+        """Take or renew the lease if it is free, expired or already ours. Returns True if we hold it."""
+
+    @abc.abstractmethod
+    def release(self, name, holder):
+        pass
+
+    @abc.abstractmethod
+    def holders(self, prefix):
+        """Unexpired leases whose name starts with prefix, as {name: holder}."""
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    # Shared by every process on one host, e.g. the workers of a gunicorn master
+    def __init__(self, path=LEASE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def acquire(self, name, holder, ttl):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (name, holder, now + ttl, now)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, name, holder):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def holders(self, prefix):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, holder FROM leases WHERE substr(name, 1, ?) = ? AND expires_at >= ?",
+                (len(prefix), prefix, time.time())
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self._conn.close()
+
+
+class PostgresLeaseBackend(LeaseBackend):
+    # Leases in a database every node can reach, e.g. the Postgres Keycloak already uses.
+    # Expiry uses each node's clock, so nodes need NTP-synchronised time.
+    def __init__(self, dsn):
+        try:
+            import psycopg2
+        except ImportError:
+            raise RuntimeError("PostgresLeaseBackend requires psycopg2 (pip install psycopg2-binary)")
+        self._lock = threading.Lock()
+        self._conn = psycopg2.connect(dsn)
+        self._conn.autocommit = True
+        with self._lock, self._conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS gateway_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL
+                )
+            """)
+
+    def acquire(self, name, holder, ttl):
+        now = time.time()
+        with self._lock, self._conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO gateway_leases (name, holder, expires_at) VALUES (%s, %s, %s) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE gateway_leases.holder = excluded.holder OR gateway_leases.expires_at < %s",
+                (name, holder, now + ttl, now)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name, holder):
+        with self._lock, self._conn.cursor() as cursor:
+            cursor.execute("DELETE FROM gateway_leases WHERE name = %s AND holder = %s", (name, holder))
+
+    def holders(self, prefix):
+        with self._lock, self._conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, holder FROM gateway_leases WHERE left(name, %s) = %s AND expires_at >= %s",
+                (len(prefix), prefix, time.time())
+            )
+            return dict(cursor.fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+def lease_backend_from_env():
+    backend = os.getenv('LEASE_BACKEND', 'sqlite')
+    if backend == 'postgres':
+        return PostgresLeaseBackend(os.getenv('LEASE_DATABASE_URL'))
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown LEASE_BACKEND '{backend}'")
+    return SQLiteLeaseBackend()
+
+
+def shard_of(user_id, shards):
+    # A stable hash; Python's hash() differs between processes
+    return int(hashlib.sha1(user_id.encode()).hexdigest()[:8], 16) % shards
+
+
+class ShardCoordinator:
+    """Splits `shards` leases fairly between the live holders of `name`.
+
+    With shards=1 this is plain leader election. Every holder calls heartbeat() well within the
+    TTL; a holder that stops heartbeating loses its membership and shards when the leases expire,
+    and the remaining holders pick them up on their next heartbeat.
+    """
+
+    def __init__(self, backend, name, holder, shards=1, ttl=30):
+        self.backend = backend
+        self.name = name
+        self.holder = holder
+        self.shards = shards
+        self.ttl = ttl
+        self._owned = set()
+        self._valid_until = 0.0
+        self._lock = threading.Lock()
+        OWNED_SHARDS.set_function(lambda: len(self.owned_shards()), name=name)
+
+    def _shard_lease(self, shard):
+        return f"{self.name}/shard/{shard}"
+
+    def heartbeat(self):
+        started = time.monotonic()
+        self.backend.acquire(f"{self.name}/member/{self.holder}", self.holder, self.ttl)
+        members = len(self.backend.holders(f"{self.name}/member/")) or 1
+        fair_share = math.ceil(self.shards / members)
+
+        owned = {shard for shard in sorted(self._owned) if self.backend.acquire(self._shard_lease(shard), self.holder, self.ttl)}
+        # Give shards back when new members have joined, so the load evens out
+        while len(owned) > fair_share:
+            shard = max(owned)
+            self.backend.release(self._shard_lease(shard), self.holder)
+            owned.discard(shard)
+        if len(owned) < fair_share:
+            taken = self.backend.holders(f"{self.name}/shard/")
+            for shard in range(self.shards):
+                if len(owned) >= fair_share:
+                    break
+                if shard not in owned and self._shard_lease(shard) not in taken \
+                        and self.backend.acquire(self._shard_lease(shard), self.holder, self.ttl):
+                    owned.add(shard)
+
+        with self._lock:
+            if owned != self._owned:
+                logger.info(f"{self.holder} now holds {len(owned)} of {self.shards} '{self.name}' shards: {sorted(owned)}")
+            self._owned = owned
+            # Leases are only trusted for a margin below the TTL, measured from before the renewal started
+            self._valid_until = started + self.ttl * 0.8
+        return owned
+
+    def owned_shards(self):
+        with self._lock:
+            return set(self._owned) if time.monotonic() < self._valid_until else set()
+
+    @property
+    def is_leader(self):
+        return bool(self.owned_shards())
+
+    def owns(self, user_id, owned=None):
+        owned = self.owned_shards() if owned is None else owned
+        return shard_of(user_id, self.shards) in owned
+
+    def release_all(self):
+        with self._lock:
+            owned, self._owned, self._valid_until = self._owned, set(), 0.0
+        for shard in owned:
+            self.backend.release(self._shard_lease(shard), self.holder)
+        self.backend.release(f"{self.name}/member/{self.holder}", self.holder)
@@ -0,0 +1,224 @@
+import abc
+import bisect
+import math
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+# Minimal Prometheus collectors. Counters and histograms write to a per-thread shard,
+# so the hot path never takes a lock; shards are only merged when the registry is rendered.
+# A thread's shard is folded into a shared base when the thread exits, so short-lived
+# threads (e.g. one bulk-update pool per run) do not leave shards behind.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # Atomic replace so a node_exporter textfile collector never reads a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class _ShardedMetric(_Metric, abc.ABC):
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        super().__init__(name, help, labelnames, registry)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            # Only the thread-local refers to the owner, so it is collected when the thread exits
+            self._local.owner = owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard)
+            # Taken once per thread, not per observation
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._shards_lock:
+            # _merge never changes the values it reads, so snapshots of the old base stay valid
+            retired = dict(self._retired)
+            self._merge(retired, shard)
+            self._retired = retired
+            self._shards = [live for live in self._shards if live is not shard]
+
+    @abc.abstractmethod
+    def _merge(self, totals, shard):
+        """Add one shard's values into totals without changing the values it reads."""
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+            retired = self._retired
+        return [retired] + [shard.copy() for shard in shards]
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+
+class _ShardOwner:
+    pass
+
+
+class Counter(_ShardedMetric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, totals, shard):
+        for key, value in shard.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self.values().items())]
+
+
+class Histogram(_ShardedMetric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # One slot per bucket plus +Inf, then sum
+            state = [0] * (len(self.buckets) + 1) + [0.0]
+            shard[key] = state
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        labels.setdefault('status', 'ok')
+        started = time.perf_counter()
+        try:
+            yield labels
+        except Exception:
+            if labels['status'] == 'ok':
+                labels['status'] = 'error'
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _merge(self, totals, shard):
+        for key, state in shard.items():
+            state = list(state)
+            total = totals.get(key)
+            totals[key] = state if total is None else [a + b for a, b in zip(total, state)]
+
+    def samples(self):
+        lines = []
+        for key, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        # A single dict assignment is atomic, and last-writer-wins is the right semantics for a gauge
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function, **labels):
+        self._functions[self._key(labels)] = function
+
+    def samples(self):
+        values = dict(self._values)
+        for key, function in list(self._functions.items()):
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+# Outbound calls shared by the gateway and the setup scripts
+DEPENDENCY_LATENCY = Histogram(
+    'dependency_request_duration_seconds', 'Duration of outbound dependency calls.',
+    ['dependency', 'operation', 'status']
+)
@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+import stripe
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+import metrics
+from metrics import DEPENDENCY_LATENCY
+from payment_gateway_server import (
+    PRICE_IDS, REQUEST_LATENCY, SUBSCRIPTION_OPTIONS_BODY, SUBSCRIPTION_OPTIONS_CACHE_CONTROL, SUBSCRIPTION_OPTIONS_ETAG,
+    TIER_CATALOG, checkout_session_params, create_app, get_stripe, get_user_profile, logger, meter_usage, release_storage,
+    shutdown, webhook_queue
+)
+
+#pip install starlette uvicorn httpx stripe>=10
+#run: uvicorn payment_gateway_asgi:app --port 4242
+
+# Stripe calls go through httpx so create_async never blocks the event loop
+stripe.default_http_client = stripe.HTTPXClient()
+
+
+SUBSCRIPTION_OPTIONS_HEADERS = {
+    'ETag': f'"{SUBSCRIPTION_OPTIONS_ETAG}"',
+    'Cache-Control': SUBSCRIPTION_OPTIONS_CACHE_CONTROL,
+    'X-Catalog-Version': str(TIER_CATALOG['version'])
+}
+
+
+async def subscription_options(request):
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match.strip() == '*' or SUBSCRIPTION_OPTIONS_HEADERS['ETag'] in [
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=SUBSCRIPTION_OPTIONS_HEADERS)
+    return Response(SUBSCRIPTION_OPTIONS_BODY, media_type='application/json', headers=SUBSCRIPTION_OPTIONS_HEADERS)
+
+
+async def create_checkout_session(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data:
+        logger.error("Invalid data received for creating checkout session.")
+        return JSONResponse({"error": "Invalid data"}, status_code=400)
+
+    access_token = data.get('access_token')
+    tier = data.get('tier')
+
+    if not access_token or not tier:
+        logger.error("Missing required fields for creating checkout session.")
+        return JSONResponse({"error": "access_token and tier are required"}, status_code=400)
+
+    if tier not in PRICE_IDS:
+        logger.error(f"Unknown subscription tier '{tier}'.")
+        return JSONResponse({"error": "Unknown tier"}, status_code=400)
+
+    # Verification is local, but a JWKS refresh is a blocking fetch, so keep it off the loop
+    user_profile = await asyncio.to_thread(get_user_profile, access_token)
+    if not user_profile:
+        logger.error("Invalid access token provided.")
+        return JSONResponse({"error": "Invalid access token"}, status_code=401)
+
+    user_id = user_profile['sub']
+
+    try:
+        with DEPENDENCY_LATENCY.time(dependency='stripe', operation='checkout_session_create'):
+            session = await stripe.checkout.Session.create_async(**checkout_session_params(user_id, tier))
+        logger.info(f"Checkout session created successfully for user {user_id}.")
+    except stripe.error.StripeError as e:
+        logger.error(f"Stripe error occurred: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    return JSONResponse({'id': session.id})
+
+
+async def stripe_webhook(request):
+    payload = (await request.body()).decode('utf-8')
+    sig_header = request.headers.get('Stripe-Signature')
+    endpoint_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+    try:
+        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
+    except ValueError:
+        return PlainTextResponse('Invalid payload', status_code=400)
+    except stripe.error.SignatureVerificationError:
+        return PlainTextResponse('Invalid signature', status_code=400)
+
+    try:
+        await asyncio.to_thread(webhook_queue.enqueue, event['id'], event['type'], payload)
+    except sqlite3.Error as e:
+        logger.error(f"Error enqueueing webhook event {event['id']}: {e}")
+        return PlainTextResponse('Failed to enqueue event', status_code=500)
+
+    return PlainTextResponse('Success')
+
+
+async def record_usage(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or not data.get('access_token'):
+        return JSONResponse({"error": "access_token is required"}, status_code=400)
+    try:
+        ai_tokens = int(data.get('ai_tokens', 0))
+        storage = int(data.get('storage', 0))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "ai_tokens and storage must be integers"}, status_code=400)
+    if ai_tokens < 0 or storage < 0:
+        return JSONResponse({"error": "ai_tokens and storage must not be negative; use /usage/release to free storage"},
+                            status_code=400)
+
+    user_profile = await asyncio.to_thread(get_user_profile, data['access_token'])
+    if not user_profile:
+        return JSONResponse({"error": "Invalid access token"}, status_code=401)
+
+    # The quota check is a SQLite transaction that can wait on other processes' writes
+    body, status = await asyncio.to_thread(meter_usage, user_profile, ai_tokens, storage)
+    return JSONResponse(body, status_code=status)
+
+
+async def release_usage(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or not data.get('access_token'):
+        return JSONResponse({"error": "access_token is required"}, status_code=400)
+    try:
+        storage = int(data.get('storage', 0))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "storage must be an integer"}, status_code=400)
+    if storage <= 0:
+        return JSONResponse({"error": "storage must be positive"}, status_code=400)
+
+    user_profile = await asyncio.to_thread(get_user_profile, data['access_token'])
+    if not user_profile:
+        return JSONResponse({"error": "Invalid access token"}, status_code=401)
+
+    body, status = await asyncio.to_thread(release_storage, user_profile, storage)
+    return JSONResponse(body, status_code=status)
+
+
+async def webhook_stats(request):
+    return JSONResponse(await asyncio.to_thread(webhook_queue.stats))
+
+
+async def metrics_endpoint(request):
+    # Callback gauges query SQLite, so render off the event loop
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return Response(body, headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+class RequestLatencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope['path'] if scope['path'] in ROUTE_PATHS else 'unmatched'
+            REQUEST_LATENCY.observe(time.perf_counter() - started, route=route, method=scope['method'], status=status['code'])
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # The Flask app only provides the context the shared webhook workers send email from;
+    # the scheduler still needs RUN_SCHEDULER=true
+    create_app()
+    get_stripe()
+    yield
+    await asyncio.to_thread(shutdown)
+
+
+app = Starlette(
+    routes=[
+        Route('/subscription-options', subscription_options, methods=['GET']),
+        Route('/create-checkout-session', create_checkout_session, methods=['POST']),
+        Route('/webhook', stripe_webhook, methods=['POST']),
+        Route('/usage', record_usage, methods=['POST']),
+        Route('/usage/release', release_usage, methods=['POST']),
+        Route('/webhook/stats', webhook_stats, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(RequestLatencyMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ],
+    lifespan=lifespan
+)
+ROUTE_PATHS = {route.path for route in app.routes}
+
+if __name__ == '__main__':
+    uvicorn.run(app, port=4242, ssl_certfile='cert.pem', ssl_keyfile='key.pem')
@@ -1,141 +1,591 @@
 import os
-import json
-import stripe
-import requests
-from flask import Flask, request, jsonify
+import functools
+import itertools
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify
+from werkzeug.local import LocalProxy
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
 from flask_cors import CORS
-from flask_mail import Mail, Message
-from flask_oauthlib.provider import OAuth2Provider
 import logging
+from token_verifier import JWKSTokenVerifier, TokenVerificationError
+from keycloak_admin_client import KeycloakAdminClient, KeycloakAdminError
+from expiry_index import ExpiryIndex
+from bulk_updater import BulkClaimUpdater
+from webhook_queue import WebhookQueue, WebhookWorkerPool
+from usage_meter import METERED_RESOURCES, QuotaExceeded, UsageMeter
+from leader_election import ShardCoordinator, SQLiteLeaseBackend, lease_backend_from_env
+import tier_catalog
+import metrics
+from metrics import DEPENDENCY_LATENCY
 
-#pip install flask stripe requests apscheduler flask-cors flask-mail flask-oauthlib
+#pip install flask stripe requests apscheduler flask-cors flask-mail flask-oauthlib pyjwt[crypto]
+#run: gunicorn 'payment_gateway_server:create_app()'
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
-oauth = OAuth2Provider(app)
+# Routes are registered on the apps built by create_app()
+gateway = Blueprint('gateway', __name__)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure Stripe
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+# Prometheus collectors, rendered by /metrics
+REQUEST_LATENCY = metrics.Histogram('http_request_duration_seconds', 'Gateway request latency by route.', ['route', 'method', 'status'])
+EXPIRY_JOB_DURATION = metrics.Histogram('expiry_job_duration_seconds', 'Duration of subscription expiry runs.', ['job'])
+EXPIRY_JOB_USERS = metrics.Counter('expiry_job_users_total', 'Users handled by subscription expiry runs.', ['job', 'outcome'])
+EXPIRY_JOB_LAST_RUN = metrics.Gauge('expiry_job_last_run_timestamp_seconds', 'Completion time of the last expiry run.', ['job'])
+
+
+class Lazy:
+    # Wraps a zero-argument factory so the object is built on the first call, by whichever thread
+    # gets there first, and reused afterwards. Module-level names are LocalProxy objects over these,
+    # so importing the gateway builds nothing.
+    def __init__(self, factory):
+        functools.update_wrapper(self, factory)
+        self.factory = factory
+        self.instance = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.instance is None:
+            with self._lock:
+                if self.instance is None:
+                    self.instance = self.factory()
+        return self.instance
+
+@Lazy
+def get_stripe():
+    import stripe
+    stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+    stripe.api_base = os.getenv('STRIPE_API_BASE', stripe.api_base)
+    return stripe
+
+stripe = LocalProxy(get_stripe)
 
 # Keycloak configuration
 KEYCLOAK_URL = os.getenv('KEYCLOAK_URL')
 REALM = os.getenv('KEYCLOAK_REALM')
+KEYCLOAK_CLIENT_ID = os.getenv('KEYCLOAK_CLIENT_ID')
+JWKS_CACHE_TTL = int(os.getenv('JWKS_CACHE_TTL', 3600))
+
+# Access tokens are verified locally against the realm's cached signing keys. Without an audience
+# any client's token for the realm would be accepted, so the client id is required.
+def require_audience():
+    if not KEYCLOAK_CLIENT_ID:
+        raise RuntimeError("KEYCLOAK_CLIENT_ID must be set so access tokens issued to other clients are rejected")
+
+@Lazy
+def get_token_verifier():
+    require_audience()
+    return JWKSTokenVerifier(KEYCLOAK_URL, REALM, audience=KEYCLOAK_CLIENT_ID, jwks_ttl=JWKS_CACHE_TTL)
+
+token_verifier = LocalProxy(get_token_verifier)
 
-# Pricing IDs
-PRICE_IDS = {
-    'basic': 'price_1ExampleBasic',  # Replace with actual price IDs
-    'advanced': 'price_1ExampleAdvanced',
-    'pro': 'price_1ExamplePro'
+# Expiry sweep configuration; set SWEEP_ATTRIBUTE_QUERY to '' to page through every user
+SWEEP_PAGE_SIZE = int(os.getenv('SWEEP_PAGE_SIZE', 500))
+SWEEP_ATTRIBUTE_QUERY = os.getenv('SWEEP_ATTRIBUTE_QUERY', 'expiration_date:')
+EXPIRED_CLAIMS = {
+    'tier': '',
+    'ai_tokens': 0,
+    'storage': 0,
+    'expiration_date': ''
+}
+# Claim -> the user attribute it is stored in; the realm's protocol mappers put these in tokens
+CLAIM_ATTRIBUTES = {
+    'tier': 'tier',
+    'ai_tokens': 'aiToken',
+    'storage': 'usedStorage',
+    'expiration_date': 'expiration_date'
 }
 
-# Subscription options
-SUBSCRIPTION_OPTIONS = [
-    {
-        'name': 'Basic',
-        'price_monthly': 1,
-        'price_yearly': 12,
-        'ai_tokens': 10,
-        'storage': 50
-    },
-    {
-        'name': 'Advanced',
-        'price_monthly': 2,
-        'price_yearly': 24,
-        'ai_tokens': 20,
-        'storage': 100
-    },
-    {
-        'name': 'Pro',
-        'price_monthly': 3,
-        'price_yearly': 36,
-        'ai_tokens': 30,
-        'storage': 150
-    }
-]
+# Pooled admin API client authenticated with the gateway's service account
+@Lazy
+def get_admin_client():
+    return KeycloakAdminClient.from_env()
+
+admin_client = LocalProxy(get_admin_client)
+
+# Bulk downgrades run on a bounded pool, rate limited to protect Keycloak
+BULK_UPDATE_WORKERS = int(os.getenv('BULK_UPDATE_WORKERS', 8))
+BULK_UPDATE_RATE_LIMIT = float(os.getenv('BULK_UPDATE_RATE_LIMIT', 50))
+
+# Local index of subscription expiry times, written by the webhook and drained by the expiry job
+EXPIRY_CHECK_INTERVAL_MINUTES = int(os.getenv('EXPIRY_CHECK_INTERVAL_MINUTES', 60))
+EXPIRY_BATCH_SIZE = int(os.getenv('EXPIRY_BATCH_SIZE', 1000))
+# Entries that failed stay claimed this long before a later run retries them
+EXPIRY_RETRY_SECONDS = int(os.getenv('EXPIRY_RETRY_SECONDS', 300))
+
+@Lazy
+def get_expiry_index():
+    return ExpiryIndex()
+
+expiry_index = LocalProxy(get_expiry_index)
+
+# Scheduled jobs run under leases instead of in every process. Host-local state (the expiry index
+# and usage meter) is drained by one leader per host; the full sweep hashes user ids into
+# SWEEP_SHARDS shards leased across all nodes sharing LEASE_BACKEND. A dead holder's leases
+# expire after LEASE_TTL_SECONDS and are picked up by the remaining processes.
+NODE_ID = os.getenv('NODE_ID', f"{socket.gethostname()}-{os.getpid()}")
+LEASE_TTL_SECONDS = int(os.getenv('LEASE_TTL_SECONDS', 30))
+SWEEP_SHARDS = int(os.getenv('SWEEP_SHARDS', 1))
 
-# Mail configuration
-app.config['MAIL_SERVER'] = 'smtp.example.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USERNAME'] = 'your-email@example.com'
-app.config['MAIL_PASSWORD'] = 'your-email-password'
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USE_SSL'] = False
-mail = Mail(app)
+@Lazy
+def get_local_leader():
+    return ShardCoordinator(SQLiteLeaseBackend(), f"local:{socket.gethostname()}", NODE_ID, ttl=LEASE_TTL_SECONDS)
+
+@Lazy
+def get_sweep_shards():
+    return ShardCoordinator(lease_backend_from_env(), 'expiry-sweep', NODE_ID, shards=SWEEP_SHARDS, ttl=LEASE_TTL_SECONDS)
+
+local_leader = LocalProxy(get_local_leader)
+sweep_shards = LocalProxy(get_sweep_shards)
+
+# Tier catalog shared with the Keycloak setup script; the options response is serialized once
+TIER_CATALOG = tier_catalog.load_catalog()
+PRICE_IDS = tier_catalog.price_ids(TIER_CATALOG)
+SUBSCRIPTION_OPTIONS = tier_catalog.subscription_options(TIER_CATALOG)
+SUBSCRIPTION_OPTIONS_BODY, SUBSCRIPTION_OPTIONS_ETAG = tier_catalog.serialize(SUBSCRIPTION_OPTIONS)
+SUBSCRIPTION_OPTIONS_CACHE_CONTROL = os.getenv('SUBSCRIPTION_OPTIONS_CACHE_CONTROL', 'public, max-age=300')
+
+# Mail configuration, applied to every app create_app() builds
+MAIL_SETTINGS = {
+    'MAIL_SERVER': 'smtp.example.com',
+    'MAIL_PORT': 587,
+    'MAIL_USERNAME': 'your-email@example.com',
+    'MAIL_PASSWORD': 'your-email-password',
+    'MAIL_USE_TLS': True,
+    'MAIL_USE_SSL': False
+}
+MAIL_SENDER = 'your-email@example.com'
+
+# Webhook workers, scheduled jobs and the email outbox run outside requests; they use the app
+# create_app() built last in this process
+background_app = None
+
+def get_background_app():
+    if background_app is None:
+        raise RuntimeError("create_app() must be called before background work can run")
+    return background_app
+
+@Lazy
+def get_mail():
+    from flask_mail import Mail
+    return Mail(get_background_app())
+
+# Emails are batched by a background worker over one reused SMTP connection
+@Lazy
+def get_email_outbox():
+    from email_outbox import EmailOutbox
+    outbox = EmailOutbox(get_mail(), get_background_app(), sender=MAIL_SENDER)
+    outbox.start()
+    EMAIL_OUTBOX_QUEUED.set_function(lambda: outbox.stats()['queued'])
+    return outbox
+
+email_outbox = LocalProxy(get_email_outbox)
+
+# Nothing uses the OAuth provider yet, so it is only attached to an app when first asked for
+def get_oauth_provider():
+    from flask_oauthlib.provider import OAuth2Provider
+    return current_app.extensions.get('oauthlib.provider.oauth2') or OAuth2Provider(current_app._get_current_object())
+
+oauth = LocalProxy(get_oauth_provider)
 
 def get_user_profile(access_token):
-    url = f"{KEYCLOAK_URL}/realms/{REALM}/protocol/openid-connect/userinfo"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    with DEPENDENCY_LATENCY.time(dependency='keycloak', operation='verify_token') as labels:
+        try:
+            return token_verifier.get_profile(access_token)
+        except TokenVerificationError as e:
+            labels['status'] = 'invalid'
+            logger.warning(f"Access token rejected: {e}")
+            return None
 
-def update_user_claims(user_id, claims):
-    url = f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/{user_id}"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('KEYCLOAK_ADMIN_TOKEN')}",
-        "Content-Type": "application/json"
+def record_expiry_job(job, started, stats):
+    EXPIRY_JOB_DURATION.observe(time.perf_counter() - started, job=job)
+    EXPIRY_JOB_LAST_RUN.set(time.time(), job=job)
+    for outcome, count in stats.items():
+        EXPIRY_JOB_USERS.inc(count, job=job, outcome=outcome)
+
+def checkout_session_params(user_id, tier):
+    # Quotas come from the catalog, never from the client; the webhook grants what the metadata says
+    spec = TIER_CATALOG['tiers'][tier]
+    return {
+        'payment_method_types': ['card'],
+        'line_items': [{
+            'price': PRICE_IDS[tier],
+            'quantity': 1,
+        }],
+        'mode': 'subscription',
+        'metadata': {
+            'user_id': user_id,
+            'ai_tokens': spec['aiToken'],
+            'storage': spec['usedStorage']
+        },
+        'success_url': 'https://example.com/success',
+        'cancel_url': 'https://example.com/cancel',
     }
-    response = requests.put(url, headers=headers, data=json.dumps(claims))
+
+def claims_to_attributes(attributes, claims):
+    # Keycloak ignores top-level fields it does not know on PUT /users/{id}, so claims are stored
+    # as user attributes; an empty value removes the attribute
+    attributes = dict(attributes or {})
+    for claim, value in claims.items():
+        attribute = CLAIM_ATTRIBUTES[claim]
+        if value in ('', None):
+            attributes.pop(attribute, None)
+        else:
+            attributes[attribute] = [str(value)]
+    return attributes
+
+def update_user_attributes(user_id, change):
+    # PUT replaces the whole attribute map, so the user's other attributes are read and sent back
+    response = admin_client.get(f"/users/{user_id}")
+    if response.status_code != 200:
+        return False
+    attributes = change(response.json().get('attributes') or {})
+    response = admin_client.put(f"/users/{user_id}", json={'attributes': attributes})
     return response.status_code == 204
 
+def update_user_claims(user_id, claims):
+    try:
+        return update_user_attributes(user_id, lambda attributes: claims_to_attributes(attributes, claims))
+    except KeycloakAdminError as e:
+        logger.error(f"Error updating claims for user {user_id}: {e}")
+        return False
+
+claim_updater = BulkClaimUpdater(update_user_claims, max_workers=BULK_UPDATE_WORKERS, rate_limit=BULK_UPDATE_RATE_LIMIT)
+
+def iter_expired_users(now):
+    params = {'briefRepresentation': 'false'}
+    if SWEEP_ATTRIBUTE_QUERY:
+        params['q'] = SWEEP_ATTRIBUTE_QUERY
+    try:
+        users = admin_client.iter_users(page_size=SWEEP_PAGE_SIZE, **params)
+        first_user = next(users, None)
+    except KeycloakAdminError as e:
+        if 'q' not in params or e.status_code != 400:
+            raise
+        # Older Keycloak versions reject attribute search, so fall back to a full listing
+        logger.warning(f"Attribute search not supported, scanning all users: {e}")
+        del params['q']
+        users = admin_client.iter_users(page_size=SWEEP_PAGE_SIZE, **params)
+        first_user = next(users, None)
+    if first_user is None:
+        return
+
+    for user in itertools.chain([first_user], users):
+        expiration_date = (user.get('attributes') or {}).get('expiration_date')
+        if not expiration_date or not expiration_date[0]:
+            yield user, False
+            continue
+        try:
+            expired = now > datetime.fromisoformat(expiration_date[0])
+        except ValueError:
+            logger.warning(f"Invalid expiration date '{expiration_date[0]}' for user {user['id']}.")
+            expired = False
+        yield user, expired
+
+def heartbeat_leases():
+    for coordinator in (local_leader, sweep_shards):
+        try:
+            coordinator.heartbeat()
+        except Exception as e:
+            logger.error(f"Error renewing '{coordinator.name}' leases: {e}")
+
+def on_local_leader(job):
+    @functools.wraps(job)
+    def run():
+        if local_leader.is_leader:
+            return job()
+    return run
+
 def remove_expired_groups():
-    url = f"{KEYCLOAK_URL}/admin/realms/{REALM}/users"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('KEYCLOAK_ADMIN_TOKEN')}",
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        users = response.json()
-        for user in users:
-            user_id = user['id']
-            user_detail_url = f"{KEYCLOAK_URL}/admin/realms/{REALM}/users/{user_id}"
-            user_response = requests.get(user_detail_url, headers=headers)
-            if user_response.status_code == 200:
-                user_data = user_response.json()
-                expiration_date = user_data.get('attributes', {}).get('expiration_date')
-                if expiration_date:
-                    expiration_date = datetime.fromisoformat(expiration_date[0])
-                    if datetime.now() > expiration_date:
-                        claims = {
-                            'tier': '',
-                            'ai_tokens': 0,
-                            'storage': 0,
-                            'expiration_date': ''
-                        }
-                        update_user_claims(user_id, claims)
-                        logger.info(f"Removed expired subscription for user {user_id}.")
-    else:
-        logger.error(f"Error fetching users: {response.status_code}")
+    started = time.perf_counter()
+    stats = {'scanned': 0, 'expired': 0, 'updated': 0, 'failed': 0}
+    owned = sweep_shards.owned_shards()
+    if not owned:
+        logger.debug(f"{NODE_ID} holds no sweep shards, skipping the expiry sweep.")
+        return stats
+    expired_users = {}
+    try:
+        # Collect ids first so clearing claims cannot shift the pages still being read
+        for user, expired in iter_expired_users(datetime.now()):
+            if not sweep_shards.owns(user['id'], owned):
+                continue
+            stats['scanned'] += 1
+            if expired:
+                expired_users[user['id']] = user.get('email')
+    except KeycloakAdminError as e:
+        logger.error(f"Error fetching users: {e}")
+        record_expiry_job('sweep', started, stats)
+        return stats
+    stats['expired'] = len(expired_users)
+
+    result = claim_updater.run((user_id, EXPIRED_CLAIMS) for user_id in expired_users)
+    if result.failures:
+        logger.warning(f"Retrying {len(result.failures)} failed claim updates.")
+        retry = claim_updater.retry_failed(result)
+        result.succeeded += retry.succeeded
+        result.failures = retry.failures
+    for user_id, (_, error) in result.failures.items():
+        logger.error(f"Failed to remove expired subscription for user {user_id}: {error}")
+    stats['updated'] = result.succeeded
+    stats['failed'] = len(result.failures)
+    send_expiry_notices(email for user_id, email in expired_users.items() if email and user_id not in result.failures)
+
+    logger.info(f"Expiry sweep finished: {stats['scanned']} scanned, {stats['expired']} expired, "
+                f"{stats['updated']} updated, {stats['failed']} failed.")
+    record_expiry_job('sweep', started, stats)
+    return stats
+
+def fetch_due_user(user_id):
+    if claim_updater.bucket:
+        claim_updater.bucket.acquire()
+    try:
+        return admin_client.get(f"/users/{user_id}")
+    except KeycloakAdminError as e:
+        logger.error(f"Error fetching user {user_id}: {e}")
+        return None
+
+def expire_due_subscriptions():
+    started = time.perf_counter()
+    stats = {'due': 0, 'renewed': 0, 'updated': 0, 'failed': 0}
+    now = datetime.now()
+    # Drain in batches until nothing is due; failed entries stay claimed and are skipped until a later run
+    while True:
+        entries = expiry_index.claim_due(now, limit=EXPIRY_BATCH_SIZE, lease=EXPIRY_RETRY_SECONDS)
+        if not entries:
+            break
+        stats['due'] += len(entries)
+        done = []
+        expired = {}
+        # Re-check Keycloak so a renewal that raced with the index is not downgraded
+        with ThreadPoolExecutor(max_workers=BULK_UPDATE_WORKERS) as pool:
+            responses = pool.map(fetch_due_user, [user_id for user_id, _ in entries])
+            for (user_id, expires_at), response in zip(entries, responses):
+                if response is None or response.status_code not in (200, 404):
+                    stats['failed'] += 1
+                    continue
+                if response.status_code == 404:
+                    done.append((user_id, expires_at))
+                    continue
+                user = response.json()
+                current = (user.get('attributes') or {}).get('expiration_date')
+                try:
+                    renewed = bool(current and current[0]) and datetime.fromisoformat(current[0]) > now
+                except ValueError:
+                    renewed = False
+                if renewed:
+                    # Recording the new expiry also releases the claim
+                    expiry_index.record(user_id, current[0])
+                    stats['renewed'] += 1
+                else:
+                    expired[user_id] = (expires_at, user.get('email'))
+
+        result = claim_updater.run((user_id, EXPIRED_CLAIMS) for user_id in expired)
+        for user_id, (_, error) in result.failures.items():
+            logger.error(f"Failed to remove expired subscription for user {user_id}: {error}")
+        succeeded = [user_id for user_id in expired if user_id not in result.failures]
+        done.extend((user_id, expired[user_id][0]) for user_id in succeeded)
+        expiry_index.complete(done)
+        stats['updated'] += len(succeeded)
+        stats['failed'] += len(result.failures)
+        send_expiry_notices(expired[user_id][1] for user_id in succeeded if expired[user_id][1])
+    if stats['due']:
+        logger.info(f"Expiry job finished: {stats['due']} due, {stats['renewed']} renewed, "
+                    f"{stats['updated']} updated, {stats['failed']} failed.")
+    record_expiry_job('index', started, stats)
+    return stats
 
 def send_email(subject, recipient, body):
-    msg = Message(subject, sender='your-email@example.com', recipients=[recipient])
-    msg.body = body
-    mail.send(msg)
-    logger.info(f"Email sent to {recipient} with subject: {subject}")
+    email_outbox.send(subject, recipient, body)
+
+def send_expiry_notices(emails):
+    return email_outbox.send_bulk(
+        ("Subscription Expired", email, "Your subscription has expired. Renew it any time to restore your plan.")
+        for email in emails
+    )
+
+def handle_stripe_event(event):
+    if event['type'] == 'checkout.session.completed':
+        session = event['data']['object']
+        metadata = session['metadata']
+
+        user_id = metadata['user_id']
+        ai_tokens = int(metadata['ai_tokens'])
+        storage = int(metadata['storage'])
+
+        expiration_date = (datetime.now() + timedelta(days=365)).isoformat()
 
-# Schedule the removal of expired groups
-scheduler = BackgroundScheduler()
-scheduler.add_job(remove_expired_groups, 'interval', hours=24)
-scheduler.start()
+        claims = {
+            'tier': session['subscription'],
+            'ai_tokens': ai_tokens,
+            'storage': storage,
+            'expiration_date': expiration_date
+        }
+
+        if not update_user_claims(user_id, claims):
+            raise RuntimeError(f"Failed to update user claims for user {user_id}")
+        expiry_index.record(user_id, expiration_date)
+        logger.info(f"User claims updated successfully for user {user_id}.")
+
+        email = (session.get('customer_details') or {}).get('email') or session.get('customer_email')
+        if email:
+            send_email("Subscription Successful", email, "Thank you for subscribing!")
+
+def usage_from_attributes(attributes):
+    usage = {}
+    for resource, (_, attribute) in METERED_RESOURCES.items():
+        try:
+            usage[resource] = int((attributes.get(attribute) or ['0'])[0])
+        except ValueError:
+            usage[resource] = 0
+    return usage
+
+def read_usage(user_id):
+    # Seeds the local counter the first time this host meters a user; if Keycloak cannot be read
+    # the user starts from zero here and the deltas are still added to whatever Keycloak holds
+    try:
+        response = admin_client.get(f"/users/{user_id}")
+    except KeycloakAdminError as e:
+        logger.warning(f"Could not read usage for user {user_id}, starting from zero: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+    return usage_from_attributes(response.json().get('attributes') or {})
+
+def write_usage(user_id, deltas):
+    # Adds this host's usage since the last flush to the value in Keycloak. Two hosts flushing the
+    # same user at the same moment can still lose one delta: attributes have no compare-and-set
+    def change(attributes):
+        current = usage_from_attributes(attributes)
+        for resource, (_, attribute) in METERED_RESOURCES.items():
+            attributes[attribute] = [str(max(0, current[resource] + deltas[resource]))]
+        return attributes
+
+    try:
+        return update_user_attributes(user_id, change)
+    except KeycloakAdminError as e:
+        logger.error(f"Error writing usage for user {user_id}: {e}")
+        return False
+
+# Usage is checked against the token's limits in a SQLite counter shared by the processes on this host,
+# and written back to Keycloak in batches
+USAGE_FLUSH_INTERVAL_SECONDS = int(os.getenv('USAGE_FLUSH_INTERVAL_SECONDS', 60))
+
+@Lazy
+def get_usage_meter():
+    return UsageMeter(seed=read_usage)
+
+usage_meter = LocalProxy(get_usage_meter)
+usage_updater = BulkClaimUpdater(write_usage, max_workers=BULK_UPDATE_WORKERS, rate_limit=BULK_UPDATE_RATE_LIMIT)
+
+def flush_usage():
+    return usage_meter.flush(usage_updater)
+
+def meter_usage(user_profile, ai_tokens, storage):
+    try:
+        return usage_meter.record(user_profile['sub'], user_profile, ai_tokens=ai_tokens, storage=storage), 200
+    except QuotaExceeded as e:
+        return {'error': str(e), 'resource': e.resource, 'limit': e.limit, 'used': e.used}, 429
+
+def release_storage(user_profile, storage):
+    return usage_meter.release_storage(user_profile['sub'], storage), 200
+
+# Webhook events are acknowledged once stored and processed by a pool of background workers
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_VISIBILITY_TIMEOUT = int(os.getenv('WEBHOOK_VISIBILITY_TIMEOUT', 300))
+
+# Queue gauges are read from SQLite only when /metrics is scraped, once the queue exists
+WEBHOOK_QUEUE_DEPTH = metrics.Gauge('webhook_queue_depth', 'Webhook events waiting to be processed.')
+WEBHOOK_QUEUE_LAG = metrics.Gauge('webhook_queue_oldest_pending_age_seconds', 'Age of the oldest unprocessed webhook event.')
+EMAIL_OUTBOX_QUEUED = metrics.Gauge('email_outbox_queued', 'Emails waiting to be sent.')
+
+@Lazy
+def get_webhook_queue():
+    queue = WebhookQueue(visibility_timeout=WEBHOOK_VISIBILITY_TIMEOUT)
+    WEBHOOK_QUEUE_DEPTH.set_function(lambda: queue.stats()['depth'])
+    WEBHOOK_QUEUE_LAG.set_function(lambda: queue.stats()['oldest_pending_age_seconds'])
+    return queue
+
+@Lazy
+def get_webhook_workers():
+    workers = WebhookWorkerPool(get_webhook_queue(), handle_stripe_event, workers=WEBHOOK_WORKERS)
+    workers.start()
+    return workers
+
+webhook_queue = LocalProxy(get_webhook_queue)
+webhook_workers = LocalProxy(get_webhook_workers)
+
+# Schedule the removal of expired groups; the daily full sweep is a backstop for the index.
+# Only processes started with RUN_SCHEDULER=true (or create_app(run_scheduler=True)) run it.
+RUN_SCHEDULER = os.getenv('RUN_SCHEDULER', 'false').lower() == 'true'
+
+@Lazy
+def get_scheduler():
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(heartbeat_leases, 'interval', seconds=max(1, LEASE_TTL_SECONDS // 3), next_run_time=datetime.now())
+    scheduler.add_job(on_local_leader(expire_due_subscriptions), 'interval', minutes=EXPIRY_CHECK_INTERVAL_MINUTES)
+    scheduler.add_job(remove_expired_groups, 'interval', hours=24)
+    scheduler.add_job(on_local_leader(flush_usage), 'interval', seconds=USAGE_FLUSH_INTERVAL_SECONDS)
+    scheduler.start()
+    return scheduler
+
+def create_app(run_scheduler=None, start_workers=True):
+    # Clients are built on first use. The webhook workers start here so events queued before a
+    # restart are drained without waiting for a request.
+    global background_app
+    require_audience()
+    app = Flask(__name__)
+    app.config.update(MAIL_SETTINGS)
+    CORS(app)
+    app.register_blueprint(gateway)
+    background_app = app
+    if start_workers:
+        get_webhook_workers()
+    if RUN_SCHEDULER if run_scheduler is None else run_scheduler:
+        get_scheduler()
+    return app
+
+def shutdown():
+    # Stops whatever background work this process has started
+    if get_scheduler.instance is not None:
+        get_scheduler.instance.shutdown(wait=False)
+    if get_webhook_workers.instance is not None:
+        get_webhook_workers.instance.stop()
+    if get_usage_meter.instance is not None:
+        get_usage_meter.instance.close()
+    if get_email_outbox.instance is not None:
+        get_email_outbox.instance.stop()
 
-@app.route('/subscription-options', methods=['GET'])
+@gateway.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@gateway.after_app_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+    return response
+
+@gateway.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@gateway.route('/subscription-options', methods=['GET'])
 def subscription_options():
-    return jsonify(SUBSCRIPTION_OPTIONS)
+    response = Response(SUBSCRIPTION_OPTIONS_BODY, mimetype='application/json')
+    response.set_etag(SUBSCRIPTION_OPTIONS_ETAG)
+    response.headers['Cache-Control'] = SUBSCRIPTION_OPTIONS_CACHE_CONTROL
+    response.headers['X-Catalog-Version'] = str(TIER_CATALOG['version'])
+    return response.make_conditional(request)
 
-@app.route('/create-checkout-session', methods=['POST'])
+@gateway.route('/create-checkout-session', methods=['POST'])
 def create_checkout_session():
     data = request.json
     if not data:
@@ -144,12 +594,14 @@ def create_checkout_session():
 
     access_token = data.get('access_token')
     tier = data.get('tier')
-    ai_tokens = data.get('ai_tokens')
-    storage = data.get('storage')
 
-    if not access_token or not tier or ai_tokens is None or storage is None:
+    if not access_token or not tier:
         logger.error("Missing required fields for creating checkout session.")
-        return jsonify({"error": "All fields are required"}), 400
+        return jsonify({"error": "access_token and tier are required"}), 400
+
+    if tier not in PRICE_IDS:
+        logger.error(f"Unknown subscription tier '{tier}'.")
+        return jsonify({"error": "Unknown tier"}), 400
 
     user_profile = get_user_profile(access_token)
     if not user_profile:
@@ -159,21 +611,8 @@ def create_checkout_session():
     user_id = user_profile['sub']
 
     try:
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price': PRICE_IDS[tier],
-                'quantity': 1,
-            }],
-            mode='subscription',
-            metadata={
-                'user_id': user_id,
-                'ai_tokens': ai_tokens,
-                'storage': storage
-            },
-            success_url='https://example.com/success',
-            cancel_url='https://example.com/cancel',
-        )
+        with DEPENDENCY_LATENCY.time(dependency='stripe', operation='checkout_session_create'):
+            session = stripe.checkout.Session.create(**checkout_session_params(user_id, tier))
         logger.info(f"Checkout session created successfully for user {user_id}.")
     except stripe.error.StripeError as e:
         logger.error(f"Stripe error occurred: {str(e)}")
@@ -181,7 +620,7 @@ def create_checkout_session():
 
     return jsonify({'id': session.id})
 
-@app.route('/webhook', methods=['POST'])
+@gateway.route('/webhook', methods=['POST'])
 def stripe_webhook():
     payload = request.get_data(as_text=True)
     sig_header = request.headers.get('Stripe-Signature')
@@ -194,31 +633,57 @@ def stripe_webhook():
     except stripe.error.SignatureVerificationError:
         return 'Invalid signature', 400
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        metadata = session['metadata']
+    # Stripe only needs an acknowledgement; the claim update and email run on the queue workers
+    try:
+        webhook_queue.enqueue(event['id'], event['type'], payload)
+    except sqlite3.Error as e:
+        logger.error(f"Error enqueueing webhook event {event['id']}: {e}")
+        return 'Failed to enqueue event', 500
 
-        user_id = metadata['user_id']
-        ai_tokens = int(metadata['ai_tokens'])
-        storage = int(metadata['storage'])
+    return 'Success', 200
 
-        expiration_date = (datetime.now() + timedelta(days=365)).isoformat()
+@gateway.route('/usage', methods=['POST'])
+def record_usage():
+    data = request.json
+    if not data or not data.get('access_token'):
+        return jsonify({"error": "access_token is required"}), 400
+    try:
+        ai_tokens = int(data.get('ai_tokens', 0))
+        storage = int(data.get('storage', 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "ai_tokens and storage must be integers"}), 400
+    if ai_tokens < 0 or storage < 0:
+        return jsonify({"error": "ai_tokens and storage must not be negative; use /usage/release to free storage"}), 400
 
-        claims = {
-            'tier': session['subscription'],
-            'ai_tokens': ai_tokens,
-            'storage': storage,
-            'expiration_date': expiration_date
-        }
+    user_profile = get_user_profile(data['access_token'])
+    if not user_profile:
+        return jsonify({"error": "Invalid access token"}), 401
 
-        if update_user_claims(user_id, claims):
-            send_email("Subscription Successful", user_profile['email'], "Thank you for subscribing!")
-            logger.info(f"User claims updated successfully for user {user_id}.")
-        else:
-            logger.error("Failed to update user claims.")
-            return 'Failed to update user claims', 500
+    body, status = meter_usage(user_profile, ai_tokens, storage)
+    return jsonify(body), status
 
-    return 'Success', 200
+@gateway.route('/usage/release', methods=['POST'])
+def release_usage():
+    data = request.json
+    if not data or not data.get('access_token'):
+        return jsonify({"error": "access_token is required"}), 400
+    try:
+        storage = int(data.get('storage', 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "storage must be an integer"}), 400
+    if storage <= 0:
+        return jsonify({"error": "storage must be positive"}), 400
+
+    user_profile = get_user_profile(data['access_token'])
+    if not user_profile:
+        return jsonify({"error": "Invalid access token"}), 401
+
+    body, status = release_storage(user_profile, storage)
+    return jsonify(body), status
+
+@gateway.route('/webhook/stats', methods=['GET'])
+def webhook_stats():
+    return jsonify(webhook_queue.stats())
 
 if __name__ == '__main__':
-    app.run(port=4242, ssl_context=('cert.pem', 'key.pem'))
+    create_app().run(port=4242, ssl_context=('cert.pem', 'key.pem'))
@@ -0,0 +1,70 @@
+import logging
+import os
+import random
+import socket
+import time
+import requests
+import metrics
+
+logger = logging.getLogger(__name__)
+
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", 300))
+PROBE_TIMEOUT = 2.0
+STARTUP_PHASE_DURATION = metrics.Histogram("keycloak_startup_phase_duration_seconds",
+                                           "Time until each startup dependency became ready.", ["phase", "status"])
+
+
+class ReadinessTimeout(Exception):
+    pass
+
+
+def wait_for(phase, check, deadline, initial_delay=0.25, max_delay=5.0):
+    # Probes immediately, then backs off exponentially with jitter until check() is true or the deadline passes
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        if check():
+            elapsed = time.monotonic() - started
+            STARTUP_PHASE_DURATION.observe(elapsed, phase=phase, status="ready")
+            logger.info(f"Startup phase '{phase}' ready after {elapsed:.2f}s ({attempt} probes).")
+            return elapsed
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            elapsed = time.monotonic() - started
+            STARTUP_PHASE_DURATION.observe(elapsed, phase=phase, status="timeout")
+            raise ReadinessTimeout(f"'{phase}' was not ready after {elapsed:.1f}s ({attempt} probes)")
+        delay = min(max_delay, initial_delay * 2 ** (attempt - 1))
+        time.sleep(min(remaining, random.uniform(delay / 2, delay)))
+
+
+def port_open(host, port, timeout=PROBE_TIMEOUT):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def keycloak_ready(health_url, verify=True, timeout=PROBE_TIMEOUT):
+    try:
+        response = requests.get(health_url, timeout=timeout, verify=verify)
+    except requests.RequestException:
+        return False
+    if response.status_code != 200:
+        return False
+    try:
+        return response.json().get("status") == "UP"
+    except ValueError:
+        return False
+
+
+def wait_until_ready(health_url, db_host=None, db_port=5432, deadline=None, verify=True):
+    # Keycloak only reports ready once its database is reachable, so the database is checked first
+    # to show which of the two a slow start is waiting on
+    deadline = deadline or time.monotonic() + READINESS_TIMEOUT
+    phases = {}
+    if db_host:
+        phases["database"] = wait_for("database", lambda: port_open(db_host, db_port), deadline)
+    phases["keycloak"] = wait_for("keycloak", lambda: keycloak_ready(health_url, verify), deadline)
+    return phases
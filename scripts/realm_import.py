@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+import jsonschema
+from keycloak_admin_client import KeycloakAdminError
+
+#pip install jsonschema
+
+logger = logging.getLogger(__name__)
+
+REALM_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "realm_schema.json")
+IMPORTED_RESOURCES = ["clients", "groups", "users", "identityProviders"]
+
+
+class RealmImportError(Exception):
+    pass
+
+
+def validate_realm(representation, schema_path=REALM_SCHEMA_PATH):
+    with open(schema_path) as file:
+        schema = json.load(file)
+    errors = sorted(jsonschema.Draft7Validator(schema).iter_errors(representation), key=lambda error: list(error.path))
+    if errors:
+        details = "; ".join(f"{'/'.join(str(part) for part in error.path) or '<root>'}: {error.message}" for error in errors)
+        raise RealmImportError(f"Realm representation is invalid: {details}")
+    return representation
+
+
+def write_realm_file(representation, directory):
+    # Keycloak's --import-realm picks up every *.json in /opt/keycloak/data/import
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{representation['realm']}-realm.json")
+    with open(path, "w") as file:
+        json.dump(representation, file, indent=2)
+    logger.info(f"Realm representation written to {path}.")
+    return path
+
+
+class RealmImporter:
+    def __init__(self, admin_client):
+        self.admin_client = admin_client
+
+    def _check(self, response, action):
+        if response.status_code not in (200, 201, 204):
+            raise KeycloakAdminError(f"Error {action}: {response.status_code} {response.text}", response.status_code)
+        return response
+
+    def apply(self, representation, if_resource_exists="SKIP"):
+        realm_name = representation["realm"]
+        response = self.admin_client.get("")
+        if response.status_code == 404:
+            # A new realm is created together with all of its resources in one call
+            self._check(self.admin_client.post(f"{self.admin_client.server_url}/admin/realms", json=representation),
+                        f"creating realm '{realm_name}'")
+            logger.info(f"Realm '{realm_name}' created from its full representation.")
+            return 1
+        self._check(response, f"reading realm '{realm_name}'")
+
+        # partialImport covers the realm's resources but not its settings, which take one PUT
+        settings = {key: value for key, value in representation.items() if key not in IMPORTED_RESOURCES}
+        self._check(self.admin_client.put("", json=settings), f"updating realm '{realm_name}' settings")
+        payload = {"ifResourceExists": if_resource_exists, **{key: representation.get(key, []) for key in IMPORTED_RESOURCES}}
+        response = self._check(self.admin_client.post("/partialImport", json=payload), f"importing into realm '{realm_name}'")
+        result = response.json() if response.content else {}
+        logger.info(f"Partial import into '{realm_name}': {result.get('added', 0)} added, "
+                    f"{result.get('overwritten', 0)} overwritten, {result.get('skipped', 0)} skipped.")
+        return 2
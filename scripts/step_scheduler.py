@@ -0,0 +1,90 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class StepResult:
+    def __init__(self, name, status, elapsed=0.0, error=None):
+        self.name = name
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+
+
+class StepScheduler:
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.steps = {}
+
+    def add(self, name, fn, depends_on=()):
+        if name in self.steps:
+            raise ValueError(f"Step '{name}' is already defined")
+        self.steps[name] = (fn, tuple(depends_on))
+        return name
+
+    def _check_graph(self):
+        for name, (_, depends_on) in self.steps.items():
+            for dependency in depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step '{name}' depends on unknown step '{dependency}'")
+        # Kahn's algorithm; anything left over sits on a cycle
+        remaining = {name: set(depends_on) for name, (_, depends_on) in self.steps.items()}
+        while True:
+            ready = [name for name, depends_on in remaining.items() if not depends_on]
+            if not ready:
+                break
+            for name in ready:
+                del remaining[name]
+            for depends_on in remaining.values():
+                depends_on.difference_update(ready)
+        if remaining:
+            raise ValueError(f"Steps form a dependency cycle: {', '.join(sorted(remaining))}")
+
+    def _timed(self, name, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            return StepResult(name, FAILED, time.perf_counter() - started, e)
+        return StepResult(name, SUCCEEDED, time.perf_counter() - started)
+
+    def _cancel_dependents(self, failed, results):
+        pending = [failed]
+        while pending:
+            current = pending.pop()
+            for name, (_, depends_on) in self.steps.items():
+                if current in depends_on and name not in results:
+                    results[name] = StepResult(name, CANCELLED, error=f"dependency '{current}' did not succeed")
+                    logger.warning(f"Step '{name}' cancelled: dependency '{current}' did not succeed.")
+                    pending.append(name)
+
+    def run(self):
+        self._check_graph()
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(results) < len(self.steps):
+                for name, (fn, depends_on) in self.steps.items():
+                    if name in results or name in running.values():
+                        continue
+                    if all(results.get(dependency) and results[dependency].status == SUCCEEDED for dependency in depends_on):
+                        running[pool.submit(self._timed, name, fn)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    results[name] = result
+                    if result.status == SUCCEEDED:
+                        logger.info(f"Step '{name}' finished in {result.elapsed:.2f}s.")
+                    else:
+                        logger.error(f"Step '{name}' failed after {result.elapsed:.2f}s: {result.error}")
+                        self._cancel_dependents(name, results)
+        return results
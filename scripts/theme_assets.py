@@ -0,0 +1,224 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#optional: pip install rjsmin rcssmin brotli
+
+logger = logging.getLogger(__name__)
+
+THEME_ASSET_SOURCE = os.getenv("THEME_ASSET_SOURCE", os.path.join("themes", "material-theme", "login"))
+THEME_ASSET_OUTPUT = os.getenv("THEME_ASSET_OUTPUT", os.path.join("dist", "themes", "material-theme", "login"))
+ASSET_MANIFEST_NAME = "asset-manifest.json"
+# Fingerprinted files never change under the same name, so they can be cached for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_EXTENSIONS = {".js", ".css"}
+TEMPLATE_EXTENSIONS = {".ftl"}
+# Bundler output is already minified; running it through a regex minifier again gains nothing
+MINIFIED_LINE_LENGTH = 500
+BUNDLER_HASH = re.compile(r"-[A-Z0-9]{8}$")
+REFERENCE = re.compile(r'((?:src|href)=")([^"?#]+)')
+# Keycloak templates reach theme resources through this prefix, whatever directory the template is in
+RESOURCES_PATH_PREFIX = "${url.resourcesPath}/"
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def pipeline_tools():
+    # Part of every asset's cache key, so installing a minifier or brotli rebuilds what it affects
+    return {"rjsmin": rjsmin is not None, "rcssmin": rcssmin is not None, "brotli": brotli is not None}
+
+
+def minify(data, extension):
+    lines = data.count(b"\n") + 1
+    if len(data) / lines > MINIFIED_LINE_LENGTH:
+        return data
+    if extension == ".js" and rjsmin:
+        return rjsmin.jsmin(data.decode()).encode()
+    if extension == ".css" and rcssmin:
+        return rcssmin.cssmin(data.decode()).encode()
+    return data
+
+
+def fingerprinted_name(relative_path, digest):
+    # css/styles-Z3IZGFQL.css -> css/styles.<digest>.css; the bundler's own hash is replaced by ours
+    directory, name = os.path.split(relative_path)
+    stem, extension = os.path.splitext(name)
+    return os.path.join(directory, f"{BUNDLER_HASH.sub('', stem)}.{digest[:12]}{extension}")
+
+
+class AssetPipeline:
+    def __init__(self, source=THEME_ASSET_SOURCE, output=THEME_ASSET_OUTPUT):
+        self.source = source
+        self.output = output
+        self.manifest_path = os.path.join(output, ASSET_MANIFEST_NAME)
+        try:
+            with open(self.manifest_path) as file:
+                self.previous = json.load(file).get("assets", {})
+        except (OSError, ValueError):
+            self.previous = {}
+        self.results = []
+
+    def _source_files(self):
+        for root, directories, names in os.walk(self.source):
+            directories.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, self.source)
+
+    def _write(self, relative_path, data):
+        path = os.path.join(self.output, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+    def _outputs_exist(self, entry):
+        return all(os.path.exists(os.path.join(self.output, name)) for name in entry["outputs"])
+
+    def _build_asset(self, path, relative_path):
+        with open(path, "rb") as file:
+            data = file.read()
+        source_digest = sha256(data)
+        previous = self.previous.get(relative_path)
+        if previous and previous["source_sha256"] == source_digest and previous["tools"] == pipeline_tools() \
+                and self._outputs_exist(previous):
+            return previous, False
+
+        minified = minify(data, os.path.splitext(relative_path)[1])
+        name = fingerprinted_name(relative_path, sha256(minified))
+        variants = {"gzip": (f"{name}.gz", gzip.compress(minified, 9, mtime=0))}
+        if brotli:
+            variants["brotli"] = (f"{name}.br", brotli.compress(minified, quality=11))
+        # A variant that is not smaller than the plain file would only cost the server a lookup
+        variants = {variant: output for variant, output in variants.items() if len(output[1]) < len(minified)}
+        self._write(name, minified)
+        for variant_name, variant_data in variants.values():
+            self._write(variant_name, variant_data)
+        entry = {
+            "file": name,
+            "source_sha256": source_digest,
+            "tools": pipeline_tools(),
+            "outputs": [name] + [variant_name for variant_name, _ in variants.values()],
+            "bytes": {"source": len(data), "minified": len(minified),
+                      **{variant: len(variant_data) for variant, (_, variant_data) in variants.items()}}
+        }
+        return entry, True
+
+    def _rewrite_template(self, path, relative_path, renames):
+        # renames maps source paths to fingerprinted paths, both relative to the source root, so
+        # same-named assets in different directories are told apart
+        with open(path, encoding="utf-8") as file:
+            template = file.read()
+        base = posixpath.dirname(relative_path.replace(os.sep, "/"))
+
+        def replace(match):
+            reference = match.group(2)
+            if reference.startswith(RESOURCES_PATH_PREFIX):
+                target = posixpath.normpath(reference[len(RESOURCES_PATH_PREFIX):])
+                if target in renames:
+                    return match.group(1) + RESOURCES_PATH_PREFIX + renames[target]
+                return match.group(0)
+            target = posixpath.normpath(posixpath.join(base, reference))
+            if target not in renames:
+                return match.group(0)
+            return match.group(1) + posixpath.relpath(renames[target], base or ".")
+
+        self._sync(relative_path, REFERENCE.sub(replace, template).encode("utf-8"))
+
+    def _sync(self, relative_path, data):
+        # Unchanged outputs are not rewritten, so their mtimes and downstream caches stay valid
+        path = os.path.join(self.output, relative_path)
+        try:
+            with open(path, "rb") as file:
+                if file.read() == data:
+                    return False
+        except OSError:
+            pass
+        self._write(relative_path, data)
+        return True
+
+    def run(self):
+        assets = {}
+        others = []
+        for path, relative_path in self._source_files():
+            extension = os.path.splitext(relative_path)[1]
+            if extension not in ASSET_EXTENSIONS:
+                others.append((path, relative_path, extension))
+                continue
+            entry, built = self._build_asset(path, relative_path)
+            assets[relative_path] = entry
+            self.results.append((relative_path, entry, built))
+
+        renames = {relative_path.replace(os.sep, "/"): entry["file"].replace(os.sep, "/") for relative_path, entry in assets.items()}
+        for path, relative_path, extension in others:
+            if extension in TEMPLATE_EXTENSIONS:
+                self._rewrite_template(path, relative_path, renames)
+            else:
+                with open(path, "rb") as file:
+                    self._sync(relative_path, file.read())
+
+        # Fingerprinted files from earlier builds are removed once nothing references them
+        current = {name for entry in assets.values() for name in entry["outputs"]}
+        for entry in self.previous.values():
+            for name in entry["outputs"]:
+                if name not in current and os.path.exists(os.path.join(self.output, name)):
+                    os.remove(os.path.join(self.output, name))
+
+        self._sync(ASSET_MANIFEST_NAME, json.dumps({"cache_control": IMMUTABLE_CACHE_CONTROL, "assets": assets},
+                                                   indent=2, sort_keys=True).encode())
+        self.previous = assets
+        return assets
+
+    def report(self):
+        for relative_path, entry, built in self.results:
+            sizes = entry["bytes"]
+            smallest = min(value for key, value in sizes.items() if key != "source")
+            saved = 100 * (sizes["source"] - smallest) / sizes["source"] if sizes["source"] else 0
+            variants = ", ".join(f"{key} {sizes[key]:,}" for key in ("gzip", "brotli") if key in sizes)
+            logger.info(f"{'built  ' if built else 'skipped'} {relative_path} -> {entry['file']}: {sizes['source']:,} bytes, "
+                        f"minified {sizes['minified']:,}, {variants} ({saved:.0f}% saved)")
+        source = sum(entry["bytes"]["source"] for _, entry, _ in self.results)
+        best = sum(min(value for key, value in entry["bytes"].items() if key != "source") for _, entry, _ in self.results)
+        built = sum(1 for _, _, was_built in self.results if was_built)
+        logger.info(f"Theme assets: {built} of {len(self.results)} built, {source:,} -> {best:,} bytes over the wire.")
+        return self.results
+
+
+def build_theme_assets(source=THEME_ASSET_SOURCE, output=THEME_ASSET_OUTPUT):
+    pipeline = AssetPipeline(source, output)
+    pipeline.run()
+    pipeline.report()
+    return pipeline
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Minify, fingerprint and precompress the login theme assets.")
+    parser.add_argument("--source", default=THEME_ASSET_SOURCE)
+    parser.add_argument("--output", default=THEME_ASSET_OUTPUT)
+    args = parser.parse_args()
+    build_theme_assets(args.source, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+PLAN_CONFIGURATION_PATH = os.getenv(
+    "PLAN_CONFIGURATION_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_configuration.json")
+)
+
+REQUIRED_FIELDS = ["name", "price_monthly", "price_yearly", "aiToken", "usedStorage", "max_devices"]
+NUMERIC_FIELDS = ["price_monthly", "price_yearly", "aiToken", "usedStorage", "max_devices"]
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def validate_catalog(catalog):
+    if not isinstance(catalog.get("version"), int):
+        raise CatalogError("Tier catalog must have an integer 'version'")
+    tiers = catalog.get("tiers")
+    if not isinstance(tiers, dict) or not tiers:
+        raise CatalogError("Tier catalog must define at least one tier")
+    for tier, spec in tiers.items():
+        missing = [field for field in REQUIRED_FIELDS if field not in spec]
+        if missing:
+            raise CatalogError(f"Tier '{tier}' is missing fields: {', '.join(missing)}")
+        for field in NUMERIC_FIELDS:
+            value = spec[field]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise CatalogError(f"Tier '{tier}' has an invalid {field}: {value!r}")
+        # Anything that costs money must be purchasable through Stripe
+        if (spec["price_monthly"] or spec["price_yearly"]) and not spec.get("price_id"):
+            raise CatalogError(f"Tier '{tier}' has a price but no Stripe price_id")
+    return catalog
+
+
+def load_catalog(path=PLAN_CONFIGURATION_PATH):
+    try:
+        with open(path) as file:
+            catalog = json.load(file)
+    except (OSError, ValueError) as e:
+        raise CatalogError(f"Could not read tier catalog '{path}': {e}")
+    return validate_catalog(catalog)
+
+
+def price_ids(catalog):
+    return {tier: spec["price_id"] for tier, spec in catalog["tiers"].items() if spec.get("price_id")}
+
+
+def subscription_options(catalog):
+    return [
+        {
+            "tier": tier,
+            "name": spec["name"],
+            "price_monthly": spec["price_monthly"],
+            "price_yearly": spec["price_yearly"],
+            "ai_tokens": spec["aiToken"],
+            "storage": spec["usedStorage"]
+        }
+        for tier, spec in catalog["tiers"].items() if spec.get("price_id")
+    ]
+
+
+def group_attributes(catalog):
+    return {tier: {"aiToken": spec["aiToken"], "usedStorage": spec["usedStorage"]} for tier, spec in catalog["tiers"].items()}
+
+
+def device_restrictions(catalog):
+    return {tier: spec["max_devices"] for tier, spec in catalog["tiers"].items()}
+
+
+def serialize(payload):
+    body = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return body, hashlib.sha256(body).hexdigest()[:32]
@@ -0,0 +1,129 @@
+import json
+import logging
+import threading
+import time
+import jwt
+import requests
+from jwt.algorithms import RSAAlgorithm
+from metrics import DEPENDENCY_LATENCY
+
+#pip install pyjwt[crypto] requests
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_ALGORITHMS = ['RS256', 'RS384', 'RS512']
+
+# Claims that describe the token itself rather than the user; userinfo does not return them
+TOKEN_ONLY_CLAIMS = {
+    'exp', 'iat', 'nbf', 'auth_time', 'jti', 'iss', 'aud', 'typ', 'azp', 'nonce',
+    'session_state', 'sid', 'acr', 'scope', 'allowed-origins', 'realm_access', 'resource_access'
+}
+
+
+class TokenVerificationError(Exception):
+    pass
+
+
+class JWKSTokenVerifier:
+    def __init__(self, keycloak_url, realm, audience=None, jwks_ttl=3600, min_refresh_interval=30, leeway=10, timeout=5):
+        self.issuer = f"{(keycloak_url or '').rstrip('/')}/realms/{realm}"
+        self.jwks_url = f"{self.issuer}/protocol/openid-connect/certs"
+        self.audience = audience
+        self.jwks_ttl = jwks_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.leeway = leeway
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def _refresh_keys(self):
+        with DEPENDENCY_LATENCY.time(dependency='keycloak_jwks', operation='GET') as labels:
+            response = self._session.get(self.jwks_url, timeout=self.timeout)
+            labels['status'] = str(response.status_code)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get('keys', []):
+            if jwk.get('kty') != 'RSA' or jwk.get('use', 'sig') != 'sig' or 'kid' not in jwk:
+                continue
+            keys[jwk['kid']] = RSAAlgorithm.from_jwk(json.dumps(jwk))
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        logger.info(f"Loaded {len(keys)} signing keys from {self.jwks_url}.")
+
+    def _age(self):
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def get_signing_key(self, kid):
+        age = self._age()
+        key = self._keys.get(kid)
+        if key is not None and age < self.jwks_ttl:
+            return key
+
+        with self._lock:
+            # Another thread may have refreshed the keys while we were waiting for the lock
+            age = self._age()
+            key = self._keys.get(kid)
+            if key is not None and age < self.jwks_ttl:
+                return key
+            # Unknown kids must not let a client force a JWKS download on every request
+            if key is None and age is not None and age < self.min_refresh_interval:
+                return None
+            try:
+                self._refresh_keys()
+            except (requests.RequestException, ValueError) as e:
+                logger.error(f"Error fetching JWKS from {self.jwks_url}: {e}")
+                if self._fetched_at is not None:
+                    # Keep serving the stale keys but do not retry the fetch on every request
+                    self._fetched_at = time.monotonic() - self.jwks_ttl + self.min_refresh_interval
+                return key
+            return self._keys.get(kid)
+
+    def verify(self, access_token):
+        try:
+            header = jwt.get_unverified_header(access_token)
+        except jwt.InvalidTokenError as e:
+            raise TokenVerificationError(f"Malformed token: {e}")
+
+        algorithm = header.get('alg')
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise TokenVerificationError(f"Unsupported signing algorithm: {algorithm}")
+
+        key = self.get_signing_key(header.get('kid'))
+        if key is None:
+            raise TokenVerificationError(f"Unknown signing key: {header.get('kid')}")
+
+        try:
+            claims = jwt.decode(
+                access_token,
+                key,
+                algorithms=[algorithm],
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={'require': ['exp', 'iss', 'sub'], 'verify_aud': False}
+            )
+        except jwt.InvalidTokenError as e:
+            raise TokenVerificationError(str(e))
+
+        # ID and refresh tokens are signed by the same keys; only access tokens may authorize requests
+        if claims.get('typ') != 'Bearer':
+            raise TokenVerificationError(f"Not an access token: typ is '{claims.get('typ')}'")
+
+        if self.audience and not self._audience_matches(claims):
+            raise TokenVerificationError(f"Token was not issued for audience '{self.audience}'")
+
+        return claims
+
+    def _audience_matches(self, claims):
+        # Keycloak puts the requesting client in azp and only resource servers in aud
+        audience = claims.get('aud') or []
+        if isinstance(audience, str):
+            audience = [audience]
+        return self.audience in audience or claims.get('azp') == self.audience
+
+    def get_profile(self, access_token):
+        claims = self.verify(access_token)
+        return {name: value for name, value in claims.items() if name not in TOKEN_ONLY_CLAIMS}
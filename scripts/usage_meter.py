@@ -0,0 +1,202 @@
+import logging
+import os
+import sqlite3
+import threading
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+USAGE_METER_PATH = os.getenv('USAGE_METER_PATH', 'usage_meter.db')
+
+# Metered resource -> (token claim holding the limit, user attribute the usage is written back to)
+METERED_RESOURCES = {
+    'ai_tokens': ('aiToken', 'aiTokenUsed'),
+    'storage': ('usedStorage', 'usedStorageUsed')
+}
+
+USAGE_CHECKS = Counter('usage_meter_checks_total', 'Metered calls by outcome.', ['outcome'])
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, resource, limit, used, requested):
+        super().__init__(f"{resource} quota exceeded: {used} used of {limit}, {requested} requested")
+        self.resource = resource
+        self.limit = limit
+        self.used = used
+        self.requested = requested
+
+
+def claim_limit(claims, resource):
+    value = claims.get(METERED_RESOURCES[resource][0])
+    if isinstance(value, list):
+        value = value[0] if value else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        # No limit in the token means nothing may be consumed
+        return 0
+
+
+class UsageMeter:
+    """Per-user usage counters in SQLite, checked and updated in one transaction per call.
+
+    Every process on the host shares the file, so gunicorn workers enforce one quota between them.
+    seed(user_id) returns the usage Keycloak already holds for a user ({'ai_tokens': n, 'storage': n}
+    or None); it is asked once, the first time the file sees that user.
+    """
+
+    def __init__(self, path=USAGE_METER_PATH, seed=None):
+        self.path = path
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Commits survive a process crash; only a power loss can drop the last few
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                user_id TEXT PRIMARY KEY,
+                ai_tokens INTEGER NOT NULL DEFAULT 0,
+                storage INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0,
+                flushed_version INTEGER NOT NULL DEFAULT 0,
+                flushed_ai_tokens INTEGER NOT NULL DEFAULT 0,
+                flushed_storage INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(usage)')]
+        if 'flushed_ai_tokens' not in columns:
+            # Files from before deltas were flushed: fully flushed rows are already in Keycloak
+            self._conn.execute('ALTER TABLE usage ADD COLUMN flushed_ai_tokens INTEGER NOT NULL DEFAULT 0')
+            self._conn.execute('ALTER TABLE usage ADD COLUMN flushed_storage INTEGER NOT NULL DEFAULT 0')
+            self._conn.execute('UPDATE usage SET flushed_ai_tokens = ai_tokens, flushed_storage = storage '
+                               'WHERE version = flushed_version')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_usage_unflushed ON usage (version, flushed_version)')
+
+    def _transaction(self, statements):
+        # statements(conn) runs inside BEGIN IMMEDIATE; the write lock is what makes the quota check atomic
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(self._conn)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def _seed_if_new(self, user_id):
+        # Keycloak is asked outside the write lock; if two processes seed at once the first insert wins
+        if self.seed is None:
+            return
+        with self._lock:
+            known = self._conn.execute('SELECT 1 FROM usage WHERE user_id = ?', (user_id,)).fetchone()
+        if known:
+            return
+        used = self.seed(user_id) or {}
+        ai_tokens, storage = int(used.get('ai_tokens', 0)), int(used.get('storage', 0))
+        with self._lock:
+            # Seeded usage counts as flushed, so only what this host records is added back to Keycloak
+            self._conn.execute(
+                'INSERT INTO usage (user_id, ai_tokens, storage, flushed_ai_tokens, flushed_storage) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (user_id) DO NOTHING',
+                (user_id, ai_tokens, storage, ai_tokens, storage)
+            )
+
+    def record(self, user_id, claims, ai_tokens=0, storage=0):
+        if ai_tokens < 0 or storage < 0:
+            raise ValueError("Usage must not be negative; storage is given back with release_storage()")
+        limits = (claim_limit(claims, 'ai_tokens'), claim_limit(claims, 'storage'))
+        self._seed_if_new(user_id)
+
+        def statements(conn):
+            conn.execute('INSERT INTO usage (user_id) VALUES (?) ON CONFLICT (user_id) DO NOTHING', (user_id,))
+            used = conn.execute('SELECT ai_tokens, storage FROM usage WHERE user_id = ?', (user_id,)).fetchone()
+            for index, (resource, amount) in enumerate((('ai_tokens', ai_tokens), ('storage', storage))):
+                if amount > 0 and used[index] + amount > limits[index]:
+                    raise QuotaExceeded(resource, limits[index], used[index], amount)
+            if not (ai_tokens or storage):
+                return used
+            conn.execute(
+                'UPDATE usage SET ai_tokens = ai_tokens + ?, storage = storage + ?, version = version + 1 WHERE user_id = ?',
+                (ai_tokens, storage, user_id)
+            )
+            return (used[0] + ai_tokens, used[1] + storage)
+
+        try:
+            used = self._transaction(statements)
+        except QuotaExceeded:
+            USAGE_CHECKS.inc(outcome='rejected')
+            raise
+        USAGE_CHECKS.inc(outcome='accepted')
+        return {
+            'ai_tokens': {'used': used[0], 'limit': limits[0], 'remaining': max(0, limits[0] - used[0])},
+            'storage': {'used': used[1], 'limit': limits[1], 'remaining': max(0, limits[1] - used[1])}
+        }
+
+    def release_storage(self, user_id, storage):
+        # The only way usage goes down; AI tokens are consumed for good
+        if storage <= 0:
+            raise ValueError("Released storage must be positive")
+        self._seed_if_new(user_id)
+
+        def statements(conn):
+            conn.execute(
+                'UPDATE usage SET storage = MAX(0, storage - ?), version = version + 1 WHERE user_id = ?',
+                (storage, user_id)
+            )
+            row = conn.execute('SELECT ai_tokens, storage FROM usage WHERE user_id = ?', (user_id,)).fetchone()
+            return row or (0, 0)
+
+        ai_tokens, storage = self._transaction(statements)
+        return {'ai_tokens': ai_tokens, 'storage': storage}
+
+    def usage(self, user_id):
+        with self._lock:
+            row = self._conn.execute('SELECT ai_tokens, storage FROM usage WHERE user_id = ?', (user_id,)).fetchone()
+        ai_tokens, storage = row or (0, 0)
+        return {'ai_tokens': ai_tokens, 'storage': storage}
+
+    def unflushed(self, limit=1000):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT user_id, ai_tokens, storage, flushed_ai_tokens, flushed_storage, version FROM usage '
+                'WHERE version > flushed_version LIMIT ?', (limit,)
+            ).fetchall()
+
+    def mark_flushed(self, flushed):
+        # flushed: (user_id, version, ai_tokens, storage) as read by unflushed(); usage recorded after
+        # that version stays due for the next flush
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE usage SET flushed_version = ?, flushed_ai_tokens = ?, flushed_storage = ? '
+                'WHERE user_id = ? AND flushed_version < ?',
+                [(version, ai_tokens, storage, user_id, version) for user_id, version, ai_tokens, storage in flushed]
+            )
+
+    def flush(self, updater, batch_size=1000):
+        # updater is a BulkClaimUpdater whose update function adds each delta to the value in Keycloak,
+        # so hosts flushing the same user do not overwrite each other. A crash between the write and
+        # mark_flushed() adds that batch twice: usage is over-counted rather than lost
+        stats = {'flushed': 0, 'failed': 0}
+        while True:
+            rows = self.unflushed(batch_size)
+            if not rows:
+                break
+            result = updater.run(
+                (user_id, {'ai_tokens': ai_tokens - flushed_ai_tokens, 'storage': storage - flushed_storage})
+                for user_id, ai_tokens, storage, flushed_ai_tokens, flushed_storage, _ in rows
+            )
+            self.mark_flushed((user_id, version, ai_tokens, storage) for user_id, ai_tokens, storage, _, _, version in rows
+                              if user_id not in result.failures)
+            stats['flushed'] += result.succeeded
+            stats['failed'] += len(result.failures)
+            if result.failures:
+                # Left for the next flush rather than retried in a tight loop
+                break
+        if stats['flushed'] or stats['failed']:
+            logger.info(f"Usage flush finished: {stats['flushed']} users written back, {stats['failed']} failed.")
+        return stats
+
+    def close(self):
+        self._conn.close()
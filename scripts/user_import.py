@@ -0,0 +1,266 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from keycloak_admin_client import KeycloakAdminClient
+import tier_catalog
+
+logger = logging.getLogger(__name__)
+
+USER_IMPORT_BATCH_SIZE = int(os.getenv("USER_IMPORT_BATCH_SIZE", 500))
+USER_IMPORT_WORKERS = int(os.getenv("USER_IMPORT_WORKERS", 4))
+CLAIM_ATTRIBUTES = ["aiToken", "usedStorage"]
+PROFILE_FIELDS = ["email", "firstName", "lastName"]
+
+
+class UserImportError(Exception):
+    pass
+
+
+class RecordRejected(Exception):
+    pass
+
+
+def iter_records(path, file_format=None):
+    # Yields (position, record) one line at a time; JSONL lines are decoded later so a bad line is a reject, not a crash
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="") as file:
+        if file_format == "csv":
+            yield from enumerate(csv.DictReader(file))
+        else:
+            yield from enumerate(line for line in file if line.strip())
+
+
+def user_representation(record, tiers):
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise RecordRejected(f"invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise RecordRejected("record is not an object")
+    username = (record.get("username") or "").strip()
+    if not username:
+        raise RecordRejected("missing username")
+    tier = (record.get("tier") or "free").strip()
+    if tier not in tiers:
+        raise RecordRejected(f"unknown tier '{tier}'")
+
+    attributes = {}
+    for name in CLAIM_ATTRIBUTES:
+        value = record.get(name)
+        # Customers without their own limits get the tier defaults, like members of the group would
+        value = tiers[tier][name] if value in (None, "") else value
+        try:
+            attributes[name] = [str(int(value))]
+        except (TypeError, ValueError):
+            raise RecordRejected(f"invalid {name}: {value!r}")
+
+    user = {"username": username, "enabled": True, "groups": [tier], "attributes": attributes}
+    user.update({field: record[field] for field in PROFILE_FIELDS if record.get(field)})
+    return user
+
+
+class ImportCheckpoint:
+    # Batches finish out of order, so the checkpoint keeps the contiguous prefix that is done plus
+    # the batches completed beyond it; a resumed run skips both and never imports a batch twice
+    def __init__(self, path, source, batch_size):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.batch_size = batch_size
+        self.position = 0
+        self.completed = set()
+        self.totals = {"imported": 0, "skipped": 0, "rejected": 0}
+
+    @classmethod
+    def load(cls, path, source, batch_size):
+        checkpoint = cls(path, source, batch_size)
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path) as file:
+            state = json.load(file)
+        if state["source"] != checkpoint.source:
+            raise UserImportError(f"Checkpoint {path} belongs to {state['source']}; remove it to start over")
+        checkpoint.batch_size = state["batch_size"]
+        checkpoint.position = state["position"]
+        checkpoint.completed = set(state["completed"])
+        checkpoint.totals = state["totals"]
+        return checkpoint
+
+    def is_done(self, start):
+        return start < self.position or start in self.completed
+
+    def mark_done(self, start, counts):
+        self.completed.add(start)
+        for name, count in counts.items():
+            self.totals[name] += count
+        while self.position in self.completed:
+            self.completed.discard(self.position)
+            self.position += self.batch_size
+
+    def save(self):
+        state = {"source": self.source, "batch_size": self.batch_size, "position": self.position,
+                 "completed": sorted(self.completed), "totals": self.totals}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkUserImporter:
+    def __init__(self, admin_client, tiers, batch_size=USER_IMPORT_BATCH_SIZE, workers=USER_IMPORT_WORKERS,
+                 method="partial-import", report_interval=10):
+        self.admin_client = admin_client
+        self.tiers = tiers
+        self.batch_size = batch_size
+        self.workers = workers
+        self.method = method
+        self.report_interval = report_interval
+
+    def _create_one(self, user):
+        response = self.admin_client.post("/users", json=user)
+        if response.status_code == 201:
+            return "imported", None
+        if response.status_code == 409:
+            return "skipped", None
+        if response.status_code >= 500:
+            raise UserImportError(f"Error creating user '{user['username']}': {response.status_code} {response.text}")
+        return "rejected", f"{response.status_code} {response.text}"
+
+    def _import_batch(self, users):
+        # Returns {"imported": n, "skipped": n} and a list of (position, user, error) rejects
+        counts = {"imported": 0, "skipped": 0}
+        rejects = []
+        if self.method == "partial-import":
+            response = self.admin_client.post("/partialImport", json={"ifResourceExists": "SKIP",
+                                                                      "users": [user for _, user in users]})
+            if response.status_code == 200:
+                result = response.json()
+                counts["imported"] += result.get("added", 0)
+                counts["skipped"] += result.get("skipped", 0) + result.get("overwritten", 0)
+                return counts, rejects
+            if response.status_code >= 500:
+                raise UserImportError(f"Error importing batch: {response.status_code} {response.text}")
+            # One bad user fails the whole import; falling back to single creates isolates it
+            logger.warning(f"Batch import rejected ({response.status_code}), retrying its {len(users)} users one by one.")
+        for position, user in users:
+            outcome, error = self._create_one(user)
+            if outcome == "rejected":
+                rejects.append((position, user, error))
+            else:
+                counts[outcome] += 1
+        return counts, rejects
+
+    def _batches(self, records):
+        # Boundaries depend only on record positions, so every run cuts the file the same way
+        batch = []
+        for position, record in records:
+            if batch and position % self.batch_size == 0:
+                yield batch[0][0], batch
+                batch = []
+            batch.append((position, record))
+        if batch:
+            yield batch[0][0], batch
+
+    def run(self, path, file_format=None, checkpoint_path=None, rejects_path=None):
+        checkpoint = ImportCheckpoint.load(checkpoint_path or f"{path}.checkpoint", path, self.batch_size)
+        # A resumed run keeps the original batch boundaries so the checkpoint stays meaningful
+        self.batch_size = checkpoint.batch_size
+        resumed_from = checkpoint.position
+        if resumed_from or checkpoint.completed:
+            logger.info(f"Resuming import of {path} at record {resumed_from} ({len(checkpoint.completed)} later batches already done).")
+
+        lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        errors = []
+        processed = 0
+        started = last_report = time.monotonic()
+        rejects_file = open(rejects_path or f"{path}.rejects.jsonl", "a")
+
+        def process(start, records):
+            users, rejects = [], []
+            for position, record in records:
+                try:
+                    users.append((position, user_representation(record, self.tiers)))
+                except RecordRejected as e:
+                    rejects.append((position, record, str(e)))
+            counts, failed = self._import_batch(users) if users else ({"imported": 0, "skipped": 0}, [])
+            return counts, rejects + failed, len(records)
+
+        def on_done(future, start):
+            nonlocal processed, last_report
+            try:
+                counts, rejects, size = future.result()
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                in_flight.release()
+                return
+            with lock:
+                for position, record, error in rejects:
+                    rejects_file.write(json.dumps({"position": position, "record": record, "error": error}) + "\n")
+                rejects_file.flush()
+                checkpoint.mark_done(start, {**counts, "rejected": len(rejects)})
+                checkpoint.save()
+                processed += size
+                now = time.monotonic()
+                if now - last_report >= self.report_interval:
+                    last_report = now
+                    logger.info(f"{processed} records processed, {processed / (now - started):.1f}/s; totals {checkpoint.totals}.")
+            in_flight.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for start, records in self._batches(iter_records(path, file_format)):
+                    if errors:
+                        break
+                    if checkpoint.is_done(start):
+                        continue
+                    in_flight.acquire()
+                    future = pool.submit(process, start, records)
+                    future.add_done_callback(lambda f, s=start: on_done(f, s))
+        finally:
+            rejects_file.close()
+
+        elapsed = time.monotonic() - started
+        if errors:
+            raise UserImportError(f"Import stopped, rerun to resume from record {checkpoint.position}: {errors[0]}")
+        checkpoint.remove()
+        stats = {**checkpoint.totals, "resumed_from": resumed_from, "processed": processed,
+                 "elapsed_seconds": round(elapsed, 3), "records_per_second": round(processed / elapsed, 1) if elapsed else 0.0}
+        logger.info(f"User import finished: {stats}.")
+        return stats
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Stream users from JSONL or CSV into the realm, resuming where a previous run stopped.")
+    parser.add_argument("path", help="JSONL or CSV with username, email, firstName, lastName, tier, aiToken, usedStorage")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=USER_IMPORT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=USER_IMPORT_WORKERS)
+    parser.add_argument("--method", choices=["partial-import", "users"], default="partial-import",
+                        help="One partialImport call per batch, or one POST /users per user")
+    parser.add_argument("--checkpoint", help="Defaults to <path>.checkpoint")
+    parser.add_argument("--rejects", help="Defaults to <path>.rejects.jsonl")
+    args = parser.parse_args()
+
+    # Keep KEYCLOAK_ADMIN_POOL_SIZE at or above --workers so every worker gets a pooled connection
+    admin_client = KeycloakAdminClient.from_env()
+    importer = BulkUserImporter(admin_client, tier_catalog.group_attributes(tier_catalog.load_catalog()),
+                                batch_size=args.batch_size, workers=args.workers, method=args.method)
+    try:
+        importer.run(args.path, args.format, args.checkpoint, args.rejects)
+    finally:
+        admin_client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_PATH = os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.db')
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+DEAD = 'dead'
+
+WEBHOOK_EVENTS = Counter('webhook_events_total', 'Stripe webhook events by type and outcome.', ['type', 'outcome'])
+
+
+class WebhookQueue:
+    def __init__(self, path=WEBHOOK_QUEUE_PATH, dedup_ttl=7 * 24 * 3600, max_attempts=5, retry_backoff=30,
+                 visibility_timeout=300):
+        self.path = path
+        self.dedup_ttl = dedup_ttl
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        # A claimed event not completed or failed within this time is handed out again, e.g. after a crash
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_events (
+                event_id TEXT PRIMARY KEY,
+                event_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                received_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                processed_at REAL,
+                last_error TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_status ON webhook_events (status, available_at)")
+
+    def enqueue(self, event_id, event_type, payload):
+        now = time.time()
+        with self._lock:
+            # The event id is the primary key, so a redelivered event is dropped here
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO webhook_events (event_id, event_type, payload, status, received_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (event_id, event_type, payload, PENDING, now, now)
+            )
+        if cursor.rowcount == 0:
+            WEBHOOK_EVENTS.inc(type=event_type, outcome='duplicate')
+            logger.info(f"Ignoring duplicate webhook event {event_id}.")
+            return False
+        WEBHOOK_EVENTS.inc(type=event_type, outcome='received')
+        return True
+
+    def claim(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT event_id, event_type, payload, attempts FROM webhook_events "
+                    "WHERE status IN (?, ?) AND available_at <= ? ORDER BY received_at LIMIT 1",
+                    (PENDING, PROCESSING, now)
+                ).fetchone()
+                if row and row[3] >= self.max_attempts:
+                    # Only a claim that timed out can get here, e.g. an event that keeps crashing its worker
+                    self._conn.execute(
+                        "UPDATE webhook_events SET status = ?, processed_at = ?, last_error = ? WHERE event_id = ?",
+                        (DEAD, now, 'Claim timed out', row[0])
+                    )
+                    logger.error(f"Webhook event {row[0]} timed out {row[3]} times, giving up.")
+                    row = None
+                elif row:
+                    self._conn.execute(
+                        "UPDATE webhook_events SET status = ?, attempts = attempts + 1, available_at = ? WHERE event_id = ?",
+                        (PROCESSING, now + self.visibility_timeout, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {'id': row[0], 'type': row[1], 'event': json.loads(row[2]), 'attempts': row[3] + 1}
+
+    def complete(self, event_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_events SET status = ?, processed_at = ?, last_error = NULL WHERE event_id = ?",
+                (DONE, time.time(), event_id)
+            )
+
+    def fail(self, event_id, attempts, error):
+        now = time.time()
+        if attempts >= self.max_attempts:
+            status, available_at = DEAD, now
+            logger.error(f"Webhook event {event_id} failed {attempts} times, giving up: {error}")
+        else:
+            status, available_at = PENDING, now + self.retry_backoff * (2 ** (attempts - 1))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_events SET status = ?, available_at = ?, processed_at = ?, last_error = ? WHERE event_id = ?",
+                (status, available_at, now if status == DEAD else None, str(error), event_id)
+            )
+
+    def purge(self):
+        # Finished events are kept for the dedup TTL so Stripe retries are still recognised
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM webhook_events WHERE status IN (?, ?) AND processed_at < ?",
+                (DONE, DEAD, time.time() - self.dedup_ttl)
+            )
+        return cursor.rowcount
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM webhook_events GROUP BY status").fetchall())
+            oldest_pending = self._conn.execute(
+                "SELECT MIN(received_at) FROM webhook_events WHERE status IN (?, ?)", (PENDING, PROCESSING)
+            ).fetchone()[0]
+            recent_lag = self._conn.execute(
+                "SELECT AVG(processed_at - received_at) FROM webhook_events WHERE status = ? AND processed_at > ?",
+                (DONE, now - 300)
+            ).fetchone()[0]
+        return {
+            'depth': counts.get(PENDING, 0) + counts.get(PROCESSING, 0),
+            'pending': counts.get(PENDING, 0),
+            'processing': counts.get(PROCESSING, 0),
+            'done': counts.get(DONE, 0),
+            'dead': counts.get(DEAD, 0),
+            'oldest_pending_age_seconds': round(now - oldest_pending, 3) if oldest_pending else 0.0,
+            'avg_processing_lag_seconds': round(recent_lag, 3) if recent_lag else 0.0
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+class WebhookWorkerPool:
+    def __init__(self, queue, handler, workers=4, poll_interval=0.5, purge_interval=3600):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_purge = 0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} webhook workers.")
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - self._last_purge > self.purge_interval:
+                    self._last_purge = time.monotonic()
+                    self.queue.purge()
+                item = self.queue.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading webhook queue: {e}")
+                item = None
+            if item is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                self.handler(item['event'])
+                self.queue.complete(item['id'])
+                WEBHOOK_EVENTS.inc(type=item['type'], outcome='processed')
+            except Exception as e:
+                logger.error(f"Error processing webhook event {item['id']}: {e}")
+                WEBHOOK_EVENTS.inc(type=item['type'], outcome='failed')
+                self.queue.fail(item['id'], item['attempts'], e)
@@ -0,0 +1,66 @@
+import json
+import os
+import pytest
+from artifact_sync import REMOTE_MANIFEST_NAME, ArtifactSync, local_manifest
+from deploy_to_vs_server import VirtualServerManager, parse_host
+from fake_ssh_server import FakeSSHServer
+
+
+@pytest.fixture
+def artifacts(tmp_path, monkeypatch):
+    # Paths in the manifest are relative, like the deploy script's
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('themes/material/node_modules')
+    for name in ('login.css', 'login.js'):
+        with open(f"themes/material/{name}", 'w') as file:
+            file.write(f"/* {name} */\n")
+    with open('themes/material/node_modules/dep.js', 'w') as file:
+        file.write('module.exports = 1;\n')
+    with open('Dockerfile', 'w') as file:
+        file.write('FROM keycloak\n')
+    return ['Dockerfile', 'themes']
+
+
+@pytest.fixture
+def server(tmp_path):
+    fake = FakeSSHServer(str(tmp_path / 'host')).start()
+    host, port = parse_host(fake.address)
+    with VirtualServerManager(host, 'deploy', 'secret', port) as manager:
+        yield fake, manager
+    fake.stop()
+
+
+def test_manifest_skips_ignored_directories(artifacts):
+    manifest = local_manifest(artifacts)
+    assert sorted(manifest) == ['Dockerfile', 'themes/material/login.css', 'themes/material/login.js']
+    assert manifest['Dockerfile']['size'] == len('FROM keycloak\n')
+
+
+def test_only_changed_files_are_sent(artifacts, server):
+    fake, manager = server
+    sync = ArtifactSync(manager, '/home/deploy')
+    first = sync.sync(artifacts)
+    assert (first.files_sent, first.files_total) == (3, 3)
+
+    repeat = sync.sync(artifacts)
+    assert (repeat.files_sent, repeat.bytes_sent) == (0, 0)
+
+    with open('themes/material/login.css', 'a') as file:
+        file.write('body { margin: 0; }\n')
+    changed = sync.sync(artifacts)
+    assert changed.files_sent == 1
+
+    remote = os.path.join(fake.root, 'home', 'deploy')
+    with open(os.path.join(remote, 'themes', 'material', 'login.css')) as file:
+        assert file.read().endswith('body { margin: 0; }\n')
+    with open(os.path.join(remote, REMOTE_MANIFEST_NAME)) as file:
+        assert json.load(file) == local_manifest(artifacts)
+
+
+def test_remote_files_no_longer_local_stay_in_the_manifest(artifacts, server):
+    _, manager = server
+    sync = ArtifactSync(manager, '/home/deploy')
+    sync.sync(artifacts)
+    os.remove('themes/material/login.js')
+    assert sync.sync(artifacts).files_sent == 0
+    assert 'themes/material/login.js' in sync.remote_manifest()
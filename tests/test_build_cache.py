@@ -0,0 +1,56 @@
+import os
+import pytest
+from build_cache import BuildCache, hash_inputs
+
+
+@pytest.fixture
+def tree(tmp_path):
+    source = tmp_path / 'theme'
+    (source / 'node_modules').mkdir(parents=True)
+    (source / 'login.css').write_text('body { margin: 0; }')
+    (source / 'node_modules' / 'dep.js').write_text('module.exports = 1;')
+    return tmp_path
+
+
+def cache_for(tree, **kwargs):
+    return BuildCache(str(tree / '.build-cache.json'), **kwargs)
+
+
+def test_unchanged_inputs_hit_and_a_change_misses(tree):
+    inputs = [str(tree / 'theme')]
+    builds = []
+    assert cache_for(tree).run('theme', inputs, builds.append)
+    assert not cache_for(tree).run('theme', inputs, builds.append)
+
+    (tree / 'theme' / 'login.css').write_text('body { margin: 1px; }')
+    assert cache_for(tree).run('theme', inputs, builds.append)
+    assert len(builds) == 2 and builds[0] != builds[1]
+
+
+def test_ignored_directories_and_settings(tree):
+    inputs = [str(tree / 'theme')]
+    digest = hash_inputs(inputs)
+    (tree / 'theme' / 'node_modules' / 'dep.js').write_text('module.exports = 2;')
+    assert hash_inputs(inputs) == digest
+    assert hash_inputs(inputs, extra={'image': 'other'}) != digest
+
+
+def test_missing_artifact_and_force_rebuild(tree):
+    inputs = [str(tree / 'theme')]
+    builds = []
+    cache_for(tree).run('image', inputs, builds.append)
+    assert cache_for(tree).run('image', inputs, builds.append, artifact_exists=lambda digest: False)
+    assert cache_for(tree, force=True).run('image', inputs, builds.append)
+    assert len(builds) == 3
+
+
+def test_failed_build_is_not_recorded(tree):
+    inputs = [str(tree / 'theme')]
+
+    def fail(digest):
+        raise RuntimeError("npm run build failed")
+
+    with pytest.raises(RuntimeError):
+        cache_for(tree).run('theme', inputs, fail)
+    assert not os.path.exists(tree / '.build-cache.json')
+    assert cache_for(tree).run('theme', inputs, lambda digest: None)
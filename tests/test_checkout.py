@@ -0,0 +1,8 @@
+import payment_gateway_server as gateway
+
+
+def test_checkout_quotas_come_from_the_catalog():
+    spec = gateway.TIER_CATALOG['tiers']['basic']
+    params = gateway.checkout_session_params('user-1', 'basic')
+    assert params['line_items'] == [{'price': gateway.PRICE_IDS['basic'], 'quantity': 1}]
+    assert params['metadata'] == {'user_id': 'user-1', 'ai_tokens': spec['aiToken'], 'storage': spec['usedStorage']}
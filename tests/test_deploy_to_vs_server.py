@@ -0,0 +1,90 @@
+import functools
+import os
+import threading
+import pytest
+import deploy_to_vs_server as deploy
+from fake_ssh_server import FakeSSHServer
+
+
+@pytest.fixture
+def servers(tmp_path):
+    started = []
+
+    def start(count):
+        started.extend(FakeSSHServer(str(tmp_path / f"host{i}")).start() for i in range(count))
+        return started
+
+    yield start
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    deploy.create_dockerfile()
+    deploy.create_docker_compose_file()
+    os.makedirs(deploy.THEME_ARTIFACTS)
+    with open(os.path.join(deploy.THEME_ARTIFACTS, "login.css"), "w") as file:
+        file.write("body { margin: 0; }\n")
+    return tmp_path
+
+
+def manager(server):
+    host, port = deploy.parse_host(server.address)
+    return deploy.VirtualServerManager(host, "deploy", "secret", port)
+
+
+def test_one_session_serves_commands_and_transfers(servers, workdir):
+    [server] = servers(1)
+    with manager(server) as vserver:
+        assert vserver.execute_commands(["echo one", "echo two"]) == [(0, ""), (0, "")]
+        vserver.transfer_file(deploy.DOCKERFILE, "/home/deploy/Dockerfile")
+        vserver.sync_artifacts([deploy.DOCKER_COMPOSE_FILE], "/home/deploy")
+        vserver.deploy_docker_compose()
+    assert server.connections == 1
+    assert os.path.isfile(os.path.join(server.root, "home", "deploy", "Dockerfile"))
+
+
+def test_output_on_both_streams_does_not_stall(servers):
+    [server] = servers(1)
+    # More than a channel window on stderr, sent before any stdout
+    server.responses[r"noisy"] = (3, "done\n", "x" * (4 * 1024 * 1024))
+    results = []
+    with manager(server) as vserver:
+        reader = threading.Thread(target=lambda: results.append(vserver.execute_commands(["noisy"], check=False)))
+        reader.start()
+        reader.join(timeout=30)
+    assert results == [[(3, "done\n")]]
+
+
+def test_failed_command_raises_with_stderr(servers):
+    [server] = servers(1)
+    server.responses[r"docker-compose"] = (1, "", "no such service")
+    with manager(server) as vserver, pytest.raises(deploy.RemoteCommandError, match="no such service"):
+        vserver.deploy_docker_compose()
+
+
+def test_rolling_deploy_halts_after_a_failed_batch(servers, workdir):
+    hosts = servers(4)
+    hosts[1].responses[r"docker-compose -f"] = (1, "", "port is already allocated")
+    deploy_fn = functools.partial(deploy.deploy_host, user="deploy", password="secret")
+    results = deploy.MultiHostDeployer([server.address for server in hosts], deploy_fn, batch_size=1).run()
+
+    assert [result.status for result in results] == ["succeeded", "failed", "skipped", "skipped"]
+    assert "port is already allocated" in results[1].error
+    assert [server.connections for server in hosts] == [1, 1, 0, 0]
+    assert deploy.MultiHostDeployer.report(results) == [server.address for server in hosts[1:]]
+
+
+def test_parallel_deploy_does_not_halt(servers, workdir):
+    hosts = servers(3)
+    hosts[0].responses[r"docker-compose -f"] = (1, "")
+    deploy_fn = functools.partial(deploy.deploy_host, user="deploy", password="secret")
+    results = deploy.MultiHostDeployer([server.address for server in hosts], deploy_fn).run()
+    assert [result.status for result in results] == ["failed", "succeeded", "succeeded"]
+
+
+def test_no_hosts_deploys_nothing():
+    assert deploy.MultiHostDeployer([]).run() == []
+    assert deploy.MultiHostDeployer([], batch_size=2).run() == []
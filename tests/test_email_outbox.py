@@ -0,0 +1,81 @@
+import socket
+import pytest
+from aiosmtpd.controller import Controller
+from flask import Flask
+from flask_mail import Mail
+from email_outbox import EmailOutbox
+
+
+class Handler:
+    def __init__(self):
+        self.delivered = []
+        self.sessions = set()
+        # recipient -> replies returned to its DATA commands, in order, before it is accepted
+        self.replies = {}
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        recipient = envelope.rcpt_tos[0]
+        replies = self.replies.get(recipient)
+        if replies:
+            return replies.pop(0)
+        self.delivered.append(recipient)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    handler = Handler()
+    port = free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    yield handler, port
+    controller.stop()
+
+
+def outbox_for(port, **kwargs):
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USE_SSL=False)
+    outbox = EmailOutbox(Mail(app), app, sender='no-reply@example.com', flush_interval=0.05, retry_backoff=0.05, **kwargs)
+    outbox.start()
+    return outbox
+
+
+def send_all(outbox, recipients):
+    outbox.send_bulk(("Subject", recipient, "Body") for recipient in recipients)
+    outbox.stop()
+
+
+def test_rejected_message_does_not_affect_the_batch(smtp):
+    handler, port = smtp
+    handler.replies['b@example.com'] = ['554 Message rejected']
+    outbox = outbox_for(port)
+    send_all(outbox, ['a@example.com', 'b@example.com', 'c@example.com'])
+    assert handler.delivered == ['a@example.com', 'c@example.com']
+    assert outbox.stats() == {'queued': 0, 'sent': 2, 'failed': 1}
+    assert len(handler.sessions) == 1
+
+
+def test_deferred_message_is_retried_alone(smtp):
+    handler, port = smtp
+    handler.replies['a@example.com'] = ['451 Try again later']
+    outbox = outbox_for(port)
+    send_all(outbox, ['a@example.com', 'b@example.com'])
+    assert handler.delivered == ['b@example.com', 'a@example.com']
+    assert outbox.stats() == {'queued': 0, 'sent': 2, 'failed': 0}
+
+
+def test_deferred_message_gives_up_after_max_retries(smtp):
+    handler, port = smtp
+    handler.replies['a@example.com'] = ['451 Try again later'] * 3
+    outbox = outbox_for(port, max_retries=2)
+    send_all(outbox, ['a@example.com', 'b@example.com'])
+    assert handler.delivered == ['b@example.com']
+    assert outbox.stats() == {'queued': 0, 'sent': 1, 'failed': 1}
+    assert handler.replies['a@example.com'] == []
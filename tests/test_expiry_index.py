@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+import pytest
+from expiry_index import ExpiryIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ExpiryIndex(str(tmp_path / 'expiry_index.db'))
+    yield index
+    index.close()
+
+
+def test_claimed_entries_stay_until_completed(index):
+    now = datetime.now()
+    index.record('user-1', now - timedelta(days=1))
+    index.record('user-2', now + timedelta(days=1))
+    entries = index.claim_due(now)
+    assert [user_id for user_id, _ in entries] == ['user-1']
+    assert index.claim_due(now) == []
+    assert index.count() == 2
+    index.complete(entries)
+    assert index.count() == 1
+
+
+def test_expired_claim_is_retried(index):
+    now = datetime.now()
+    index.record('user-1', now - timedelta(days=1))
+    index.claim_due(now, lease=-1)
+    assert [user_id for user_id, _ in index.claim_due(now)] == ['user-1']
+
+
+def test_claim_due_is_batched(index):
+    now = datetime.now()
+    for n in range(5):
+        index.record(f"user-{n}", now - timedelta(minutes=n))
+    assert len(index.claim_due(now, limit=2)) == 2
+    assert len(index.claim_due(now, limit=10)) == 3
+
+
+def test_renewal_keeps_claimed_entry(index):
+    now = datetime.now()
+    index.record('user-1', now - timedelta(days=1))
+    entries = index.claim_due(now)
+    index.record('user-1', now + timedelta(days=30))
+    index.complete(entries)
+    assert index.count() == 1
+    assert index.claim_due(now) == []
@@ -0,0 +1,53 @@
+import time
+import pytest
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient, KeycloakAdminError
+
+
+@pytest.fixture
+def keycloak():
+    fake = FakeKeycloak().start()
+    yield fake
+    fake.stop()
+
+
+def client_for(keycloak, **kwargs):
+    return KeycloakAdminClient(keycloak.url, keycloak.realm, client_id='gateway', client_secret='secret',
+                               backoff_factor=0, **kwargs)
+
+
+def with_token(client):
+    # Skips the token request so only the call under test sees the injected latency
+    client._token = 'token'
+    client._token_expires_at = time.monotonic() + 300
+    return client
+
+
+def test_token_timeout_is_wrapped(keycloak):
+    keycloak.latency = 0.3
+    client = client_for(keycloak, timeout=0.05)
+    with pytest.raises(KeycloakAdminError, match='admin token'):
+        client.get('/users')
+
+
+def test_read_timeout_is_retried_for_get(keycloak):
+    user_id = keycloak.add_user('alice')
+    keycloak.latency = 0.3
+    client = with_token(client_for(keycloak, timeout=0.05, max_retries=2))
+    with pytest.raises(KeycloakAdminError, match='Error calling GET'):
+        client.get(f"/users/{user_id}")
+    assert keycloak.request_count == 3
+
+
+def test_read_timeout_is_not_retried_for_post(keycloak):
+    keycloak.latency = 0.3
+    client = with_token(client_for(keycloak, timeout=0.05, max_retries=2))
+    with pytest.raises(KeycloakAdminError, match='Error calling POST'):
+        client.post('/users', json={'username': 'bob'})
+    assert keycloak.request_count == 1
+
+
+def test_connection_refused_is_wrapped():
+    client = with_token(KeycloakAdminClient('http://127.0.0.1:9', 'myrealm', max_retries=1, backoff_factor=0))
+    with pytest.raises(KeycloakAdminError):
+        list(client.iter_users())
@@ -0,0 +1,50 @@
+import pytest
+from build_and_config_keycloak import RealmDefinition
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+from keycloak_reconciler import KeycloakReconciler
+
+
+@pytest.fixture
+def keycloak():
+    fake = FakeKeycloak(realm=RealmDefinition.realm()['realm']).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def reconciler(keycloak):
+    client = KeycloakAdminClient(keycloak.url, keycloak.realm, client_id='admin-cli', client_secret='secret')
+    yield KeycloakReconciler(client)
+    client.close()
+
+
+def writes(keycloak):
+    return keycloak.requests_by_method['POST'] + keycloak.requests_by_method['PUT']
+
+
+@pytest.mark.parametrize('realm_exists', [True, False])
+def test_second_reconcile_writes_nothing(keycloak, reconciler, realm_exists):
+    if not realm_exists:
+        keycloak.realm_settings = None
+    desired = RealmDefinition.desired_state()
+    assert reconciler.apply(reconciler.plan(desired)) > 0
+    assert keycloak.groups and keycloak.clients and keycloak.identity_providers
+
+    # Token requests are POSTs too, so count from after the client already holds one
+    writes_before = writes(keycloak)
+    assert reconciler.plan(desired) == []
+    assert reconciler.apply(reconciler.plan(desired)) == 0
+    assert writes(keycloak) == writes_before
+
+
+def test_drift_is_put_back(keycloak, reconciler):
+    desired = RealmDefinition.desired_state()
+    reconciler.apply(reconciler.plan(desired))
+    group = next(iter(keycloak.groups.values()))
+    group['attributes']['aiToken'] = ['1']
+
+    changes = reconciler.plan(desired)
+    assert [(change.action, change.kind, change.name) for change in changes] == [('update', 'group', group['name'])]
+    reconciler.apply(changes)
+    assert reconciler.plan(desired) == []
@@ -0,0 +1,37 @@
+import pytest
+from leader_election import LeaseBackend, ShardCoordinator, SQLiteLeaseBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / 'leases.db'))
+    yield backend
+    backend.close()
+
+
+def test_backend_must_implement_every_operation():
+    class Incomplete(LeaseBackend):
+        def acquire(self, name, holder, ttl):
+            return True
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_shards_are_split_between_holders(backend):
+    nodes = [ShardCoordinator(backend, 'sweep', f"node-{n}", shards=4) for n in range(2)]
+    for _ in range(2):
+        for node in nodes:
+            node.heartbeat()
+    owned = [node.owned_shards() for node in nodes]
+    assert owned[0] | owned[1] == {0, 1, 2, 3}
+    assert len(owned[0]) == len(owned[1]) == 2
+
+
+def test_released_shards_are_taken_over(backend):
+    nodes = [ShardCoordinator(backend, 'sweep', f"node-{n}", shards=4) for n in range(2)]
+    for node in nodes:
+        node.heartbeat()
+    nodes[0].release_all()
+    assert nodes[1].heartbeat() == {0, 1, 2, 3}
+    assert not nodes[0].is_leader
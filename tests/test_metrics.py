@@ -0,0 +1,47 @@
+import gc
+import threading
+import pytest
+from metrics import Counter, Histogram, _ShardedMetric
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+
+
+def test_exited_threads_fold_into_the_base():
+    requests = Counter('test_requests_total', 'Requests.', ['route'], registry=None)
+    latency = Histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0), registry=None)
+
+    def work():
+        for _ in range(10):
+            requests.inc(route='/usage')
+            latency.observe(0.5)
+
+    for _ in range(5):
+        run_threads(work, 8)
+    assert len(requests._shards) == 0 and len(latency._shards) == 0
+    assert requests.values() == {('/usage',): 400}
+    assert latency.values() == {(): [0, 400, 0, 200.0]}
+
+
+def test_live_thread_shard_is_counted():
+    requests = Counter('test_live_total', 'Requests.', registry=None)
+    requests.inc(2)
+    run_threads(lambda: requests.inc(3), 4)
+    requests.inc()
+    assert requests.values() == {(): 15}
+    assert len(requests._shards) == 1
+    assert 'test_live_total 15' in requests.samples()
+
+
+def test_sharded_metric_must_implement_merge():
+    class Incomplete(_ShardedMetric):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete('test_incomplete', 'Incomplete.', registry=None)
@@ -0,0 +1,62 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import readiness
+
+
+@pytest.fixture
+def health():
+    # /health/ready that reports whatever status the test sets
+    state = {'status': 'DOWN'}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({'status': state['status']}).encode()
+            self.send_response(200 if state['status'] == 'UP' else 503)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield state, f"http://127.0.0.1:{server.server_address[1]}/health/ready"
+    server.shutdown()
+    server.server_close()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_timeout_stops_at_the_deadline():
+    probes = []
+    started = time.monotonic()
+    with pytest.raises(readiness.ReadinessTimeout, match="'keycloak' was not ready"):
+        readiness.wait_for('keycloak', lambda: probes.append(time.monotonic()) and False, started + 0.5,
+                           initial_delay=0.05, max_delay=0.1)
+    elapsed = time.monotonic() - started
+    assert 0.5 <= elapsed < 0.8
+    assert len(probes) >= 4
+
+
+def test_database_timeout_is_reported_before_keycloak(health):
+    _, url = health
+    with pytest.raises(readiness.ReadinessTimeout, match="'database'"):
+        readiness.wait_until_ready(url, db_host='127.0.0.1', db_port=closed_port(), deadline=time.monotonic() + 0.3)
+
+
+def test_ready_once_health_reports_up(health):
+    state, url = health
+    assert not readiness.keycloak_ready(url)
+    threading.Timer(0.2, state.update, [{'status': 'UP'}]).start()
+    phases = readiness.wait_until_ready(url, deadline=time.monotonic() + 5)
+    assert 0.2 <= phases['keycloak'] < 5
+    assert readiness.keycloak_ready(url)
@@ -0,0 +1,65 @@
+import pytest
+from build_and_config_keycloak import RealmDefinition
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+from realm_import import RealmImporter, RealmImportError, validate_realm
+
+
+@pytest.fixture
+def keycloak():
+    fake = FakeKeycloak(realm=RealmDefinition.realm()['realm']).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def importer(keycloak):
+    client = KeycloakAdminClient(keycloak.url, keycloak.realm, client_id='admin-cli', client_secret='secret')
+    yield RealmImporter(client)
+    client.close()
+
+
+def imported(keycloak):
+    return (sorted(group['name'] for group in keycloak.groups.values()),
+            sorted(client['clientId'] for client in keycloak.clients.values()),
+            sorted(keycloak.identity_providers),
+            sorted(user['username'] for user in keycloak.users.values()))
+
+
+def test_representation_is_valid():
+    representation = RealmDefinition.realm_representation()
+    assert validate_realm(representation) is representation
+    assert all(isinstance(value, str) for value in representation['smtpServer'].values())
+
+
+def test_invalid_representation_is_rejected():
+    representation = RealmDefinition.realm_representation()
+    del representation['realm']
+    with pytest.raises(RealmImportError, match='realm'):
+        validate_realm(representation)
+
+
+def test_existing_realm_gets_settings_and_partial_import(keycloak, importer):
+    representation = RealmDefinition.realm_representation()
+    assert importer.apply(representation) == 2
+    assert keycloak.realm_settings['smtpServer']['host'] == representation['smtpServer']['host']
+    assert imported(keycloak) == (
+        sorted(group['name'] for group in representation['groups']),
+        sorted(client['clientId'] for client in representation['clients']),
+        sorted(idp['alias'] for idp in representation['identityProviders']),
+        sorted(user['username'] for user in representation['users'])
+    )
+
+    # Applying again skips every resource instead of duplicating it
+    before = imported(keycloak)
+    assert importer.apply(representation) == 2
+    assert imported(keycloak) == before
+
+
+def test_missing_realm_is_created_in_one_call(keycloak, importer):
+    keycloak.realm_settings = None
+    representation = RealmDefinition.realm_representation()
+    assert importer.apply(representation) == 1
+    assert keycloak.realm_settings['realm'] == representation['realm']
+    assert len(keycloak.groups) == len(representation['groups'])
+    assert len(keycloak.users) == len(representation['users'])
@@ -0,0 +1,69 @@
+import threading
+import pytest
+from step_scheduler import CANCELLED, FAILED, SUCCEEDED, StepScheduler
+
+
+def recorder(order, lock, name):
+    def step():
+        with lock:
+            order.append(name)
+    return step
+
+
+def test_steps_run_after_their_dependencies():
+    scheduler = StepScheduler(max_workers=4)
+    order, lock = [], threading.Lock()
+    graph = {'build': (), 'image': ('build',), 'realm': (), 'client': ('realm',), 'start': ('image', 'client')}
+    for name, depends_on in graph.items():
+        scheduler.add(name, recorder(order, lock, name), depends_on)
+
+    results = scheduler.run()
+    assert {name: result.status for name, result in results.items()} == dict.fromkeys(graph, SUCCEEDED)
+    for name, depends_on in graph.items():
+        assert all(order.index(dependency) < order.index(name) for dependency in depends_on)
+
+
+def test_independent_steps_run_in_parallel():
+    scheduler = StepScheduler(max_workers=2)
+    both_started = threading.Barrier(2, timeout=5)
+    scheduler.add('a', both_started.wait)
+    scheduler.add('b', both_started.wait)
+    assert all(result.status == SUCCEEDED for result in scheduler.run().values())
+
+
+def test_failure_cancels_dependents_only():
+    scheduler = StepScheduler()
+
+    def fail():
+        raise RuntimeError("docker build failed")
+
+    scheduler.add('build', fail)
+    scheduler.add('image', lambda: None, ['build'])
+    scheduler.add('start', lambda: None, ['image'])
+    scheduler.add('realm', lambda: None)
+    results = scheduler.run()
+    assert {name: result.status for name, result in results.items()} == {
+        'build': FAILED, 'image': CANCELLED, 'start': CANCELLED, 'realm': SUCCEEDED
+    }
+    assert str(results['build'].error) == "docker build failed"
+
+
+def test_cycle_is_rejected_before_anything_runs():
+    scheduler = StepScheduler()
+    ran = []
+    scheduler.add('setup', lambda: ran.append('setup'))
+    scheduler.add('a', lambda: ran.append('a'), ['setup', 'c'])
+    scheduler.add('b', lambda: ran.append('b'), ['a'])
+    scheduler.add('c', lambda: ran.append('c'), ['b'])
+    with pytest.raises(ValueError, match='cycle: a, b, c'):
+        scheduler.run()
+    assert ran == []
+
+
+def test_unknown_dependency_and_duplicate_names_are_rejected():
+    scheduler = StepScheduler()
+    scheduler.add('start', lambda: None, ['image'])
+    with pytest.raises(ValueError, match="unknown step 'image'"):
+        scheduler.run()
+    with pytest.raises(ValueError, match='already defined'):
+        scheduler.add('start', lambda: None)
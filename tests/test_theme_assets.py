@@ -0,0 +1,62 @@
+import json
+import os
+import pytest
+from theme_assets import ASSET_MANIFEST_NAME, AssetPipeline, fingerprinted_name
+
+
+def write(root, relative_path, text):
+    path = os.path.join(root, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(text)
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    source, output = str(tmp_path / 'login'), str(tmp_path / 'dist')
+    write(source, 'css/app.css', 'body { margin: 0; }\n')
+    write(source, 'vendor/app.css', '.vendor { color: red; }\n')
+    write(source, 'js/main-YT3QVHDC.js', 'console.log("main");\n')
+    write(source, 'login.ftl', '<link href="css/app.css"><link href="vendor/app.css">'
+                                '<link href="${url.resourcesPath}/vendor/app.css"><script src="js/main-YT3QVHDC.js"></script>'
+                                '<link href="missing/app.css">')
+    write(source, 'email/html/notice.ftl', '<link href="../../css/app.css">')
+    write(source, 'theme.properties', 'parent=base\n')
+    return source, output
+
+
+def read(root, relative_path):
+    with open(os.path.join(root, relative_path)) as file:
+        return file.read()
+
+
+def test_fingerprinted_name_replaces_the_bundler_hash():
+    assert fingerprinted_name('js/main-YT3QVHDC.js', 'abcdef0123456789') == 'js/main.abcdef012345.js'
+
+
+def test_same_named_assets_are_renamed_by_path(dirs):
+    source, output = dirs
+    assets = AssetPipeline(source, output).run()
+    css, vendor, main = (assets[path]['file'] for path in ('css/app.css', 'vendor/app.css', 'js/main-YT3QVHDC.js'))
+    assert css != vendor and css.startswith('css/app.') and vendor.startswith('vendor/app.')
+
+    assert read(output, 'login.ftl') == (
+        f'<link href="{css}"><link href="{vendor}"><link href="${{url.resourcesPath}}/{vendor}">'
+        f'<script src="{main}"></script><link href="missing/app.css">'
+    )
+    assert read(output, 'email/html/notice.ftl') == f'<link href="../../{css}">'
+    assert read(output, 'theme.properties') == 'parent=base\n'
+
+
+def test_unchanged_assets_are_skipped_and_stale_ones_removed(dirs):
+    source, output = dirs
+    first = AssetPipeline(source, output).run()
+
+    write(source, 'css/app.css', 'body { margin: 1px; }\n')
+    pipeline = AssetPipeline(source, output)
+    second = pipeline.run()
+    built = {relative_path: was_built for relative_path, _, was_built in pipeline.results}
+    assert built == {'css/app.css': True, 'js/main-YT3QVHDC.js': False, 'vendor/app.css': False}
+    assert not os.path.exists(os.path.join(output, first['css/app.css']['file']))
+    assert os.path.exists(os.path.join(output, second['css/app.css']['file']))
+    assert json.loads(read(output, ASSET_MANIFEST_NAME))['assets'] == second
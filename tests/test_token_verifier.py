@@ -0,0 +1,64 @@
+import pytest
+from fake_keycloak import FakeKeycloak
+from token_verifier import JWKSTokenVerifier, TokenVerificationError
+
+
+@pytest.fixture
+def keycloak():
+    fake = FakeKeycloak().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def verifier(keycloak):
+    return JWKSTokenVerifier(keycloak.url, keycloak.realm, audience='myclient', min_refresh_interval=0)
+
+
+def test_valid_token_returns_profile(keycloak, verifier):
+    profile = verifier.get_profile(keycloak.issue_token('user-1', email='user-1@example.com'))
+    assert profile['sub'] == 'user-1'
+    assert profile['email'] == 'user-1@example.com'
+    assert 'exp' not in profile and 'typ' not in profile
+
+
+def test_expired_token_is_rejected(keycloak, verifier):
+    with pytest.raises(TokenVerificationError, match='expired'):
+        verifier.verify(keycloak.issue_token('user-1', lifetime=-60))
+
+
+def test_wrong_issuer_is_rejected(keycloak, verifier):
+    with pytest.raises(TokenVerificationError, match='issuer'):
+        verifier.verify(keycloak.issue_token('user-1', iss=f"{keycloak.url}/realms/other"))
+
+
+def test_token_for_another_client_is_rejected(keycloak, verifier):
+    with pytest.raises(TokenVerificationError, match='audience'):
+        verifier.verify(keycloak.issue_token('user-1', audience='account', azp='other-client'))
+
+
+def test_audience_may_come_from_aud(keycloak, verifier):
+    assert verifier.verify(keycloak.issue_token('user-1', audience=['myclient'], azp='other-client'))['sub'] == 'user-1'
+
+
+def test_id_token_is_rejected(keycloak, verifier):
+    with pytest.raises(TokenVerificationError, match='access token'):
+        verifier.verify(keycloak.issue_token('user-1', audience='myclient', typ='ID'))
+
+
+def test_unknown_kid_refreshes_keys(keycloak, verifier):
+    verifier.verify(keycloak.issue_token('user-1'))
+    keycloak.rotate_key()
+    requests_before = keycloak.request_count
+    assert verifier.verify(keycloak.issue_token('user-2'))['sub'] == 'user-2'
+    assert keycloak.request_count == requests_before + 1
+
+
+def test_unknown_kid_refresh_is_rate_limited(keycloak):
+    verifier = JWKSTokenVerifier(keycloak.url, keycloak.realm, audience='myclient', min_refresh_interval=60)
+    verifier.verify(keycloak.issue_token('user-1'))
+    keycloak.rotate_key()
+    requests_before = keycloak.request_count
+    with pytest.raises(TokenVerificationError, match='Unknown signing key'):
+        verifier.verify(keycloak.issue_token('user-2'))
+    assert keycloak.request_count == requests_before
@@ -0,0 +1,98 @@
+import pytest
+from usage_meter import QuotaExceeded, UsageMeter
+
+CLAIMS = {'aiToken': '100', 'usedStorage': '50'}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'usage_meter.db')
+
+
+@pytest.fixture
+def meter(path):
+    meter = UsageMeter(path)
+    yield meter
+    meter.close()
+
+
+def test_quota_is_enforced(meter):
+    meter.record('user-1', CLAIMS, ai_tokens=100)
+    with pytest.raises(QuotaExceeded) as error:
+        meter.record('user-1', CLAIMS, ai_tokens=1)
+    assert error.value.resource == 'ai_tokens' and error.value.used == 100
+    assert meter.usage('user-1') == {'ai_tokens': 100, 'storage': 0}
+
+
+def test_rejected_call_records_nothing(meter):
+    with pytest.raises(QuotaExceeded):
+        meter.record('user-1', CLAIMS, ai_tokens=10, storage=51)
+    assert meter.usage('user-1') == {'ai_tokens': 0, 'storage': 0}
+
+
+def test_negative_usage_is_rejected(meter):
+    meter.record('user-1', CLAIMS, storage=50)
+    with pytest.raises(ValueError):
+        meter.record('user-1', CLAIMS, storage=-50)
+    with pytest.raises(ValueError):
+        meter.record('user-1', CLAIMS, ai_tokens=-1)
+    assert meter.usage('user-1')['storage'] == 50
+
+
+def test_storage_is_released_explicitly(meter):
+    meter.record('user-1', CLAIMS, ai_tokens=5, storage=50)
+    assert meter.release_storage('user-1', 80) == {'ai_tokens': 5, 'storage': 0}
+    meter.record('user-1', CLAIMS, storage=50)
+    with pytest.raises(ValueError):
+        meter.release_storage('user-1', 0)
+
+
+def test_quota_is_shared_between_processes(path):
+    meters = [UsageMeter(path), UsageMeter(path)]
+    accepted = 0
+    for i in range(150):
+        try:
+            meters[i % 2].record('user-1', CLAIMS, ai_tokens=1)
+            accepted += 1
+        except QuotaExceeded:
+            pass
+    assert accepted == 100
+    for meter in meters:
+        meter.close()
+
+
+class Recorder:
+    # Stands in for BulkClaimUpdater.run(), collecting what each flush would write
+    def __init__(self):
+        self.writes = []
+
+    def run(self, items):
+        self.writes.append(dict(items))
+        return type('Result', (), {'succeeded': len(self.writes[-1]), 'failures': {}})()
+
+
+def test_counter_is_seeded_once_from_keycloak(path):
+    seeded = []
+    meter = UsageMeter(path, seed=lambda user_id: seeded.append(user_id) or {'ai_tokens': 90, 'storage': 10})
+    meter.record('user-1', CLAIMS, ai_tokens=5)
+    with pytest.raises(QuotaExceeded):
+        meter.record('user-1', CLAIMS, ai_tokens=6)
+    assert seeded == ['user-1']
+    assert meter.usage('user-1') == {'ai_tokens': 95, 'storage': 10}
+    meter.close()
+
+
+def test_flush_writes_deltas_not_totals(path):
+    meter = UsageMeter(path, seed=lambda user_id: {'ai_tokens': 40, 'storage': 20})
+    updater = Recorder()
+    meter.record('user-1', CLAIMS, ai_tokens=10, storage=5)
+    meter.flush(updater)
+    meter.record('user-1', CLAIMS, ai_tokens=3)
+    meter.release_storage('user-1', 15)
+    meter.flush(updater)
+    meter.flush(updater)
+    assert updater.writes == [
+        {'user-1': {'ai_tokens': 10, 'storage': 5}},
+        {'user-1': {'ai_tokens': 3, 'storage': -15}}
+    ]
+    meter.close()
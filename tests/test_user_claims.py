@@ -0,0 +1,53 @@
+import pytest
+import payment_gateway_server as gateway
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+
+
+@pytest.fixture
+def keycloak(monkeypatch):
+    fake = FakeKeycloak().start()
+    client = KeycloakAdminClient(fake.url, fake.realm, client_id='gateway', client_secret='secret')
+    monkeypatch.setattr(gateway.get_admin_client, 'instance', client)
+    yield fake
+    client.close()
+    fake.stop()
+
+
+def test_unknown_top_level_fields_are_ignored(keycloak):
+    user_id = keycloak.add_user('alice', attributes={'tier': ['basic']})
+    assert gateway.admin_client.put(f"/users/{user_id}", json={'tier': 'pro', 'email': 'a@example.com'}).status_code == 204
+    assert 'tier' not in keycloak.users[user_id]
+    assert keycloak.users[user_id]['email'] == 'a@example.com'
+
+
+def test_claims_are_written_as_attributes(keycloak):
+    user_id = keycloak.add_user('alice', attributes={'locale': ['en']})
+    claims = {'tier': 'sub_123', 'ai_tokens': 1000, 'storage': 500, 'expiration_date': '2030-01-01T00:00:00'}
+    assert gateway.update_user_claims(user_id, claims)
+    assert keycloak.users[user_id]['attributes'] == {
+        'locale': ['en'], 'tier': ['sub_123'], 'aiToken': ['1000'], 'usedStorage': ['500'],
+        'expiration_date': ['2030-01-01T00:00:00']
+    }
+
+
+def test_expired_claims_clear_the_subscription(keycloak):
+    user_id = keycloak.add_user('alice', attributes={'tier': ['basic'], 'aiToken': ['1000'], 'expiration_date': ['2020-01-01']})
+    assert gateway.update_user_claims(user_id, gateway.EXPIRED_CLAIMS)
+    assert keycloak.users[user_id]['attributes'] == {'aiToken': ['0'], 'usedStorage': ['0']}
+
+
+def test_missing_user_is_a_failure(keycloak):
+    assert not gateway.update_user_claims('missing', gateway.EXPIRED_CLAIMS)
+
+
+def test_usage_is_read_from_attributes(keycloak):
+    user_id = keycloak.add_user('alice', attributes={'aiTokenUsed': ['70'], 'usedStorageUsed': ['not a number']})
+    assert gateway.read_usage(user_id) == {'ai_tokens': 70, 'storage': 0}
+    assert gateway.read_usage('missing') is None
+
+
+def test_usage_deltas_are_added_to_keycloak(keycloak):
+    user_id = keycloak.add_user('alice', attributes={'tier': ['basic'], 'aiTokenUsed': ['70'], 'usedStorageUsed': ['10']})
+    assert gateway.write_usage(user_id, {'ai_tokens': 5, 'storage': -20})
+    assert keycloak.users[user_id]['attributes'] == {'tier': ['basic'], 'aiTokenUsed': ['75'], 'usedStorageUsed': ['0']}
@@ -0,0 +1,75 @@
+import json
+import pytest
+import tier_catalog
+from fake_keycloak import FakeKeycloak
+from keycloak_admin_client import KeycloakAdminClient
+from user_import import BulkUserImporter, UserImportError
+
+# Positions of the records user_representation() rejects
+INVALID = {7: '{"username": "user-7", "tier": "platinum"}', 13: '{"email": "nobody@example.com"}', 22: '{"username": '}
+
+
+class OutageAfter:
+    # Lets the first `writes` admin writes through, then makes the fake fail every write like a Keycloak outage
+    def __init__(self, client, keycloak, writes):
+        self.client = client
+        self.keycloak = keycloak
+        self.writes = writes
+
+    def post(self, path, **kwargs):
+        if self.writes == 0:
+            self.keycloak.fail_writes_with = 503
+        self.writes -= 1
+        return self.client.post(path, **kwargs)
+
+
+@pytest.fixture
+def keycloak():
+    fake = FakeKeycloak().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def client(keycloak):
+    client = KeycloakAdminClient(keycloak.url, keycloak.realm, client_id='admin-cli', client_secret='secret',
+                                 backoff_factor=0, max_retries=1)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'users.jsonl'
+    with open(path, 'w') as file:
+        for position in range(30):
+            file.write(INVALID.get(position, json.dumps({'username': f"user-{position}", 'tier': 'free'})) + '\n')
+    return str(path)
+
+
+def importer(admin_client):
+    tiers = tier_catalog.group_attributes(tier_catalog.load_catalog())
+    return BulkUserImporter(admin_client, tiers, batch_size=5, workers=1)
+
+
+def test_interrupted_import_resumes_without_duplicates(keycloak, client, source):
+    with pytest.raises(UserImportError, match='resume from record 10'):
+        importer(OutageAfter(client, keycloak, writes=2)).run(source)
+    assert len(keycloak.users) == 9
+
+    keycloak.fail_writes_with = None
+    stats = importer(client).run(source)
+    assert stats['resumed_from'] == 10
+    assert (stats['imported'], stats['skipped'], stats['rejected']) == (27, 0, 3)
+
+    usernames = [user['username'] for user in keycloak.users.values()]
+    assert sorted(usernames) == sorted(f"user-{position}" for position in range(30) if position not in INVALID)
+    with open(f"{source}.rejects.jsonl") as file:
+        assert sorted(json.loads(line)['position'] for line in file) == sorted(INVALID)
+
+
+def test_finished_import_starts_over(keycloak, client, source):
+    importer(client).run(source)
+    stats = importer(client).run(source)
+    assert stats['resumed_from'] == 0
+    assert (stats['imported'], stats['skipped']) == (0, 27)
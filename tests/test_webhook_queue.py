@@ -0,0 +1,39 @@
+import pytest
+from webhook_queue import DEAD, WebhookQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WebhookQueue(str(tmp_path / 'webhook_queue.db'), max_attempts=2, visibility_timeout=-1)
+    yield queue
+    queue.close()
+
+
+def test_duplicate_event_is_dropped(queue):
+    assert queue.enqueue('evt_1', 'checkout.session.completed', '{}')
+    assert not queue.enqueue('evt_1', 'checkout.session.completed', '{}')
+
+
+def test_stale_claim_is_reclaimed(queue):
+    queue.enqueue('evt_1', 'checkout.session.completed', '{"id": "evt_1"}')
+    first = queue.claim()
+    # The worker that claimed it never completes; the claim has already timed out
+    second = queue.claim()
+    assert second['id'] == 'evt_1'
+    assert second['attempts'] == first['attempts'] + 1
+
+
+def test_claim_is_not_reclaimed_before_timeout(tmp_path):
+    queue = WebhookQueue(str(tmp_path / 'webhook_queue.db'), visibility_timeout=300)
+    queue.enqueue('evt_1', 'checkout.session.completed', '{}')
+    assert queue.claim()['id'] == 'evt_1'
+    assert queue.claim() is None
+    queue.close()
+
+
+def test_repeatedly_timed_out_event_is_dead_lettered(queue):
+    queue.enqueue('evt_1', 'checkout.session.completed', '{}')
+    queue.claim()
+    queue.claim()
+    assert queue.claim() is None
+    assert queue.stats()[DEAD] == 1
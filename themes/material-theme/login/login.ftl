@@ -14,11 +14,11 @@
       document.getElementById('theme-style').setAttribute('href', 'css/dark-styles.css');
     }
   </script>
-<style>body{background-color:#fff;color:#000;font-family:-apple-system,BlinkMacSystemFont,Segoe UI,Roboto,Helvetica Neue,Arial,sans-serif}</style><link rel="stylesheet" href="styles-Z3IZGFQL.css" media="print" onload="this.media='all'"><noscript><link rel="stylesheet" href="styles-Z3IZGFQL.css"></noscript></head>
+<style>body{background-color:#fff;color:#000;font-family:-apple-system,BlinkMacSystemFont,Segoe UI,Roboto,Helvetica Neue,Arial,sans-serif}</style><link rel="stylesheet" href="css/styles-Z3IZGFQL.css" media="print" onload="this.media='all'"><noscript><link rel="stylesheet" href="css/styles-Z3IZGFQL.css"></noscript></head>
 <body>
   <app-root></app-root>
   <script src="js/runtime.js"></script>
   <script src="js/polyfills.js"></script>
   <script src="js/main.js"></script>
-<script src="polyfills-6EAL64PA.js" type="module"></script><script src="main-YT3QVHDC.js" type="module"></script></body>
+<script src="js/polyfills-6EAL64PA.js" type="module"></script><script src="js/main-YT3QVHDC.js" type="module"></script></body>
 </html>